@@ -0,0 +1 @@
+# Can be empty
@@ -0,0 +1,107 @@
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Set, TypeVar
+from sqlmodel import Session, select
+
+from messaging_manager.libs.database_models import UnifiedMessageFormat
+from messaging_manager.libs.bulk import bulk_insert_ignore
+from messaging_manager.libs.media_store import MediaStore
+from messaging_manager.libs.writing_samples import WritingSampleIndex
+from messaging_manager.libs.graph_index import GraphIndex
+from messaging_manager.libs.work_queue import DraftWorkQueue
+from messaging_manager.libs.email_threading import EmailThreadIndex
+
+T = TypeVar("T")
+
+# messages per commit
+IMPORT_BATCH_SIZE = 1000
+# conversations whose newest imported message is older than this aren't queued for drafting
+QUEUE_RECENT_DAYS = 7
+
+
+def iter_chunks(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+def to_utc(timestamp: datetime) -> datetime:
+    # naive timestamps are compared as utc, same as the mappers' cursors
+    return timestamp.replace(tzinfo=timezone.utc) if timestamp.tzinfo is None else timestamp
+
+
+class MessageImporter:
+    """
+    Writes imported history the way the pull loop writes fetched messages: email threading, bulk
+    inserts that skip messages already stored, media references, writing samples and the graph, one
+    commit per batch.
+
+    Imports are mostly years old, so instead of queueing every conversation for drafting only the
+    ones that got a message in the last queue_recent_days are queued, once the import is done.
+    """
+
+    def __init__(self, db_engine, media_dir: str, queue_recent_days: float = QUEUE_RECENT_DAYS):
+        self.db_engine = db_engine
+        self.media_store = MediaStore(media_dir)
+        self.writing_samples = WritingSampleIndex(db_engine)
+        self.graph_index = GraphIndex(db_engine)
+        self.work_queue = DraftWorkQueue(db_engine)
+        self.thread_index = EmailThreadIndex()
+        self.queue_after = datetime.now(timezone.utc) - timedelta(days=queue_recent_days)
+        self.recent_source_ids: Set[str] = set()
+        self.imported = 0
+        self.skipped = 0
+
+    def get_existing_ids(self, message_ids: List[str]) -> Set[str]:
+        """ids already stored, so a re-import doesn't copy their media again"""
+        if len(message_ids) == 0:
+            return set()
+        with Session(self.db_engine) as session:
+            return set(session.exec(select(UnifiedMessageFormat.message_id)
+                                    .where(UnifiedMessageFormat.message_id.in_(message_ids))).all())
+
+    def write(self, messages: List[UnifiedMessageFormat]) -> int:
+        """stores one batch, returns the number of new messages"""
+        messages_by_id: Dict[str, UnifiedMessageFormat] = {}
+        for message in messages:
+            messages_by_id.setdefault(message.message_id, message)
+
+        # a first load backfills through a session of its own, so it has to happen before this one takes the write lock
+        if not self.writing_samples.loaded:
+            self.writing_samples.load()
+        if not self.graph_index.loaded:
+            self.graph_index.load()
+        with Session(self.db_engine) as session:
+            existing_message_ids = set(session.exec(select(UnifiedMessageFormat.message_id)
+                                                    .where(UnifiedMessageFormat.message_id.in_(list(messages_by_id)))).all())
+            new_messages = [message for message_id, message in messages_by_id.items() if message_id not in existing_message_ids]
+            self.thread_index.assign(session, new_messages)
+
+            stored_at = datetime.now()
+            for message in new_messages:
+                message.created_at = stored_at
+            bulk_insert_ignore(session, UnifiedMessageFormat.__table__,
+                               [message.model_dump() for message in new_messages])
+            self.media_store.add_references(session, new_messages)
+            self.writing_samples.add_messages(session, new_messages)
+            self.graph_index.add_messages(session, new_messages)
+            session.commit()
+
+        for message in new_messages:
+            if to_utc(message.message_timestamp) >= self.queue_after:
+                self.recent_source_ids.add(message.source_id)
+        self.imported += len(new_messages)
+        self.skipped += len(messages) - len(new_messages)
+        print(f"Imported {self.imported} messages, {self.skipped} already stored")
+        return len(new_messages)
+
+    def finish(self) -> int:
+        """queues the recently active conversations for drafting, returns how many"""
+        with Session(self.db_engine) as session:
+            self.work_queue.mark_dirty(session, self.recent_source_ids)
+            session.commit()
+        return len(self.recent_source_ids)
@@ -0,0 +1,154 @@
+"""
+Imports a Google Takeout mbox archive.
+
+python -m messaging_manager.importers.mbox "All mail Including Spam and Trash.mbox" --email me@gmail.com
+
+Emails are parsed like the gmail mapper parses them, so they get the same ids and land in the
+same conversations as the ones it fetches, importing mail that was already pulled adds nothing.
+"""
+import os
+import re
+import email.parser
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Iterator, List, Optional, Tuple
+
+from messaging_manager.libs.database import get_engine
+from messaging_manager.libs.media_store import MEDIA_DIR
+from messaging_manager.libs.accounts import load_accounts_config
+from messaging_manager.libs.service_mapper_interface import get_account_service_name
+from messaging_manager.libs.email_parsing import parse_email, build_email_message, SENT_BOX, INBOX
+from messaging_manager.importers.common import MessageImporter, IMPORT_BATCH_SIZE, QUEUE_RECENT_DAYS
+
+# raw bytes handed to the parsing processes at once, next to the message count of a batch
+MAX_BATCH_BYTES = 64 * 1024 * 1024
+# takeout labels of mail the gmail mapper never sees
+SKIPPED_LABELS = {"Spam", "Trash", "Draft", "Drafts", "Chat"}
+
+MBOXRD_FROM = re.compile(rb"^>+From ")
+
+
+def iter_mbox(path: str) -> Iterator[bytes]:
+    """
+    raw emails of an mbox file one at a time, mailbox.mbox would index the whole file first.
+    lines get \\r\\n endings like emails fetched over imap, so the text is stripped the same way
+    """
+    lines = []
+    with open(path, "rb") as f:
+        for line in f:
+            if line.startswith(b"From "):
+                if len(lines) > 0:
+                    yield b"".join(lines)
+                lines = []
+                continue
+            if MBOXRD_FROM.match(line):
+                line = line[1:]
+            lines.append(line.rstrip(b"\r\n") + b"\r\n")
+    if len(lines) > 0:
+        yield b"".join(lines)
+
+
+def iter_batches(raw_emails: Iterator[bytes], batch_size: int, max_bytes: int = MAX_BATCH_BYTES) -> Iterator[List[bytes]]:
+    batch = []
+    size = 0
+    for raw_email in raw_emails:
+        batch.append(raw_email)
+        size += len(raw_email)
+        if len(batch) >= batch_size or size >= max_bytes:
+            yield batch
+            batch = []
+            size = 0
+    if len(batch) > 0:
+        yield batch
+
+
+def get_box(labels: Optional[str]) -> Optional[str]:
+    """the folder the gmail mapper would have fetched the email from, None to skip it"""
+    labels = {label.strip() for label in (labels or "").split(",")}
+    if len(labels & SKIPPED_LABELS) > 0:
+        return None
+    if "Sent" in labels:
+        return SENT_BOX
+    # archived mail is imported with the inbox, it is part of the same conversations
+    return INBOX
+
+
+def parse_mbox_email(raw_email: bytes, own_email: str, account_id: Optional[str] = None) -> Optional[Tuple[dict, List[Tuple[str, bytes]]]]:
+    """runs in the parsing processes, None for skipped or broken emails"""
+    try:
+        headers = email.parser.BytesHeaderParser().parsebytes(raw_email)
+        box = get_box(headers["X-Gmail-Labels"])
+        if box is None:
+            return None
+        return parse_email(raw_email, box, own_email, account_id)
+    except Exception as e:
+        print(f"Error parsing email: {str(e)}")
+        return None
+
+
+def write_parsed(importer: MessageImporter, service_name: str, parsed) -> int:
+    parsed = [item for item in parsed if item is not None]
+    existing_ids = importer.get_existing_ids([record["message_id"] for record, _ in parsed])
+    messages = []
+    for record, attachments in parsed:
+        file_paths = []
+        if record["message_id"] not in existing_ids:
+            file_paths = [importer.media_store.put_bytes(payload, filename) for filename, payload in attachments]
+        messages.append(build_email_message(record, service_name, file_paths))
+    return importer.write(messages)
+
+
+def import_mbox(path: str, own_email: str, account_id: Optional[str] = None, media_dir: str = MEDIA_DIR,
+                workers: Optional[int] = None, batch_size: int = IMPORT_BATCH_SIZE,
+                queue_recent_days: float = QUEUE_RECENT_DAYS) -> int:
+    """returns the number of new messages"""
+    importer = MessageImporter(get_engine(media_dir), media_dir, queue_recent_days)
+    service_name = get_account_service_name("email", account_id)
+    parse = partial(parse_mbox_email, own_email=own_email, account_id=account_id)
+    workers = workers or os.cpu_count() or 1
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for batch in iter_batches(iter_mbox(path), batch_size):
+            # map keeps the order, the next batch is parsed while the previous one is written
+            pending.append(executor.map(parse, batch, chunksize=max(1, len(batch) // (4 * workers))))
+            if len(pending) > 1:
+                write_parsed(importer, service_name, pending.popleft())
+        while len(pending) > 0:
+            write_parsed(importer, service_name, pending.popleft())
+
+    queued = importer.finish()
+    print(f"Imported {importer.imported} new messages from {path}, {queued} recent conversations queued for drafting")
+    return importer.imported
+
+
+def get_account_email(account_id: Optional[str]) -> Optional[str]:
+    if account_id is None:
+        import dotenv
+        dotenv.load_dotenv()
+        return os.getenv("GMAIL_EMAIL")
+    accounts_config = load_accounts_config()
+    for account in (accounts_config.accounts if accounts_config else []):
+        if account.account_id == account_id:
+            return account.init_keys.get("email")
+    return None
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Import a Google Takeout mbox archive")
+    parser.add_argument("mbox_path")
+    parser.add_argument("--email", help="Address of the account, defaults to its email in accounts.json or GMAIL_EMAIL")
+    parser.add_argument("--account_id", help="Account in accounts.json the archive belongs to, leave out for the .env account")
+    parser.add_argument("--media_dir", default=MEDIA_DIR)
+    parser.add_argument("--workers", type=int, help="Parsing processes, defaults to the number of cpus")
+    parser.add_argument("--batch_size", type=int, default=IMPORT_BATCH_SIZE, help="Emails per commit")
+    parser.add_argument("--queue_recent_days", type=float, default=QUEUE_RECENT_DAYS,
+                        help="Conversations active in this many days are queued for drafting")
+    args = parser.parse_args()
+
+    own_email = args.email or get_account_email(args.account_id)
+    if not own_email:
+        parser.error("--email is required when the account's address isn't configured")
+    import_mbox(args.mbox_path, own_email, args.account_id, args.media_dir, args.workers, args.batch_size, args.queue_recent_days)
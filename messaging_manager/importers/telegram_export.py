@@ -0,0 +1,139 @@
+"""
+Imports a Telegram Desktop export, Settings > Advanced > Export Telegram data with the JSON format.
+
+python -m messaging_manager.importers.telegram_export ~/Downloads/Telegram\\ Desktop/DataExport/result.json
+
+Private chats get the same ids and source ids as the telegram mapper gives them, so the import and
+live polling fill the same conversations. Both a full export and a single chat export work.
+result.json is read into memory as a whole, messages and media are written in batches. For an export
+larger than the available memory, export the big chats one at a time and import those.
+"""
+import os
+import json
+import hashlib
+from datetime import datetime, timezone
+from typing import Iterator, Optional, Tuple
+
+from messaging_manager.libs.database import get_engine
+from messaging_manager.libs.media_store import MEDIA_DIR
+from messaging_manager.libs.service_mapper_interface import UnifiedMessageFormat, get_source_id
+from messaging_manager.libs.service_mapper_interface import get_account_service_name, get_account_scoped_key
+from messaging_manager.importers.common import MessageImporter, iter_chunks, IMPORT_BATCH_SIZE, QUEUE_RECENT_DAYS
+
+# the media_type source key the telegram mapper stores, str() of the telethon media class
+MEDIA_TYPES = {
+    "photo": "<class 'telethon.tl.types.MessageMediaPhoto'>",
+    "file": "<class 'telethon.tl.types.MessageMediaDocument'>",
+}
+
+
+def iter_chats(export: dict) -> Iterator[dict]:
+    """the private chats of a full or a single chat export, the mapper only reads those"""
+    chats = export["chats"]["list"] if "chats" in export else [export]
+    for chat in chats:
+        if chat.get("type") == "personal_chat":
+            yield chat
+
+
+def get_text(message: dict) -> str:
+    # formatted text is a list of plain strings and entities
+    if "text_entities" in message:
+        return "".join(entity.get("text", "") for entity in message["text_entities"])
+    text = message.get("text", "")
+    if isinstance(text, list):
+        return "".join(part if isinstance(part, str) else part.get("text", "") for part in text)
+    return text
+
+
+def get_timestamp(message: dict) -> datetime:
+    if "date_unixtime" in message:
+        return datetime.fromtimestamp(int(message["date_unixtime"]), tz=timezone.utc)
+    # older exports only have the local time
+    return datetime.fromisoformat(message["date"])
+
+
+def get_media(message: dict) -> Optional[Tuple[str, str]]:
+    """(media_type, path relative to the export), None without media"""
+    for key in ("photo", "file"):
+        if key in message:
+            return MEDIA_TYPES[key], message[key]
+    return None
+
+
+def to_unified_message(chat: dict, message: dict, service_name: str, account_id: Optional[str]) -> UnifiedMessageFormat:
+    peer_id = int(chat["id"])
+    # from_id looks like user123456
+    from_id = int("".join(c for c in message.get("from_id", "") if c.isdigit()) or peer_id)
+    source_keys = {"peer_id": str(peer_id), "message_id": str(message["id"])}
+
+    media = get_media(message)
+    if media is not None:
+        source_keys["media_type"] = media[0]
+
+    source_id = get_source_id(peer_id)
+    if account_id is not None:
+        source_id = get_source_id([account_id, peer_id])
+    return UnifiedMessageFormat(
+        message_id=hashlib.sha256(get_account_scoped_key(str(message["id"]) + "telegram", account_id).encode()).hexdigest(),
+        service_name=service_name,
+        source_id=source_id,
+        source_keys=source_keys,
+        message_content=get_text(message),
+        sender_id=str(from_id),
+        # a private chat has two parties, anyone but the peer is the exporting user
+        sender_name="user" if from_id != peer_id else (chat.get("name") or "Unknown"),
+        message_timestamp=get_timestamp(message),
+        file_paths=[]
+    )
+
+
+def import_telegram_export(path: str, account_id: Optional[str] = None, media_dir: str = MEDIA_DIR,
+                           batch_size: int = IMPORT_BATCH_SIZE, queue_recent_days: float = QUEUE_RECENT_DAYS) -> int:
+    """returns the number of new messages"""
+    importer = MessageImporter(get_engine(media_dir), media_dir, queue_recent_days)
+    service_name = get_account_service_name("telegram", account_id)
+    export_dir = os.path.dirname(os.path.abspath(path))
+
+    # the whole export is parsed at once, the stdlib has no incremental json reader
+    with open(path, "r", encoding="utf-8") as f:
+        export = json.load(f)
+
+    def iter_messages():
+        for chat in iter_chats(export):
+            for message in chat.get("messages", []):
+                # service messages are joins, calls and the like
+                if message.get("type") == "message":
+                    yield chat, message
+
+    for batch in iter_chunks(iter_messages(), batch_size):
+        messages = [to_unified_message(chat, message, service_name, account_id) for chat, message in batch]
+        existing_ids = importer.get_existing_ids([message.message_id for message in messages])
+        for (chat, message), unified_message in zip(batch, messages):
+            media = get_media(message)
+            if unified_message.message_id in existing_ids or media is None:
+                continue
+            # files left out of the export are just a note in place of the path
+            media_path = os.path.join(export_dir, media[1])
+            if os.path.isfile(media_path):
+                unified_message.file_paths = [importer.media_store.put_file(media_path)]
+        importer.write(messages)
+
+    queued = importer.finish()
+    print(f"Imported {importer.imported} new messages from {path}, {queued} recent conversations queued for drafting")
+    return importer.imported
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Import a Telegram Desktop JSON export",
+                                     epilog="result.json is loaded into memory whole, needing a few times its size in RAM. "
+                                            "Split an export that doesn't fit into single chat exports.")
+    parser.add_argument("export_path", help="result.json of the export, read into memory whole")
+    parser.add_argument("--account_id", help="Account in accounts.json the export belongs to, leave out for the .env account")
+    parser.add_argument("--media_dir", default=MEDIA_DIR)
+    parser.add_argument("--batch_size", type=int, default=IMPORT_BATCH_SIZE, help="Messages per commit")
+    parser.add_argument("--queue_recent_days", type=float, default=QUEUE_RECENT_DAYS,
+                        help="Conversations active in this many days are queued for drafting")
+    args = parser.parse_args()
+
+    import_telegram_export(args.export_path, args.account_id, args.media_dir, args.batch_size, args.queue_recent_days)
@@ -0,0 +1,41 @@
+import os
+from typing import Any, Dict, List, Optional
+from pydantic import BaseModel
+
+ACCOUNTS_CONFIG_PATH = "accounts.json"
+SERVICE_TYPES = ["gmail", "telegram"]
+
+
+class AccountConfig(BaseModel):
+    # short stable name, part of every id and service name of the account, don't rename it
+    account_id: str
+    service: str # one of SERVICE_TYPES
+    # the mapper's init_keys, e.g. email and credentials_file_path, or api_id, api_hash and session_name
+    init_keys: Dict[str, Any] = {}
+    # operations on this account that may run at once, one connection per mapper so 1 is safest
+    max_concurrency: int = 1
+    enabled: bool = True
+
+class AccountsConfig(BaseModel):
+    # accounts polled at once across the deployment
+    max_concurrency: int = 4
+    accounts: List[AccountConfig] = []
+
+
+def load_accounts_config(path: str = ACCOUNTS_CONFIG_PATH) -> Optional[AccountsConfig]:
+    """reads the accounts json, None when there is no file and the single .env account is used"""
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        config = AccountsConfig.model_validate_json(f.read())
+
+    seen = set()
+    for account in config.accounts:
+        if account.service not in SERVICE_TYPES:
+            raise ValueError(f"Unknown service {account.service} for account {account.account_id}, use one of {', '.join(SERVICE_TYPES)}")
+        if account.account_id in seen:
+            raise ValueError(f"Duplicate account id: {account.account_id}")
+        if ":" in account.account_id or "/" in account.account_id:
+            raise ValueError(f"Account ids can't contain ':' or '/': {account.account_id}")
+        seen.add(account.account_id)
+    return config
@@ -0,0 +1,57 @@
+import asyncio
+from collections import deque
+from typing import Any, Optional
+
+
+class BoundedBuffer:
+    """
+    Queue between two pipeline stages, sized in messages rather than items.
+
+    put() blocks once high_watermark messages are buffered and stays blocked until the consumer
+    has drained the buffer down to low_watermark, so a fast producer is paused for a while
+    instead of waking for every single batch. close() lets the consumer finish what is buffered,
+    get() then returns None.
+    """
+
+    def __init__(self, high_watermark: int = 1000, low_watermark: int = 250):
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.items = deque()
+        self.size = 0
+        self.paused = False
+        self.closed = False
+        self.changed = asyncio.Condition()
+        # reported in pipeline progress
+        self.peak_size = 0
+        self.pauses = 0
+
+    async def put(self, item: Any, size: int):
+        async with self.changed:
+            await self.changed.wait_for(lambda: not self.paused)
+            self.items.append((item, size))
+            self.size += size
+            self.peak_size = max(self.peak_size, self.size)
+            if self.size >= self.high_watermark:
+                self.paused = True
+                self.pauses += 1
+            self.changed.notify_all()
+
+    async def get(self) -> Optional[Any]:
+        async with self.changed:
+            await self.changed.wait_for(lambda: len(self.items) > 0 or self.closed)
+            if len(self.items) == 0:
+                return None
+            item, size = self.items.popleft()
+            self.size -= size
+            if self.paused and self.size <= self.low_watermark:
+                self.paused = False
+            self.changed.notify_all()
+            return item
+
+    def empty(self) -> bool:
+        return len(self.items) == 0
+
+    async def close(self):
+        async with self.changed:
+            self.closed = True
+            self.changed.notify_all()
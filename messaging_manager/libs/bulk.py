@@ -0,0 +1,37 @@
+from typing import Iterator, List
+
+
+def get_dialect_name(connection) -> str:
+    """dialect of a Connection, Engine or Session"""
+    if hasattr(connection, "dialect"):
+        return connection.dialect.name
+    return connection.get_bind().dialect.name
+
+def dialect_insert(dialect_name: str, table):
+    """INSERT of sqlite or postgresql, both support on_conflict_do_nothing and on_conflict_do_update"""
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+def insert_ignore(dialect_name: str, table):
+    """INSERT that skips rows whose primary key already exists, on sqlite and postgresql"""
+    return dialect_insert(dialect_name, table).on_conflict_do_nothing()
+
+def bulk_insert_ignore(connection, table, rows: List[dict], batch_size: int = 500):
+    """executemany inserts in batches, works with a Connection or a Session"""
+    if len(rows) == 0:
+        return
+    statement = insert_ignore(get_dialect_name(connection), table)
+    for start in range(0, len(rows), batch_size):
+        connection.execute(statement, rows[start:start + batch_size])
+
+def iter_batches(session, statement, batch_size: int = 1000) -> Iterator[list]:
+    """
+    Streams a large select in batches instead of loading it all at once.
+    yield_per turns on server side cursors on postgresql, on sqlite rows are fetched incrementally.
+    """
+    result = session.exec(statement.execution_options(yield_per=batch_size))
+    for partition in result.partitions(batch_size):
+        yield list(partition)
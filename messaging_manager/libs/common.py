@@ -76,16 +76,20 @@ def call_ollama_vision(server_url, model,  messages, json_schema=None, temperatu
         print("~~~~~~~~~~~~~~~~~~~~~~~")
         return error
 def embed_with_ollama(server_url, text, model="nomic-embed-text"):
+    return embed_batch_with_ollama(server_url, [text], model=model)[0]
+
+def embed_batch_with_ollama(server_url, texts, model="nomic-embed-text"):
+    """embeds a list of texts in one request, returns one embedding per text in the same order"""
     client = Client(
         host=server_url
     )
 
     results = client.embed(
         model=model,
-        input=text
+        input=texts
     )
 
-    return results["embeddings"][0]
+    return results["embeddings"]
 
 class ToolCall(BaseModel):
     toolset_id: str
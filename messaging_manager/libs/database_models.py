@@ -1,12 +1,16 @@
 import uuid
 from typing import Optional, Dict, List
-from sqlmodel import Field, SQLModel, Column, JSON
+from sqlmodel import Field, SQLModel, Column, JSON, Index
 from datetime import datetime
 import json
 
 
 
 class UnifiedMessageFormat(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_unifiedmessageformat_service_name_message_timestamp", "service_name", "message_timestamp"),
+        Index("ix_unifiedmessageformat_source_id_message_timestamp", "source_id", "message_timestamp"),
+    )
     message_id: str = Field(default_factory=lambda: str(uuid.uuid4()), primary_key=True)
     service_name: str # the name of the service that the message is from
     source_id: str # the id of the source, this is a hash of the source_keys
@@ -16,20 +20,93 @@ class UnifiedMessageFormat(SQLModel, table=True):
     sender_name: str # the name of the sender at time of retrieval
     message_timestamp: datetime # the timestamp of the message
     file_paths: List[str] | None = Field(default=[], sa_column=Column(JSON)) # the paths to the files in the message
+    created_at: Optional[datetime] = Field(default_factory=datetime.now, index=True) # when the message was stored, None for messages stored before it was recorded
 
 
 class DraftResponse(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_draftresponse_status_updated_at", "status", "updated_at"),
+        Index("ix_draftresponse_source_id_created_at", "source_id", "created_at"),
+        Index("ix_draftresponse_status_created_at", "status", "created_at"),
+    )
     draft_response_id: str = Field(default_factory=lambda: str(uuid.uuid4()), primary_key=True)
-    messages: List[UnifiedMessageFormat] = Field(sa_column=Column(JSON))
+    # the messages the draft was written for are referenced through DraftMessageLink
     thoughts: str
     summary_of_chat: str
     reasoning_for_decision: str
     response_suggested: bool
     response: Optional[str] = None
-    status: str
+    status: str = Field(index=True)
+    source_id: Optional[str] = None # the conversation the draft was written for
+    created_at: Optional[datetime] = Field(default_factory=datetime.now)
+    updated_at: Optional[datetime] = Field(default_factory=datetime.now) # last status change
+
+
+class DraftMessageLink(SQLModel, table=True):
+    draft_response_id: str = Field(primary_key=True)
+    position: int = Field(primary_key=True) # the order of the message in the draft's conversation window
+    message_id: str = Field(index=True)
+
+
+class MediaObject(SQLModel, table=True):
+    content_hash: str = Field(primary_key=True) # sha256 of the file content
+    path: str # where the object lives in the media store
+    size: int
+    ref_count: int = Field(default=0, index=True) # number of messages that carry this file
+    created_at: datetime = Field(default_factory=datetime.now)
+    updated_at: datetime = Field(default_factory=datetime.now, index=True)
+
+
+class DraftQueueItem(SQLModel, table=True):
+    source_id: str = Field(primary_key=True) # a conversation with messages that have not been drafted yet
+    version: int = 1 # bumped whenever new messages arrive, a lease only completes the version it claimed
+    dirty_at: datetime = Field(default_factory=datetime.now)
+    leased_by: Optional[str] = None # worker id holding the lease
+    leased_version: Optional[int] = None
+    # the item can be claimed once this has passed, also used to delay retries after a failure
+    lease_expires_at: Optional[datetime] = Field(default=None, index=True)
+    attempts: int = 0
+
+
+class EmailThreadLink(SQLModel, table=True):
+    message_key: str = Field(primary_key=True) # service name and a Message-ID, of an email or of one an email references
+    source_id: str = Field(index=True) # the conversation of the thread
 
 
 class ServiceMetadata(SQLModel, table=True):
     service_id: str = Field(default_factory=lambda: str(uuid.uuid4()), primary_key=True)
     service_name: str # the name of the service
     init_keys: List[str] | None = Field(default=[], sa_column=Column(JSON)) # the keys that are needed to initialize the service
+
+
+class WritingSample(SQLModel, table=True):
+    message_id: str = Field(primary_key=True) # the id of the user's outgoing message
+    service_name: str = Field(index=True) # the service the message was sent through
+    recipient_id: str = Field(index=True) # the other party of the conversation
+    source_id: str # the conversation the message belongs to
+    message_content: str # the text the user wrote
+    message_timestamp: datetime # when the message was sent
+    created_at: datetime = Field(default_factory=datetime.now, index=True) # when the sample was stored, processes that don't ingest refresh from it
+
+
+class GraphNode(SQLModel, table=True):
+    node_id: str = Field(primary_key=True) # "<node_type>:<key>", e.g. "sender:email:bob@example.com"
+    node_type: str # sender, conversation or service
+    label: str # display name, the latest sender name for senders
+    updated_at: datetime = Field(default_factory=datetime.now, index=True) # processes that don't ingest refresh from it
+
+
+class GraphEdge(SQLModel, table=True):
+    edge_id: str = Field(primary_key=True) # "<source_node>|<target_node>"
+    source_node: str = Field(index=True)
+    target_node: str = Field(index=True)
+    interaction_count: int = 0 # number of messages that connected the two nodes
+    first_interaction: datetime
+    last_interaction: datetime
+    updated_at: datetime = Field(default_factory=datetime.now, index=True)
+
+
+class SchemaMigration(SQLModel, table=True):
+    version: int = Field(primary_key=True) # the migration number, applied in ascending order
+    name: str
+    applied_at: datetime
@@ -0,0 +1,99 @@
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+from pydantic import BaseModel
+from sqlalchemy import and_
+from sqlmodel import Session, select, func
+
+from messaging_manager.libs.database_models import UnifiedMessageFormat
+from messaging_manager.libs.graph_index import GraphIndex, to_epoch
+
+# conversations per scoring query when only some are scored
+SCORE_BATCH_SIZE = 500
+
+
+class DraftCandidate(BaseModel):
+    source_id: str
+    score: float
+    # None when the other party never wrote
+    last_inbound_timestamp: Optional[datetime]
+    # the other party spoke last, so a reply is owed
+    awaiting_reply: bool
+    importance: float
+
+
+class DraftPriority:
+    """
+    Orders conversations for drafting, most urgent first.
+
+    The score adds up recency of the last inbound message (halving every recency_half_life_hours),
+    whether the other party spoke last, and how important the other party is in the
+    contact graph, each scaled by its weight.
+    """
+
+    def __init__(self, recency_weight: float = 1.0, recency_half_life_hours: float = 24.0,
+                 awaiting_reply_weight: float = 1.0, importance_weight: float = 0.5):
+        self.recency_weight = recency_weight
+        self.recency_half_life_hours = recency_half_life_hours
+        self.awaiting_reply_weight = awaiting_reply_weight
+        self.importance_weight = importance_weight
+
+    def score(self, last_inbound_timestamp: Optional[datetime], awaiting_reply: bool, importance: float, now: float = None) -> float:
+        now = now or time.time()
+        recency = 0.0
+        if last_inbound_timestamp is not None:
+            age_hours = max(0.0, now - to_epoch(last_inbound_timestamp)) / 3600
+            recency = 0.5 ** (age_hours / self.recency_half_life_hours)
+        return (self.recency_weight * recency
+                + self.awaiting_reply_weight * (1.0 if awaiting_reply else 0.0)
+                + self.importance_weight * importance)
+
+    def get_queue(self, session: Session, graph_index: GraphIndex, now: float = None,
+                  source_ids: Optional[Iterable[str]] = None) -> List[DraftCandidate]:
+        """every conversation with its score, or only the ones in source_ids, highest first"""
+        candidates: Dict[str, DraftCandidate] = {}
+        if source_ids is None:
+            self._score(session, graph_index, None, now, candidates)
+        else:
+            # only the given conversations are read, through the (source_id, message_timestamp) index
+            source_ids = sorted(set(source_ids))
+            for start in range(0, len(source_ids), SCORE_BATCH_SIZE):
+                self._score(session, graph_index, source_ids[start:start + SCORE_BATCH_SIZE], now, candidates)
+        return sorted(candidates.values(), key=lambda candidate: candidate.score, reverse=True)
+
+    def _score(self, session: Session, graph_index: GraphIndex, source_ids: Optional[List[str]], now: Optional[float],
+               candidates: Dict[str, DraftCandidate]):
+        latest = (select(UnifiedMessageFormat.source_id,
+                         func.max(UnifiedMessageFormat.message_timestamp).label("last_timestamp"))
+                  .group_by(UnifiedMessageFormat.source_id))
+        inbound = (select(UnifiedMessageFormat.source_id, func.max(UnifiedMessageFormat.message_timestamp))
+                   .where(UnifiedMessageFormat.sender_name != "user")
+                   .group_by(UnifiedMessageFormat.source_id))
+        if source_ids is not None:
+            latest = latest.where(UnifiedMessageFormat.source_id.in_(source_ids))
+            inbound = inbound.where(UnifiedMessageFormat.source_id.in_(source_ids))
+        latest = latest.subquery()
+        # the last message of every conversation, served by the (source_id, message_timestamp) index
+        rows = session.exec(select(UnifiedMessageFormat.source_id, UnifiedMessageFormat.sender_name)
+                            .join(latest, and_(UnifiedMessageFormat.source_id == latest.c.source_id,
+                                               UnifiedMessageFormat.message_timestamp == latest.c.last_timestamp))).all()
+        last_inbound = dict(session.exec(inbound).all())
+
+        for source_id, sender_name in rows:
+            awaiting_reply = sender_name != "user"
+            # messages sharing the last timestamp, one from the other party is enough to owe a reply
+            if source_id in candidates and not awaiting_reply:
+                continue
+            importance = graph_index.conversation_importance(source_id)
+            last_inbound_timestamp = last_inbound.get(source_id)
+            candidates[source_id] = DraftCandidate(source_id=source_id,
+                                                   score=self.score(last_inbound_timestamp, awaiting_reply, importance, now),
+                                                   last_inbound_timestamp=last_inbound_timestamp,
+                                                   awaiting_reply=awaiting_reply,
+                                                   importance=importance)
+
+
+class DraftBudget(BaseModel):
+    """limits for one drafting pass, None means unlimited"""
+    max_drafts: Optional[int] = None
+    max_seconds: Optional[float] = None
@@ -0,0 +1,123 @@
+import json
+import base64
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from pydantic import BaseModel
+from sqlalchemy import and_, or_
+from sqlmodel import Session, select, func
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from messaging_manager.libs.database_models import DraftMessageLink, DraftResponse, UnifiedMessageFormat
+
+PREVIEW_LENGTH = 160
+
+
+def link_draft_messages(session: Session, draft_response_id: str, messages: List[UnifiedMessageFormat]):
+    """references the conversation window of a draft, the caller commits the session"""
+    for position, message in enumerate(messages):
+        session.add(DraftMessageLink(draft_response_id=draft_response_id,
+                                     position=position,
+                                     message_id=message.message_id))
+
+def _draft_messages_query(draft_response_ids: List[str]):
+    return (select(DraftMessageLink.draft_response_id, UnifiedMessageFormat)
+            .join(UnifiedMessageFormat, UnifiedMessageFormat.message_id == DraftMessageLink.message_id)
+            .where(DraftMessageLink.draft_response_id.in_(draft_response_ids))
+            .order_by(DraftMessageLink.draft_response_id, DraftMessageLink.position))
+
+def _group_draft_messages(draft_response_ids: List[str], rows) -> Dict[str, List[UnifiedMessageFormat]]:
+    messages_by_draft = {draft_response_id: [] for draft_response_id in draft_response_ids}
+    for draft_response_id, message in rows:
+        messages_by_draft[draft_response_id].append(message)
+    return messages_by_draft
+
+def load_draft_messages(session: Session, draft_response_ids: List[str]) -> Dict[str, List[UnifiedMessageFormat]]:
+    """hydrates the messages of many drafts with one query, in window order"""
+    if len(draft_response_ids) == 0:
+        return {}
+    rows = session.exec(_draft_messages_query(draft_response_ids)).all()
+    return _group_draft_messages(draft_response_ids, rows)
+
+async def load_draft_messages_async(session: AsyncSession, draft_response_ids: List[str]) -> Dict[str, List[UnifiedMessageFormat]]:
+    """load_draft_messages for async sessions"""
+    if len(draft_response_ids) == 0:
+        return {}
+    rows = (await session.exec(_draft_messages_query(draft_response_ids))).all()
+    return _group_draft_messages(draft_response_ids, rows)
+
+
+class DraftSummary(BaseModel):
+    draft_response_id: str
+    source_id: Optional[str] = None
+    status: str
+    summary_of_chat: str
+    response_suggested: bool
+    response: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    message_count: int = 0
+    service_name: Optional[str] = None
+    last_sender_name: Optional[str] = None
+    last_message_timestamp: Optional[datetime] = None
+    last_message_preview: Optional[str] = None
+
+class DraftPage(BaseModel):
+    drafts: List[DraftSummary]
+    next_cursor: Optional[str] = None
+
+
+def summarize_draft(draft: DraftResponse, message_count: int,
+                    last_message: Optional[UnifiedMessageFormat]) -> DraftSummary:
+    return DraftSummary(
+        **draft.model_dump(include=set(DraftSummary.model_fields)),
+        message_count=message_count,
+        service_name=last_message.service_name if last_message else None,
+        last_sender_name=last_message.sender_name if last_message else None,
+        last_message_timestamp=last_message.message_timestamp if last_message else None,
+        last_message_preview=(last_message.message_content or "")[:PREVIEW_LENGTH] if last_message else None)
+
+def encode_cursor(draft: DraftResponse) -> str:
+    """opaque position after a draft in the newest first listing"""
+    created_at = draft.created_at.isoformat() if draft.created_at else ""
+    return base64.urlsafe_b64encode(json.dumps([created_at, draft.draft_response_id]).encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[Optional[datetime], str]:
+    created_at, draft_response_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return (datetime.fromisoformat(created_at) if created_at else None), draft_response_id
+
+async def list_drafts_async(session: AsyncSession, status: str = "pending", limit: int = 20,
+                            cursor: Optional[str] = None) -> DraftPage:
+    """one page of drafts newest first, keyset paginated over the (status, created_at) index"""
+    statement = (select(DraftResponse)
+                 .where(DraftResponse.status == status)
+                 .order_by(DraftResponse.created_at.desc(), DraftResponse.draft_response_id.desc())
+                 .limit(limit + 1))
+    if cursor:
+        created_at, draft_response_id = decode_cursor(cursor)
+        statement = statement.where(or_(DraftResponse.created_at < created_at,
+                                        and_(DraftResponse.created_at == created_at,
+                                             DraftResponse.draft_response_id < draft_response_id)))
+    drafts = (await session.exec(statement)).all()
+    next_cursor = encode_cursor(drafts[limit - 1]) if len(drafts) > limit else None
+    drafts = drafts[:limit]
+    if len(drafts) == 0:
+        return DraftPage(drafts=[])
+
+    # window sizes and the last message of every draft on the page, without the other message bodies
+    draft_ids = [draft.draft_response_id for draft in drafts]
+    counts = dict((await session.exec(select(DraftMessageLink.draft_response_id, func.count())
+                                      .where(DraftMessageLink.draft_response_id.in_(draft_ids))
+                                      .group_by(DraftMessageLink.draft_response_id))).all())
+    last_positions = (select(DraftMessageLink.draft_response_id, func.max(DraftMessageLink.position).label("position"))
+                      .where(DraftMessageLink.draft_response_id.in_(draft_ids))
+                      .group_by(DraftMessageLink.draft_response_id)
+                      .subquery())
+    last_messages = dict((await session.exec(
+        select(DraftMessageLink.draft_response_id, UnifiedMessageFormat)
+        .join(last_positions, and_(last_positions.c.draft_response_id == DraftMessageLink.draft_response_id,
+                                   last_positions.c.position == DraftMessageLink.position))
+        .join(UnifiedMessageFormat, UnifiedMessageFormat.message_id == DraftMessageLink.message_id))).all())
+
+    summaries = [summarize_draft(draft, counts.get(draft.draft_response_id, 0), last_messages.get(draft.draft_response_id))
+                 for draft in drafts]
+    return DraftPage(drafts=summaries, next_cursor=next_cursor)
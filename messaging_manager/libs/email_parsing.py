@@ -0,0 +1,250 @@
+import email
+import email.utils
+import hashlib
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from functools import partial
+from typing import List, Optional, Tuple
+
+from messaging_manager.libs.service_mapper_interface import UnifiedMessageFormat, get_account_scoped_key
+from messaging_manager.libs.reply_stripping import strip_reply
+
+# The gmail mapper and the mbox importer both parse through here so an imported email gets the same
+# message_id and source_id as the live fetch of it. Everything is a plain function on plain data so
+# it can run in a process pool.
+
+SENT_BOX = '"[Gmail]/Sent Mail"'
+INBOX = "INBOX"
+
+# references stored per email, the first one (the thread root) and the most recent ones
+MAX_REFERENCES = 20
+
+MESSAGE_ID_PATTERN = re.compile(r"<[^<>\s]+>")
+
+# smaller batches are parsed in the calling thread, the pool round trip costs more than it saves
+PARSE_POOL_MIN_BATCH = 4
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+MIME_TO_EXT = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/gif': '.gif',
+    'image/bmp': '.bmp',
+}
+
+
+def extract_email(header_value) -> str:
+    """Extract email address from a header value like 'Name <email@example.com>'"""
+    if not header_value:
+        return ""
+    match = re.search(r'<([^>]+)>', header_value)
+    if match:
+        return match.group(1)
+    return header_value.strip()
+
+
+def parse_message_ids(header_value) -> List[str]:
+    """the <id@host> tokens of a Message-ID, In-Reply-To or References header"""
+    return MESSAGE_ID_PATTERN.findall(str(header_value or ""))
+
+
+def trim_references(references: List[str]) -> List[str]:
+    if len(references) <= MAX_REFERENCES:
+        return references
+    return references[:1] + references[-(MAX_REFERENCES - 1):]
+
+
+def get_email_message_id(box: str, message_id_header: str, fallback_key: str, account_id: Optional[str] = None) -> str:
+    """id from the Message-ID header, stable across imap sessions and exports, date/from/subject for emails without one"""
+    key = message_id_header.strip() if message_id_header else fallback_key
+    return hashlib.sha256(get_account_scoped_key(f"{box} {key}", account_id).encode()).hexdigest()
+
+
+def get_legacy_email_message_id(box: str, imap_sequence_number: str, account_id: Optional[str] = None) -> str:
+    """id emails were stored under before they were keyed by Message-ID, only the live fetch knows it"""
+    return hashlib.sha256(get_account_scoped_key(f"{box} {imap_sequence_number}", account_id).encode()).hexdigest()
+
+
+def get_email_source_id(subject: str, other_party_id: str, account_id: Optional[str] = None) -> str:
+    """thread id, the subject without Re: hashed with the other party's address"""
+    stripped_subject = re.sub(r'(?i)^Re:\s*', '', subject)
+    return hashlib.sha256(get_account_scoped_key(f"{stripped_subject} {other_party_id}", account_id).encode()).hexdigest()
+
+
+def get_inline_filename(part, content_id: str) -> str:
+    # Try Content-Disposition first
+    content_disposition = str(part.get("Content-Disposition", ""))
+    if "filename=" in content_disposition:
+        filename_match = re.search(r'filename=["\'](.*?)["\']', content_disposition)
+        if filename_match:
+            return filename_match.group(1)
+
+    # then the Content-Type header
+    content_type = str(part.get("Content-Type", ""))
+    if "name=" in content_type:
+        name_match = re.search(r'name=["\'](.*?)["\']', content_type)
+        if name_match:
+            return name_match.group(1)
+
+    # Sometimes Content-IDs follow patterns like image001.jpg@01D... or filename.ext@...
+    cid_filename_match = re.search(r'^([^@]+)@', content_id)
+    if cid_filename_match and '.' in cid_filename_match.group(1):
+        return cid_filename_match.group(1)
+    return f"{content_id}{MIME_TO_EXT.get(part.get_content_type(), '.bin')}"
+
+
+def parse_email(email_body: bytes, box: str, own_email: str, account_id: Optional[str] = None) -> Tuple[dict, List[Tuple[str, bytes]]]:
+    """
+    Parses one raw RFC822 email into (record, attachments).
+
+    The record holds the fields of the UnifiedMessageFormat, attachments are (filename, payload) of
+    the attachments the message text mentions, the others were part of a quoted reply.
+    """
+    message = email.message_from_bytes(email_body)
+
+    # Get other party's id
+    sender_email = extract_email(message['From'])
+    other_party_id = sender_email
+    sender_name = message['From']
+
+    if sender_email == own_email:
+        sender_name = "user"
+        other_party_id = extract_email(message['To'])
+
+    subject = message['Subject'] or ""
+    message_id_header = message['Message-ID'] or ""
+
+    # (filename, payload), only the ones the message text mentions are kept
+    attachments = []
+    # added after the reply is stripped, attachments belong to this email and not to the quote
+    attachment_notes = ""
+
+    # Process attachments and message content
+    if message.is_multipart():
+        message_text = ""
+        for part in message.walk():
+            content_type = part.get_content_type()
+            content_disposition = str(part.get("Content-Disposition"))
+
+            # Handle attachments
+            if "attachment" in content_disposition:
+                filename = part.get_filename()
+                if filename:
+                    attachment_notes += f"\n[Attachment: {filename}]"
+                    attachments.append((filename, part.get_payload(decode=True)))
+
+            # Handle inline images with Content-ID
+            elif "Content-ID" in part:
+                content_id = part["Content-ID"].strip("<>")
+                payload = part.get_payload(decode=True)
+                if content_id and payload:
+                    attachments.append((get_inline_filename(part, content_id), payload))
+
+            # Get text content
+            elif content_type == "text/plain":
+                payload = part.get_payload(decode=True)
+                if payload:
+                    message_text += payload.decode('utf-8', errors='replace')
+    else:
+        # For non-multipart messages
+        payload = message.get_payload(decode=True)
+        message_text = payload.decode('utf-8', errors='replace') if payload else ""
+
+    message_text = (strip_reply(message_text) + attachment_notes).strip()
+
+    try:
+        message_timestamp = email.utils.parsedate_to_datetime(message['Date']) if message['Date'] else datetime.now()
+    except (TypeError, ValueError):
+        message_timestamp = datetime.now()
+
+    record = {
+        "message_id": get_email_message_id(box, message_id_header, f"{message['Date']} {message['From']} {subject}", account_id),
+        "source_id": get_email_source_id(subject, other_party_id, account_id),
+        "message_id_header": message_id_header.strip(),
+        "in_reply_to": " ".join(parse_message_ids(message['In-Reply-To'])[-1:]),
+        "references": " ".join(trim_references(parse_message_ids(message['References']))),
+        "box": box,
+        "other_party_id": other_party_id,
+        "subject": subject,
+        "sender_id": sender_email,
+        "sender_name": sender_name,
+        "message_content": message_text,
+        "message_timestamp": message_timestamp,
+    }
+    return record, [(filename, payload) for filename, payload in attachments if payload and filename in message_text]
+
+
+def try_parse_email(email_body: bytes, box: str, own_email: str, account_id: Optional[str] = None) -> Optional[Tuple[dict, List[Tuple[str, bytes]]]]:
+    """parse_email, None for an email that can't be parsed so one broken email doesn't fail its batch"""
+    try:
+        return parse_email(email_body, box, own_email, account_id)
+    except Exception as e:
+        print(f"Error parsing email: {str(e)}")
+        return None
+
+
+def get_parse_pool() -> ProcessPoolExecutor:
+    """the process wide parsing pool, shared by every account and created on first use"""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            # spawn, forking a process that runs an event loop and threads isn't safe
+            _parse_pool = ProcessPoolExecutor(max_workers=os.cpu_count(),
+                                              mp_context=multiprocessing.get_context("spawn"))
+        return _parse_pool
+
+
+def reset_parse_pool():
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is not None:
+            _parse_pool.shutdown(wait=False, cancel_futures=True)
+        _parse_pool = None
+
+
+def parse_emails(email_bodies: List[bytes], box: str, own_email: str, account_id: Optional[str] = None) -> List[Optional[Tuple[dict, List[Tuple[str, bytes]]]]]:
+    """
+    Parses a batch of raw emails on every core, results are in the order of email_bodies so the
+    caller can advance its cursor in order. Attachment payloads come back as bytes.
+    """
+    parse = partial(try_parse_email, box=box, own_email=own_email, account_id=account_id)
+    workers = os.cpu_count() or 1
+    if len(email_bodies) < PARSE_POOL_MIN_BATCH or workers < 2:
+        return [parse(email_body) for email_body in email_bodies]
+    try:
+        return list(get_parse_pool().map(parse, email_bodies, chunksize=max(1, len(email_bodies) // (4 * workers))))
+    except BrokenProcessPool as e:
+        # a worker died, e.g. killed for memory, start a new pool next time and finish this batch here
+        print(f"Email parsing pool failed, parsing in process: {str(e)}")
+        reset_parse_pool()
+        return [parse(email_body) for email_body in email_bodies]
+
+
+def build_email_message(record: dict, service_name: str, file_paths: List[str], source_keys: Optional[dict] = None) -> UnifiedMessageFormat:
+    """the UnifiedMessageFormat of a parse_email record, source_keys adds to the keys every email has"""
+    return UnifiedMessageFormat(
+        message_id=record["message_id"],
+        service_name=service_name,
+        source_id=record["source_id"],
+        source_keys={
+            "box": record["box"],
+            "other_party_id": record["other_party_id"],
+            "message_id_header": record["message_id_header"],
+            "in_reply_to": record["in_reply_to"],
+            "references": record["references"],
+            "subject": record["subject"],
+            **(source_keys or {})
+        },
+        message_content=record["message_content"],
+        sender_id=record["sender_id"],
+        sender_name=record["sender_name"],
+        message_timestamp=record["message_timestamp"],
+        file_paths=file_paths
+    )
@@ -0,0 +1,96 @@
+import hashlib
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+from sqlmodel import Session, select
+
+from messaging_manager.libs.database_models import EmailThreadLink, UnifiedMessageFormat
+from messaging_manager.libs.bulk import bulk_insert_ignore
+from messaging_manager.libs.email_parsing import parse_message_ids
+
+# thread links kept in memory, older ones are read back from the database when a reply needs them
+THREAD_CACHE_SIZE = 100000
+# keys per IN query
+LOOKUP_BATCH_SIZE = 500
+
+
+def get_thread_key(service_name: str, message_id_header: str) -> str:
+    # per account, the same email in two accounts belongs to two conversations
+    return f"{service_name} {message_id_header}"
+
+
+def get_thread_source_id(service_name: str, root_message_id: str) -> str:
+    return hashlib.sha256(f"thread {get_thread_key(service_name, root_message_id)}".encode()).hexdigest()
+
+
+class EmailThreadIndex:
+    """
+    Assigns emails to conversations by their Message-ID, In-Reply-To and References headers.
+
+    Every email links its own Message-ID and the ones it references to its conversation in the
+    EmailThreadLink table, links are never changed once written. A new email takes the conversation
+    of the first of its own id, its parent or its nearest reference that is linked, so assigning is
+    a dict lookup with one batched query for the links that aren't cached. An email that starts a
+    thread gets a conversation of its own. A reply whose thread is unknown, e.g. it started before
+    the sync window, keeps the subject based source id the mapper gave it, which is also the one
+    conversations stored before threading existed have.
+    """
+
+    def __init__(self, cache_size: int = THREAD_CACHE_SIZE):
+        self.cache_size = cache_size
+        self.links: "OrderedDict[str, str]" = OrderedDict()
+
+    def _remember(self, key: str, source_id: str):
+        self.links[key] = source_id
+        self.links.move_to_end(key)
+        while len(self.links) > self.cache_size:
+            self.links.popitem(last=False)
+
+    def _lookup(self, key: str) -> Optional[str]:
+        source_id = self.links.get(key)
+        if source_id is not None:
+            self.links.move_to_end(key)
+        return source_id
+
+    def _prefetch(self, session: Session, keys: Iterable[str]):
+        missing = [key for key in set(keys) if key not in self.links]
+        for start in range(0, len(missing), LOOKUP_BATCH_SIZE):
+            for link in session.exec(select(EmailThreadLink)
+                                     .where(EmailThreadLink.message_key.in_(missing[start:start + LOOKUP_BATCH_SIZE]))).all():
+                self._remember(link.message_key, link.source_id)
+
+    def assign(self, session: Session, messages: List[UnifiedMessageFormat]) -> int:
+        """sets the source_id of new emails in order and links them, other messages are left alone. the caller commits the session"""
+        emails = [message for message in messages if (message.source_keys or {}).get("message_id_header")]
+        if len(emails) == 0:
+            return 0
+
+        headers: Dict[str, List[str]] = {}
+        for message in emails:
+            own_id = message.source_keys["message_id_header"]
+            parents = parse_message_ids(message.source_keys.get("in_reply_to"))
+            # nearest ancestor first
+            references = list(reversed(parse_message_ids(message.source_keys.get("references"))))
+            headers[message.message_id] = [own_id] + parents + [ref for ref in references if ref not in parents]
+        self._prefetch(session, [get_thread_key(message.service_name, header)
+                                 for message in emails for header in headers[message.message_id]])
+
+        new_links = []
+        for message in emails:
+            keys = [get_thread_key(message.service_name, header) for header in headers[message.message_id]]
+            source_id = None
+            for key in keys:
+                source_id = self._lookup(key)
+                if source_id is not None:
+                    break
+            if source_id is None and len(keys) == 1:
+                # starts a thread
+                source_id = get_thread_source_id(message.service_name, headers[message.message_id][0])
+            if source_id is not None:
+                message.source_id = source_id
+            for key in keys:
+                if key not in self.links:
+                    self._remember(key, message.source_id)
+                    new_links.append({"message_key": key, "source_id": message.source_id})
+
+        bulk_insert_ignore(session, EmailThreadLink.__table__, new_links)
+        return len(emails)
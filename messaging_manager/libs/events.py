@@ -0,0 +1,86 @@
+import asyncio
+import itertools
+import json
+import threading
+from collections import deque
+from typing import List, Optional
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+
+# event types pushed to the ui
+DRAFT_CREATED = "draft-created"
+DRAFT_STATUS_CHANGED = "draft-status-changed"
+PIPELINE_PROGRESS = "pipeline-progress"
+# sent instead of the missed events when a client fell too far behind, it should reload
+RESYNC = "resync"
+
+
+class Event(BaseModel):
+    event_id: int
+    event_type: str
+    data: dict
+
+    def to_sse(self) -> str:
+        return f"id: {self.event_id}\nevent: {self.event_type}\ndata: {json.dumps(self.data)}\n\n"
+
+
+class EventBus:
+    """
+    Fans events out to every connected client.
+
+    publish() can be called from any thread, each subscriber queue is fed through the event loop
+    that created it. A short history is kept so a reconnecting client can catch up from its
+    Last-Event-ID, a subscriber whose queue fills up gets a resync event instead of the backlog.
+    """
+
+    def __init__(self, history_size: int = 256, queue_size: int = 256):
+        self.lock = threading.Lock()
+        self.subscribers = {}
+        self.history = deque(maxlen=history_size)
+        self.queue_size = queue_size
+        self.counter = itertools.count(1)
+
+    def publish(self, event_type: str, data) -> Event:
+        with self.lock:
+            event = Event(event_id=next(self.counter), event_type=event_type, data=jsonable_encoder(data))
+            self.history.append(event)
+            subscribers = list(self.subscribers.items())
+        for queue, loop in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._deliver, queue, event)
+            except RuntimeError:
+                # the subscriber's loop is closed
+                self.unsubscribe(queue)
+        return event
+
+    def _deliver(self, queue: asyncio.Queue, event: Event):
+        if queue.full():
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(Event(event_id=event.event_id, event_type=RESYNC, data={}))
+            return
+        queue.put_nowait(event)
+
+    def subscribe(self, last_event_id: Optional[int] = None) -> asyncio.Queue:
+        """a queue of events for the calling event loop, starting after last_event_id when given"""
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        with self.lock:
+            self.subscribers[queue] = asyncio.get_running_loop()
+            if last_event_id is not None:
+                missed: List[Event] = [event for event in self.history if event.event_id > last_event_id]
+                latest_event_id = self.history[-1].event_id if len(self.history) > 0 else 0
+                if last_event_id > latest_event_id or (len(self.history) > 0 and self.history[0].event_id > last_event_id + 1):
+                    # the client missed more than the history holds, or saw ids from before a restart
+                    queue.put_nowait(Event(event_id=latest_event_id, event_type=RESYNC, data={}))
+                else:
+                    for event in missed[-self.queue_size:]:
+                        queue.put_nowait(event)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        with self.lock:
+            self.subscribers.pop(queue, None)
+
+
+# process wide bus, the pipeline publishes and the server streams
+event_bus = EventBus()
@@ -0,0 +1,339 @@
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+import math
+import numpy as np
+from pydantic import BaseModel
+from sqlalchemy import case
+from sqlmodel import Session, select
+
+from messaging_manager.libs.database_models import UnifiedMessageFormat, GraphNode, GraphEdge
+from messaging_manager.libs.bulk import iter_batches, dialect_insert, get_dialect_name
+
+# how far refresh() reads back before the newest row it has seen
+REFRESH_OVERLAP = timedelta(seconds=60)
+
+
+def sender_node_id(service_name: str, sender_id: str) -> str:
+    return f"sender:{service_name}:{sender_id}"
+
+def conversation_node_id(source_id: str) -> str:
+    return f"conversation:{source_id}"
+
+def service_node_id(service_name: str) -> str:
+    return f"service:{service_name}"
+
+def to_epoch(timestamp: datetime) -> float:
+    # naive timestamps come back from sqlite, treat them as utc like the mappers do
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.timestamp()
+
+def from_epoch(epoch: float) -> datetime:
+    return datetime.fromtimestamp(epoch, tz=timezone.utc)
+
+
+class ConversationLink(BaseModel):
+    source_id: str
+    interaction_count: int
+    last_interaction: datetime
+
+class ContactSummary(BaseModel):
+    node_id: str
+    name: str
+    interaction_count: int
+    first_interaction: datetime
+    last_interaction: datetime
+    conversations: List[ConversationLink]
+
+
+class GraphIndex:
+    """
+    Sender <-> conversation <-> service graph built from stored messages.
+
+    GraphNode and GraphEdge rows are the persisted copy and are upserted as messages arrive.
+    In memory nodes are numbered, every node has a neighbor -> edge slot map, and the edge
+    counters live in numpy arrays indexed by slot, so lookups are dict and array reads.
+    The user's own sender nodes are kept but skipped when relating conversations, otherwise
+    every conversation would be related through them.
+    """
+
+    def __init__(self, db_engine):
+        self.db_engine = db_engine
+        self._reset()
+
+    def _reset(self):
+        self.node_index: Dict[str, int] = {}
+        self.node_ids: List[str] = []
+        self.node_types: List[str] = []
+        self.node_labels: List[str] = []
+        self.adjacency: List[Dict[int, int]] = []
+        self.edge_nodes: List[Tuple[int, int]] = []
+        self.edge_counts = np.zeros(0, dtype=np.int64)
+        self.edge_first = np.zeros(0, dtype=np.float64)
+        self.edge_last = np.zeros(0, dtype=np.float64)
+        self.user_nodes = set()
+        # newest updated_at read from the database, refresh() continues from there
+        self.updated_through: Optional[datetime] = None
+        self.loaded = False
+
+    def _node(self, node_id: str, node_type: str, label: str) -> int:
+        index = self.node_index.get(node_id)
+        if index is None:
+            index = len(self.node_ids)
+            self.node_index[node_id] = index
+            self.node_ids.append(node_id)
+            self.node_types.append(node_type)
+            self.node_labels.append(label)
+            self.adjacency.append({})
+        elif label and label != "user":
+            self.node_labels[index] = label
+        if label == "user":
+            self.user_nodes.add(index)
+        return index
+
+    def _edge(self, a: int, b: int) -> int:
+        slot = self.adjacency[a].get(b)
+        if slot is not None:
+            return slot
+        slot = len(self.edge_nodes)
+        self.edge_nodes.append((a, b))
+        if slot >= len(self.edge_counts):
+            capacity = max(1024, len(self.edge_counts) * 2)
+            self.edge_counts = np.resize(self.edge_counts, capacity)
+            self.edge_first = np.resize(self.edge_first, capacity)
+            self.edge_last = np.resize(self.edge_last, capacity)
+        self.edge_counts[slot] = 0
+        self.edge_first[slot] = math.inf
+        self.edge_last[slot] = 0.0
+        self.adjacency[a][b] = slot
+        self.adjacency[b][a] = slot
+        return slot
+
+    def _touch(self, a: int, b: int, epoch: float, count: int = 1) -> int:
+        slot = self._edge(a, b)
+        self.edge_counts[slot] += count
+        self.edge_first[slot] = min(self.edge_first[slot], epoch)
+        self.edge_last[slot] = max(self.edge_last[slot], epoch)
+        return slot
+
+    def load(self):
+        """
+        loads the graph into memory, building it from stored messages the first time. the build
+        writes through its own session, so load before opening a session that writes
+        """
+        self._reset()
+        try:
+            with Session(self.db_engine) as session:
+                if session.exec(select(GraphEdge.edge_id).limit(1)).first() is None:
+                    # built in batches and committed once, an interrupted build leaves no partial graph behind
+                    with Session(self.db_engine) as write_session:
+                        for messages in iter_batches(session, select(UnifiedMessageFormat)):
+                            self._add(write_session, messages)
+                            write_session.flush()
+                            write_session.expunge_all()
+                        write_session.commit()
+                    self._seen(datetime.now())
+                else:
+                    self._read(session, None)
+        except Exception:
+            # the next call starts over instead of writing counters from a partial graph
+            self._reset()
+            raise
+        self.loaded = True
+
+    def _read(self, session: Session, since: Optional[datetime]) -> int:
+        """reads the nodes and edges updated since, all of them for None, returns the number of edges"""
+        nodes_query = select(GraphNode)
+        edges_query = select(GraphEdge)
+        if since is not None:
+            nodes_query = nodes_query.where(GraphNode.updated_at >= since)
+            edges_query = edges_query.where(GraphEdge.updated_at >= since)
+        for nodes in iter_batches(session, nodes_query):
+            for node in nodes:
+                self._node(node.node_id, node.node_type, node.label)
+                self._seen(node.updated_at)
+        read = 0
+        for edges in iter_batches(session, edges_query):
+            for edge in edges:
+                self._seen(edge.updated_at)
+                a = self.node_index.get(edge.source_node)
+                b = self.node_index.get(edge.target_node)
+                if a is None or b is None:
+                    continue
+                # counters are stored totals, reading an edge twice sets the same values
+                slot = self._edge(a, b)
+                self.edge_counts[slot] = edge.interaction_count
+                self.edge_first[slot] = to_epoch(edge.first_interaction)
+                self.edge_last[slot] = to_epoch(edge.last_interaction)
+                read += 1
+        return read
+
+    def _seen(self, updated_at: Optional[datetime]):
+        if updated_at is not None and (self.updated_through is None or updated_at > self.updated_through):
+            self.updated_through = updated_at
+
+    def refresh(self) -> int:
+        """
+        picks up the nodes and edges another process changed since the last load or refresh, for
+        processes that read the graph but don't ingest. returns the number of edges read
+        """
+        if not self.loaded:
+            self.load()
+            return len(self.edge_nodes)
+        # rows committed a little after newer ones were read are read again instead of missed
+        since = self.updated_through - REFRESH_OVERLAP if self.updated_through is not None else None
+        with Session(self.db_engine) as session:
+            return self._read(session, since)
+
+    def add_messages(self, session: Session, messages: Iterable[UnifiedMessageFormat]) -> int:
+        """adds new messages to the graph and upserts the touched rows, the caller commits the session"""
+        if not self.loaded:
+            # loading here would wait on the write lock the caller's session may already hold
+            raise RuntimeError("load the graph before adding messages")
+        return self._add(session, messages)
+
+    def _add(self, session: Session, messages: Iterable[UnifiedMessageFormat]) -> int:
+        touched_nodes = set()
+        # slot -> [count, first, last] of this batch alone, the stored rows are added to rather than overwritten
+        # since other processes (ingest workers, importers) write the same edges
+        deltas: Dict[int, list] = {}
+        added = 0
+        for message in messages:
+            epoch = to_epoch(message.message_timestamp)
+            sender = self._node(sender_node_id(message.service_name, message.sender_id), "sender", message.sender_name)
+            conversation = self._node(conversation_node_id(message.source_id), "conversation", message.source_id)
+            service = self._node(service_node_id(message.service_name), "service", message.service_name)
+            touched_nodes.update((sender, conversation, service))
+            for a, b in ((sender, conversation), (conversation, service), (sender, service)):
+                slot = self._touch(a, b, epoch)
+                delta = deltas.get(slot)
+                if delta is None:
+                    deltas[slot] = [1, epoch, epoch]
+                else:
+                    delta[0] += 1
+                    delta[1] = min(delta[1], epoch)
+                    delta[2] = max(delta[2], epoch)
+            added += 1
+
+        if added == 0:
+            return 0
+        now = datetime.now()
+        dialect_name = get_dialect_name(session)
+        nodes = GraphNode.__table__
+        statement = dialect_insert(dialect_name, nodes)
+        statement = statement.on_conflict_do_update(index_elements=[nodes.c.node_id],
+                                                    set_={"label": statement.excluded.label,
+                                                          "updated_at": statement.excluded.updated_at})
+        session.execute(statement, [{"node_id": self.node_ids[index],
+                                     "node_type": self.node_types[index],
+                                     "label": self.node_labels[index],
+                                     "updated_at": now} for index in touched_nodes])
+
+        edges = GraphEdge.__table__
+        statement = dialect_insert(dialect_name, edges)
+        excluded = statement.excluded
+        statement = statement.on_conflict_do_update(index_elements=[edges.c.edge_id], set_={
+            "interaction_count": edges.c.interaction_count + excluded.interaction_count,
+            "first_interaction": case((excluded.first_interaction < edges.c.first_interaction, excluded.first_interaction),
+                                      else_=edges.c.first_interaction),
+            "last_interaction": case((excluded.last_interaction > edges.c.last_interaction, excluded.last_interaction),
+                                     else_=edges.c.last_interaction),
+            "updated_at": excluded.updated_at,
+        })
+        rows = []
+        for slot, (count, first, last) in deltas.items():
+            a, b = self.edge_nodes[slot]
+            rows.append({"edge_id": f"{self.node_ids[a]}|{self.node_ids[b]}",
+                         "source_node": self.node_ids[a],
+                         "target_node": self.node_ids[b],
+                         "interaction_count": count,
+                         "first_interaction": from_epoch(first),
+                         "last_interaction": from_epoch(last),
+                         "updated_at": now})
+        session.execute(statement, rows)
+        return added
+
+    def _neighbors(self, index: int, node_type: str) -> List[Tuple[int, int]]:
+        return [(neighbor, slot) for neighbor, slot in self.adjacency[index].items()
+                if self.node_types[neighbor] == node_type]
+
+    def get_contact(self, service_name: str, sender_id: str) -> Optional[ContactSummary]:
+        """who is this, how often do we talk and in which conversations"""
+        if not self.loaded:
+            self.load()
+        index = self.node_index.get(sender_node_id(service_name, sender_id))
+        if index is None:
+            return None
+
+        links = self._neighbors(index, "conversation")
+        slots = np.array([slot for _, slot in links], dtype=np.int64)
+        if len(slots) == 0:
+            return None
+        conversations = [ConversationLink(source_id=self.node_labels[neighbor],
+                                          interaction_count=int(self.edge_counts[slot]),
+                                          last_interaction=from_epoch(self.edge_last[slot]))
+                         for neighbor, slot in links]
+        conversations.sort(key=lambda link: link.last_interaction, reverse=True)
+        return ContactSummary(node_id=self.node_ids[index],
+                              name=self.node_labels[index],
+                              interaction_count=int(self.edge_counts[slots].sum()),
+                              first_interaction=from_epoch(self.edge_first[slots].min()),
+                              last_interaction=from_epoch(self.edge_last[slots].max()),
+                              conversations=conversations)
+
+    def get_participants(self, source_id: str, include_user: bool = False) -> List[str]:
+        """node ids of the senders in a conversation, most active first"""
+        if not self.loaded:
+            self.load()
+        index = self.node_index.get(conversation_node_id(source_id))
+        if index is None:
+            return []
+        senders = [(neighbor, slot) for neighbor, slot in self._neighbors(index, "sender")
+                   if include_user or neighbor not in self.user_nodes]
+        senders.sort(key=lambda item: self.edge_counts[item[1]], reverse=True)
+        return [self.node_ids[neighbor] for neighbor, _ in senders]
+
+    def related_conversations(self, source_id: str, k: int = 5) -> List[Tuple[str, int]]:
+        """conversations that share senders with this one, scored by how much those senders talk there"""
+        if not self.loaded:
+            self.load()
+        index = self.node_index.get(conversation_node_id(source_id))
+        if index is None:
+            return []
+        scores: Dict[int, int] = {}
+        for sender, _ in self._neighbors(index, "sender"):
+            if sender in self.user_nodes:
+                continue
+            for conversation, slot in self._neighbors(sender, "conversation"):
+                if conversation != index:
+                    scores[conversation] = scores.get(conversation, 0) + int(self.edge_counts[slot])
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.node_labels[conversation], score) for conversation, score in ranked]
+
+    def contact_importance(self, service_name: str, sender_id: str) -> float:
+        """0..1 score from how much we talk to a sender, log scaled so a few heavy threads don't dominate"""
+        if not self.loaded:
+            self.load()
+        index = self.node_index.get(sender_node_id(service_name, sender_id))
+        if index is None or index in self.user_nodes:
+            return 0.0
+        slots = [slot for _, slot in self._neighbors(index, "conversation")]
+        if len(slots) == 0:
+            return 0.0
+        count = int(self.edge_counts[slots].sum())
+        return min(1.0, math.log1p(count) / math.log1p(500))
+
+    def conversation_importance(self, source_id: str) -> float:
+        """importance of the most important other party in a conversation"""
+        if not self.loaded:
+            self.load()
+        index = self.node_index.get(conversation_node_id(source_id))
+        if index is None:
+            return 0.0
+        importance = 0.0
+        for sender, _ in self._neighbors(index, "sender"):
+            if sender in self.user_nodes:
+                continue
+            count = int(sum(self.edge_counts[slot] for _, slot in self._neighbors(sender, "conversation")))
+            importance = max(importance, min(1.0, math.log1p(count) / math.log1p(500)))
+        return importance
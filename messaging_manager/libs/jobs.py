@@ -0,0 +1,110 @@
+import asyncio
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from pydantic import BaseModel
+
+from messaging_manager.libs.events import event_bus, PIPELINE_PROGRESS
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class Job(BaseModel):
+    job_id: str
+    kind: str
+    status: str = QUEUED
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    # latest pipeline-progress event per stage while the job runs
+    progress: Dict[str, dict] = {}
+    error: Optional[str] = None
+
+
+class JobQueue:
+    """
+    Runs background jobs one at a time in submission order.
+
+    Submitting a kind that is already queued returns the queued job instead of adding another,
+    a job that is already running doesn't absorb new submissions since it may have started
+    before what the caller wants processed arrived. Finished jobs are kept for status lookups
+    until history_size newer jobs push them out.
+    """
+
+    def __init__(self, history_size: int = 100):
+        self.handlers: Dict[str, Callable[[Job], Awaitable[None]]] = {}
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self.history_size = history_size
+        self.queue: Optional[asyncio.Queue] = None
+
+    def register(self, kind: str, handler: Callable[[Job], Awaitable[None]]):
+        self.handlers[kind] = handler
+
+    def submit(self, kind: str) -> Tuple[Job, bool]:
+        """(job, created), created is False when an identical queued job was returned"""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        for job in self.jobs.values():
+            if job.kind == kind and job.status == QUEUED:
+                return job, False
+
+        job = Job(job_id=uuid.uuid4().hex, kind=kind, created_at=datetime.now())
+        self.jobs[job.job_id] = job
+        self._trim()
+        self._get_queue().put_nowait(job.job_id)
+        return job, True
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def recent(self) -> List[Job]:
+        return list(reversed(self.jobs.values()))
+
+    def _get_queue(self) -> asyncio.Queue:
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+        return self.queue
+
+    def _trim(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.status in (SUCCEEDED, FAILED)]
+        for job_id in finished[:max(0, len(self.jobs) - self.history_size)]:
+            del self.jobs[job_id]
+
+    def _record_progress(self, job: Job, event):
+        if event.event_type == PIPELINE_PROGRESS:
+            job.progress[event.data.get("stage", "unknown")] = event.data
+
+    async def _track_progress(self, job: Job, queue: asyncio.Queue):
+        while True:
+            self._record_progress(job, await queue.get())
+
+    async def run(self):
+        """the worker, runs until cancelled"""
+        queue = self._get_queue()
+        while True:
+            job = self.jobs.get(await queue.get())
+            if job is None:
+                continue
+            job.status = RUNNING
+            job.started_at = datetime.now()
+            events = event_bus.subscribe()
+            tracker = asyncio.create_task(self._track_progress(job, events))
+            try:
+                await self.handlers[job.kind](job)
+                job.status = SUCCEEDED
+            except Exception as e:
+                print(f"Error running {job.kind} job {job.job_id}: {str(e)}")
+                job.status = FAILED
+                job.error = str(e)
+            finally:
+                tracker.cancel()
+                # progress published right before the handler returned is delivered on the next loop iteration
+                await asyncio.sleep(0)
+                while not events.empty():
+                    self._record_progress(job, events.get_nowait())
+                event_bus.unsubscribe(events)
+                job.finished_at = datetime.now()
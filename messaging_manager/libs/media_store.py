@@ -0,0 +1,195 @@
+import os
+import re
+import uuid
+import hashlib
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+from sqlalchemy import bindparam, case, update
+from sqlmodel import Session, select
+
+from messaging_manager.libs.database_models import UnifiedMessageFormat, MediaObject
+from messaging_manager.libs.bulk import dialect_insert, get_dialect_name
+
+MEDIA_DIR = "media"
+OBJECTS_DIR = "objects"
+TMP_DIR = "tmp"
+CHUNK_SIZE = 1024 * 1024
+
+
+def get_extension(filename: Optional[str]) -> str:
+    """lowercase extension of a filename, the pipeline picks captioning by extension"""
+    extension = os.path.splitext(filename or "")[1].lower()
+    if re.fullmatch(r"\.[a-z0-9]{1,10}", extension):
+        return extension
+    return ""
+
+
+class MediaWriter:
+    """
+    Streams one file into the store, hashing while it writes to a temporary file.
+    close() moves it to its content addressed path, or drops it if that content is already stored.
+    """
+
+    def __init__(self, store: "MediaStore", extension: str = ""):
+        self.store = store
+        self.extension = extension
+        self.hash = hashlib.sha256()
+        self.size = 0
+        self.path = None
+        self.tmp_path = os.path.join(store.tmp_dir, uuid.uuid4().hex)
+        self.file = open(self.tmp_path, "wb")
+
+    def write(self, data: bytes) -> int:
+        self.hash.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    def close(self) -> str:
+        if self.path is not None:
+            return self.path
+        self.file.close()
+        path = self.store.object_path(self.hash.hexdigest(), self.extension)
+        if os.path.exists(path):
+            os.remove(self.tmp_path)
+            # marks the object as in use again, the retention step skips recently touched files
+            os.utime(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(self.tmp_path, path)
+        self.path = path
+        return path
+
+    def abort(self):
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+class MediaStore:
+    """
+    Content addressed media files, media/objects/<2 hex>/<2 hex>/<sha256><ext>.
+
+    The same attachment is stored once however many messages carry it. Message file_paths
+    point at the object paths, MediaObject rows count the messages that reference each object
+    and the retention step deletes objects nobody references anymore.
+    """
+
+    def __init__(self, media_dir: str = MEDIA_DIR):
+        self.media_dir = media_dir
+        self.objects_dir = os.path.join(media_dir, OBJECTS_DIR)
+        self.tmp_dir = os.path.join(media_dir, TMP_DIR)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def object_path(self, content_hash: str, extension: str = "") -> str:
+        return os.path.join(self.objects_dir, content_hash[:2], content_hash[2:4], content_hash + extension)
+
+    def get_content_hash(self, path: str) -> Optional[str]:
+        """the content hash of a stored object path, None for paths outside the store"""
+        relative = os.path.relpath(os.path.normpath(path), os.path.normpath(self.objects_dir))
+        parts = relative.split(os.sep)
+        if len(parts) != 3 or parts[0] == "..":
+            return None
+        content_hash = os.path.splitext(parts[2])[0]
+        if not re.fullmatch(r"[0-9a-f]{64}", content_hash):
+            return None
+        return content_hash
+
+    def writer(self, filename: Optional[str] = None) -> MediaWriter:
+        return MediaWriter(self, get_extension(filename))
+
+    def put_bytes(self, data: bytes, filename: Optional[str] = None) -> str:
+        with self.writer(filename) as writer:
+            writer.write(data)
+        return writer.path
+
+    def put_file(self, source_path: str, filename: Optional[str] = None) -> str:
+        """copies a file into the store in chunks, the source is left in place"""
+        with self.writer(filename or os.path.basename(source_path)) as writer:
+            with open(source_path, "rb") as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                    writer.write(chunk)
+        return writer.path
+
+    def _count_paths(self, messages: Iterable[UnifiedMessageFormat]) -> Dict[str, Tuple[str, int]]:
+        counts: Dict[str, int] = {}
+        paths: Dict[str, str] = {}
+        for message in messages:
+            # a message counts once per object, even if it carries the same file twice
+            for path in set(message.file_paths or []):
+                content_hash = self.get_content_hash(path)
+                if content_hash is None:
+                    continue
+                counts[content_hash] = counts.get(content_hash, 0) + 1
+                paths[content_hash] = path
+        return {content_hash: (paths[content_hash], count) for content_hash, count in counts.items()}
+
+    def add_references(self, session: Session, messages: Iterable[UnifiedMessageFormat]):
+        """counts new messages against the objects they carry, the caller commits the session"""
+        counted = self._count_paths(messages)
+        if len(counted) == 0:
+            return
+        now = datetime.now()
+        rows = [{"content_hash": content_hash, "path": path, "size": os.path.getsize(path) if os.path.exists(path) else 0,
+                 "ref_count": count, "created_at": now, "updated_at": now}
+                for content_hash, (path, count) in counted.items()]
+        # the database adds the counts, ingest workers and importers store messages with the same file at once
+        table = MediaObject.__table__
+        statement = dialect_insert(get_dialect_name(session), table)
+        statement = statement.on_conflict_do_update(index_elements=[table.c.content_hash],
+                                                    set_={"ref_count": table.c.ref_count + statement.excluded.ref_count,
+                                                          "updated_at": statement.excluded.updated_at})
+        session.execute(statement, rows)
+
+    def remove_references(self, session: Session, messages: Iterable[UnifiedMessageFormat]):
+        """releases the objects of deleted messages, the caller commits the session"""
+        counted = self._count_paths(messages)
+        if len(counted) == 0:
+            return
+        table = MediaObject.__table__
+        remaining = table.c.ref_count - bindparam("released")
+        session.execute(update(table)
+                        .where(table.c.content_hash == bindparam("hash"))
+                        .values(ref_count=case((remaining > 0, remaining), else_=0), updated_at=datetime.now()),
+                        [{"hash": content_hash, "released": count} for content_hash, (_, count) in counted.items()])
+
+    def migrate_legacy_media(self, session: Session, batch_size: int = 200) -> int:
+        """
+        Copies files from the old media/<message hash>/<filename> layout into the store and
+        points the messages at them. The old directories are left for the retention step,
+        which deletes them once nothing references them.
+        """
+        migrated = 0
+        last_message_id = ""
+        while True:
+            messages = session.exec(select(UnifiedMessageFormat)
+                                    .where(UnifiedMessageFormat.message_id > last_message_id)
+                                    .order_by(UnifiedMessageFormat.message_id)
+                                    .limit(batch_size)).all()
+            if len(messages) == 0:
+                return migrated
+            last_message_id = messages[-1].message_id
+            changed = []
+            for message in messages:
+                file_paths = message.file_paths or []
+                if all(self.get_content_hash(path) is not None for path in file_paths):
+                    continue
+                new_paths = []
+                for path in file_paths:
+                    if self.get_content_hash(path) is None and os.path.isfile(path):
+                        path = self.put_file(path)
+                    new_paths.append(path)
+                message.file_paths = new_paths
+                session.add(message)
+                changed.append(message)
+            self.add_references(session, changed)
+            session.commit()
+            migrated += len(changed)
@@ -0,0 +1,169 @@
+import json
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+from sqlalchemy import text, insert, select, inspect, bindparam, DateTime
+from sqlmodel import SQLModel, Session
+
+from messaging_manager.libs.database_models import SchemaMigration, UnifiedMessageFormat, DraftMessageLink, EmailThreadLink
+from messaging_manager.libs.search_index import create_search_index, rebuild_search_index
+from messaging_manager.libs.bulk import insert_ignore, get_dialect_name
+from messaging_manager.libs.media_store import MediaStore
+from messaging_manager.libs.email_threading import get_thread_key
+
+# (version, name, apply(connection), vacuum, uses_media_dir), applied in ascending version order.
+# create_all runs first and already builds new tables, columns and indexes declared on the models,
+# so every migration has to be safe to run against a database that already has its changes.
+# vacuum=True reclaims the space a migration freed once it has been committed.
+# uses_media_dir=True migrations are called as apply(connection, media_dir) and stay pending until
+# migrate_database is given the media dir, e.g. check_database against a remote database has none.
+MIGRATIONS: List[Tuple[int, str, Callable, bool, bool]] = []
+
+def migration(version: int, name: str, vacuum: bool = False, uses_media_dir: bool = False):
+    def register(apply):
+        MIGRATIONS.append((version, name, apply, vacuum, uses_media_dir))
+        MIGRATIONS.sort(key=lambda entry: entry[0])
+        return apply
+    return register
+
+def get_column_names(connection, table_name: str) -> List[str]:
+    return [column["name"] for column in inspect(connection).get_columns(table_name)]
+
+
+# numbered 0 so it runs before the migrations that read messages through the model
+@migration(0, "record when messages are stored")
+def add_message_created_at(connection):
+    # existing messages keep NULL, the embedding scan reads all of them once after a start
+    if "created_at" not in get_column_names(connection, "unifiedmessageformat"):
+        connection.execute(text("ALTER TABLE unifiedmessageformat ADD COLUMN created_at TIMESTAMP"))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_unifiedmessageformat_created_at ON unifiedmessageformat (created_at)"))
+
+
+@migration(1, "add message and draft query indexes")
+def add_query_indexes(connection):
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_unifiedmessageformat_service_name_message_timestamp "
+                            "ON unifiedmessageformat (service_name, message_timestamp)"))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_unifiedmessageformat_source_id_message_timestamp "
+                            "ON unifiedmessageformat (source_id, message_timestamp)"))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_draftresponse_status ON draftresponse (status)"))
+
+@migration(2, "add full text search index")
+def add_search_index(connection):
+    create_search_index(connection)
+
+@migration(3, "store draft messages as references", vacuum=True)
+def normalize_draft_messages(connection):
+    if "messages" not in get_column_names(connection, "draftresponse"):
+        return
+
+    insert_message = insert_ignore(get_dialect_name(connection), UnifiedMessageFormat.__table__)
+    insert_link = insert_ignore(get_dialect_name(connection), DraftMessageLink.__table__)
+    rows = connection.execute(text("SELECT draft_response_id, messages FROM draftresponse")).all()
+    for draft_response_id, messages in rows:
+        if isinstance(messages, str):
+            messages = json.loads(messages)
+        for position, message in enumerate(messages or []):
+            message = UnifiedMessageFormat.model_validate(message)
+            # drafts held full copies, restore any message that is no longer in the message table
+            connection.execute(insert_message.values(**message.model_dump()))
+            connection.execute(insert_link.values(draft_response_id=draft_response_id, position=position,
+                                                  message_id=message.message_id))
+    connection.execute(text("ALTER TABLE draftresponse DROP COLUMN messages"))
+
+@migration(4, "add draft source ids and timestamps")
+def add_draft_tracking_columns(connection):
+    columns = get_column_names(connection, "draftresponse")
+    now = bindparam("now", value=datetime.now(), type_=DateTime())
+    for column in ["created_at", "updated_at"]:
+        if column not in columns:
+            connection.execute(text(f"ALTER TABLE draftresponse ADD COLUMN {column} TIMESTAMP"))
+            # existing drafts start their retention clock now
+            connection.execute(text(f"UPDATE draftresponse SET {column} = :now").bindparams(now))
+    if "source_id" not in columns:
+        connection.execute(text("ALTER TABLE draftresponse ADD COLUMN source_id VARCHAR"))
+        connection.execute(text("""
+            UPDATE draftresponse SET source_id = (
+                SELECT m.source_id FROM draftmessagelink l
+                JOIN unifiedmessageformat m ON m.message_id = l.message_id
+                WHERE l.draft_response_id = draftresponse.draft_response_id
+                ORDER BY l.position LIMIT 1)"""))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_draftresponse_status_updated_at "
+                            "ON draftresponse (status, updated_at)"))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_draftresponse_source_id_created_at "
+                            "ON draftresponse (source_id, created_at)"))
+
+@migration(5, "move media into the content addressed store", uses_media_dir=True)
+def move_media_to_store(connection, media_dir: str):
+    import os
+    if not os.path.exists(media_dir):
+        return
+    # the session joins the migration's transaction, its commits don't end it
+    with Session(bind=connection) as session:
+        migrated = MediaStore(media_dir).migrate_legacy_media(session)
+    print(f"Moved the media of {migrated} messages into the media store")
+
+@migration(6, "add draft listing index")
+def add_draft_listing_index(connection):
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_draftresponse_status_created_at "
+                            "ON draftresponse (status, created_at)"))
+
+@migration(7, "queue existing conversations for drafting")
+def queue_existing_conversations(connection):
+    # conversations that already have a draft for their current window are skipped cheaply by the draft workers
+    connection.execute(text("INSERT INTO draftqueueitem (source_id, version, dirty_at, attempts) "
+                            "SELECT DISTINCT source_id, 1, :now, 0 FROM unifiedmessageformat "
+                            "WHERE source_id NOT IN (SELECT source_id FROM draftqueueitem)")
+                       .bindparams(bindparam("now", type_=DateTime)), {"now": datetime.now()})
+
+@migration(8, "link stored emails to their threads")
+def link_email_threads(connection):
+    # only emails stored since Message-IDs are recorded can be linked, older ones keep their subject based conversations
+    statement = insert_ignore(get_dialect_name(connection), EmailThreadLink.__table__)
+    result = connection.execute(select(UnifiedMessageFormat.service_name, UnifiedMessageFormat.source_id,
+                                       UnifiedMessageFormat.source_keys)
+                                .order_by(UnifiedMessageFormat.message_timestamp)
+                                .execution_options(yield_per=1000))
+    for partition in result.partitions(1000):
+        links = [{"message_key": get_thread_key(service_name, source_keys["message_id_header"]), "source_id": source_id}
+                 for service_name, source_id, source_keys in partition
+                 if source_keys and source_keys.get("message_id_header")]
+        if len(links) > 0:
+            connection.execute(statement, links)
+
+@migration(9, "add index refresh timestamps")
+def add_refresh_timestamps(connection):
+    now = bindparam("now", value=datetime.now(), type_=DateTime())
+    for table, column in [("writingsample", "created_at"), ("graphnode", "updated_at"), ("graphedge", "updated_at")]:
+        if column not in get_column_names(connection, table):
+            connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} TIMESTAMP"))
+            connection.execute(text(f"UPDATE {table} SET {column} = :now").bindparams(now))
+        connection.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_{column} ON {table} ({column})"))
+
+
+def migrate_database(engine, media_dir: Optional[str] = None):
+    """
+    creates missing tables and applies pending migrations in place, one transaction per migration.
+    media_dir is the media folder of the process, the migrations that move media are skipped without it
+    """
+    SQLModel.metadata.create_all(engine)
+    with engine.connect() as connection:
+        applied = set(connection.execute(select(SchemaMigration.version)).scalars().all())
+
+    needs_vacuum = False
+    for version, name, apply, vacuum, uses_media_dir in MIGRATIONS:
+        if version in applied or (uses_media_dir and media_dir is None):
+            continue
+        print(f"Applying migration {version}: {name}")
+        with engine.begin() as connection:
+            if uses_media_dir:
+                apply(connection, media_dir)
+            else:
+                apply(connection)
+            connection.execute(insert(SchemaMigration).values(version=version, name=name, applied_at=datetime.now()))
+        needs_vacuum = needs_vacuum or vacuum
+
+    if needs_vacuum:
+        print("Vacuuming database")
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.execute(text("VACUUM"))
+        # vacuum can renumber the implicit rowids the search index points at
+        rebuild_search_index(engine)
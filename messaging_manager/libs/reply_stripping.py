@@ -0,0 +1,96 @@
+from typing import List
+
+# Removes quoted replies and signatures from the plain text of an email, one pass over the lines.
+# Every check looks at the current line and at most a few lines after it, so the work is linear
+# in the length of the text whatever the input, unlike a regex over the whole body.
+
+ATTRIBUTION_PREFIXES = ("On ", "Le ", "Am ", "El ", "Il ", "Op ")
+# the attribution ends with a colon, some languages put the name after the verb
+ATTRIBUTION_VERBS = ("wrote", "écrit", "schrieb", "escribió", "scritto", "geschreven")
+# gmail wraps a long attribution before the address
+ATTRIBUTION_MAX_LINES = 3
+# the quote starts at most this many lines below its attribution
+QUOTE_LOOKAHEAD = 3
+
+ORIGINAL_MESSAGE_MARKERS = ("-----Original Message-----", "-----Ursprüngliche Nachricht-----", "-----Message d'origine-----")
+# outlook web separates the quoted message with a line of underscores
+OUTLOOK_SEPARATOR = "_" * 20
+# outlook without a marker starts the quote with From: and Sent: or Date: lines
+OUTLOOK_HEADER_LOOKAHEAD = 5
+FORWARDED_MARKER = "Forwarded message"
+
+# RFC 3676, a bare "--" is as likely to be part of the text
+SIGNATURE_DELIMITER = "-- "
+MOBILE_SIGNATURES = ("Sent from my ", "Get Outlook for ", "Sent from Mail for Windows", "Sent from Yahoo Mail")
+
+
+def is_quoted(line: str) -> bool:
+    return line.lstrip().startswith(">")
+
+
+def get_attribution_length(lines: List[str], i: int) -> int:
+    """number of lines of an "On ... wrote:" attribution starting at line i that a quote follows, 0 if there is none"""
+    if not lines[i].lstrip().startswith(ATTRIBUTION_PREFIXES):
+        return 0
+    joined = ""
+    for length in range(1, ATTRIBUTION_MAX_LINES + 1):
+        if i + length > len(lines):
+            return 0
+        joined += " " + lines[i + length - 1].strip()
+        if joined.endswith(":") and any(verb in joined for verb in ATTRIBUTION_VERBS):
+            # "On monday I wrote:" in the text itself isn't followed by a quote
+            for j in range(i + length, min(i + length + QUOTE_LOOKAHEAD, len(lines))):
+                if is_quoted(lines[j]):
+                    return length
+                if lines[j].strip() != "":
+                    return 0
+            return 0
+    return 0
+
+
+def is_original_message(lines: List[str], i: int) -> bool:
+    """start of a quoted message in outlook style, which isn't prefixed with >"""
+    line = lines[i].strip()
+    if line in ORIGINAL_MESSAGE_MARKERS:
+        return True
+    if line.startswith(OUTLOOK_SEPARATOR) and i + 1 < len(lines) and lines[i + 1].strip().startswith("From:"):
+        return True
+    if not line.startswith("From:"):
+        return False
+    # a forwarded message has the same headers, but it is the content
+    if i > 0 and FORWARDED_MARKER in lines[i - 1]:
+        return False
+    for j in range(i + 1, min(i + 1 + OUTLOOK_HEADER_LOOKAHEAD, len(lines))):
+        if lines[j].strip().startswith(("Sent:", "Date:")):
+            return True
+    return False
+
+
+def is_signature(line: str) -> bool:
+    return line.rstrip("\r\n") == SIGNATURE_DELIMITER
+
+
+def strip_reply(text: str) -> str:
+    """the text without quoted replies, outlook style quoted messages and the signature"""
+    lines = text.splitlines()
+    kept = []
+    in_reply = False
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if is_signature(line) or is_original_message(lines, i):
+            break
+        attribution_length = get_attribution_length(lines, i)
+        if attribution_length > 0:
+            # quoted lines after an attribution are dropped, answers written between them are kept
+            in_reply = True
+            i += attribution_length
+            continue
+        if not (in_reply and is_quoted(line)):
+            kept.append(line)
+        i += 1
+
+    # a quote at the very end is history even without an attribution, so are mobile signatures
+    while len(kept) > 0 and (kept[-1].strip() == "" or is_quoted(kept[-1]) or kept[-1].strip().startswith(MOBILE_SIGNATURES)):
+        kept.pop()
+    return "\n".join(kept).strip()
@@ -0,0 +1,298 @@
+import os
+import gzip
+import json
+import shutil
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Set
+from pydantic import BaseModel
+from sqlmodel import Session, select, delete, exists
+
+from messaging_manager.libs.database_models import UnifiedMessageFormat, DraftResponse, DraftMessageLink, MediaObject
+from messaging_manager.libs.media_store import MediaStore, OBJECTS_DIR, TMP_DIR
+from messaging_manager.libs.thumbnails import ThumbnailCache, THUMBNAILS_DIR
+from messaging_manager.libs.common import DateTimeEncoder
+from messaging_manager.libs.bulk import iter_batches
+
+RETENTION_CONFIG_PATH = "retention.json"
+
+
+class MessagePolicy(BaseModel):
+    # None keeps messages in the database forever
+    archive_after_days: Optional[int] = None
+
+class DraftPolicy(BaseModel):
+    # None keeps drafts with this status forever
+    delete_after_days: Optional[int] = None
+
+class RetentionConfig(BaseModel):
+    archive_dir: str = "archive"
+    # per service name, "*" applies to services without their own entry
+    messages: Dict[str, MessagePolicy] = {"*": MessagePolicy()}
+    # per draft status, pending drafts are never deleted
+    drafts: Dict[str, DraftPolicy] = {"ignored": DraftPolicy(delete_after_days=30),
+                                      "sent": DraftPolicy(delete_after_days=90)}
+    # bounds for a single run, the rest is picked up by the next one
+    max_rows_per_run: int = 2000
+    max_archive_bytes_per_run: int = 16 * 1024 * 1024
+    max_media_dirs_per_run: int = 500
+    max_media_objects_per_run: int = 500
+    batch_size: int = 200
+    segment_max_bytes: int = 64 * 1024 * 1024
+    # media younger than this may belong to messages that are not committed yet
+    media_grace_hours: int = 24
+
+class RetentionReport(BaseModel):
+    deleted_drafts: int = 0
+    archived_messages: int = 0
+    archived_bytes: int = 0
+    deleted_media_objects: int = 0
+    deleted_media_files: int = 0
+    seconds: float = 0.0
+
+
+def load_retention_config(path: str = RETENTION_CONFIG_PATH) -> RetentionConfig:
+    """reads the retention policy json, the defaults keep every message and expire finished drafts"""
+    if not os.path.exists(path):
+        return RetentionConfig()
+    with open(path, "r") as f:
+        return RetentionConfig.model_validate_json(f.read())
+
+
+class ArchiveWriter:
+    """
+    Append only archive of deleted messages, one directory of segments per service.
+
+    Every append is written as its own gzip member and fsynced before the rows are deleted,
+    concatenated members read back as one stream. A crash between the append and the delete
+    archives those rows twice, readers keep the first copy of a message id.
+    """
+
+    def __init__(self, archive_dir: str, segment_max_bytes: int = 64 * 1024 * 1024):
+        self.archive_dir = archive_dir
+        self.segment_max_bytes = segment_max_bytes
+
+    def _segments(self, service_name: str) -> List[str]:
+        service_dir = os.path.join(self.archive_dir, service_name)
+        if not os.path.exists(service_dir):
+            return []
+        return sorted(os.path.join(service_dir, name) for name in os.listdir(service_dir)
+                      if name.startswith("segment-") and name.endswith(".jsonl.gz"))
+
+    def _current_segment(self, service_name: str) -> str:
+        segments = self._segments(service_name)
+        if len(segments) > 0 and os.path.getsize(segments[-1]) < self.segment_max_bytes:
+            return segments[-1]
+        number = len(segments)
+        service_dir = os.path.join(self.archive_dir, service_name)
+        os.makedirs(service_dir, exist_ok=True)
+        return os.path.join(service_dir, f"segment-{number:06d}.jsonl.gz")
+
+    def append(self, service_name: str, messages: List[UnifiedMessageFormat]) -> int:
+        """writes the messages to the service's open segment, returns the compressed bytes written"""
+        if len(messages) == 0:
+            return 0
+        lines = "".join(json.dumps(message.model_dump(), cls=DateTimeEncoder) + "\n" for message in messages)
+        data = gzip.compress(lines.encode("utf-8"))
+        with open(self._current_segment(service_name), "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        return len(data)
+
+    def read(self, service_name: str) -> Iterator[UnifiedMessageFormat]:
+        """archived messages of a service, oldest segment first"""
+        seen = set()
+        for segment in self._segments(service_name):
+            with gzip.open(segment, "rt", encoding="utf-8") as f:
+                for line in f:
+                    message = UnifiedMessageFormat.model_validate_json(line)
+                    if message.message_id in seen:
+                        continue
+                    seen.add(message.message_id)
+                    yield message
+
+
+class RetentionManager:
+    """
+    Applies the retention policies a little at a time, call run_once from the background loop.
+
+    Drafts are expired first, except the newest draft of a conversation, its id is what stops
+    the same message window from being drafted again. Messages referenced by any draft are
+    never archived, so expiring drafts is also what frees their messages.
+    Media objects are deleted once their reference count drops to zero. Files the database
+    doesn't know about, left by crashes, duplicate fetches or the old per message directories,
+    are collected in passes over the media folder, one slice of directories per run.
+    """
+
+    def __init__(self, db_engine, media_dir: str, config: RetentionConfig = None):
+        self.db_engine = db_engine
+        self.media_dir = media_dir
+        self.config = config or load_retention_config()
+        self.archive = ArchiveWriter(self.config.archive_dir, self.config.segment_max_bytes)
+        self.media_store = MediaStore(media_dir)
+        self.thumbnails = ThumbnailCache(self.media_store)
+        self.media_pending: List[str] = []
+        self.media_referenced: Optional[Set[str]] = None
+
+    def get_message_policy(self, service_name: str) -> MessagePolicy:
+        # account scoped names like email:work fall back to the policy of their service
+        return (self.config.messages.get(service_name) or self.config.messages.get(service_name.split(":")[0])
+                or self.config.messages.get("*") or MessagePolicy())
+
+    def expire_drafts(self, session: Session, budget: int) -> int:
+        deleted = 0
+        for status, policy in self.config.drafts.items():
+            if status == "pending" or policy.delete_after_days is None or deleted >= budget:
+                continue
+            cutoff = datetime.now() - timedelta(days=policy.delete_after_days)
+            newer = DraftResponse.__table__.alias("newer")
+            draft_ids = session.exec(select(DraftResponse.draft_response_id)
+                                     .where(DraftResponse.status == status)
+                                     .where(DraftResponse.updated_at < cutoff)
+                                     .where(exists().where(newer.c.source_id == DraftResponse.source_id)
+                                                    .where(newer.c.created_at > DraftResponse.created_at))
+                                     .limit(budget - deleted)).all()
+            if len(draft_ids) == 0:
+                continue
+            session.exec(delete(DraftMessageLink).where(DraftMessageLink.draft_response_id.in_(draft_ids)))
+            session.exec(delete(DraftResponse).where(DraftResponse.draft_response_id.in_(draft_ids)))
+            session.commit()
+            deleted += len(draft_ids)
+        return deleted
+
+    def archive_messages(self, session: Session, budget: int, byte_budget: int, report: RetentionReport):
+        service_names = session.exec(select(UnifiedMessageFormat.service_name)
+                                     .group_by(UnifiedMessageFormat.service_name)).all()
+        for service_name in service_names:
+            policy = self.get_message_policy(service_name)
+            if policy.archive_after_days is None:
+                continue
+            cutoff = datetime.now() - timedelta(days=policy.archive_after_days)
+            while report.archived_messages < budget and report.archived_bytes < byte_budget:
+                # oldest first through the (service_name, message_timestamp) index
+                messages = session.exec(select(UnifiedMessageFormat)
+                                        .where(UnifiedMessageFormat.service_name == service_name)
+                                        .where(UnifiedMessageFormat.message_timestamp < cutoff)
+                                        .where(~exists().where(DraftMessageLink.message_id == UnifiedMessageFormat.message_id))
+                                        .order_by(UnifiedMessageFormat.message_timestamp)
+                                        .limit(min(self.config.batch_size, budget - report.archived_messages))).all()
+                if len(messages) == 0:
+                    break
+                report.archived_bytes += self.archive.append(service_name, messages)
+                self.media_store.remove_references(session, messages)
+                session.exec(delete(UnifiedMessageFormat)
+                             .where(UnifiedMessageFormat.message_id.in_([message.message_id for message in messages])))
+                session.commit()
+                report.archived_messages += len(messages)
+
+    def collect_media_objects(self, session: Session, budget: int) -> int:
+        """deletes stored objects that no message references anymore"""
+        grace_cutoff = datetime.now() - timedelta(hours=self.config.media_grace_hours)
+        unreferenced = session.exec(select(MediaObject)
+                                    .where(MediaObject.ref_count <= 0)
+                                    .where(MediaObject.updated_at < grace_cutoff)
+                                    .limit(budget)).all()
+        deleted = 0
+        for media in unreferenced:
+            try:
+                if os.path.exists(media.path):
+                    if os.path.getmtime(media.path) > grace_cutoff.timestamp():
+                        # stored again by a message that isn't committed yet
+                        continue
+                    os.remove(media.path)
+                self.thumbnails.remove(media.content_hash)
+            except OSError as e:
+                print(f"Error removing media object {media.path}: {str(e)}")
+                continue
+            session.delete(media)
+            deleted += 1
+        session.commit()
+        return deleted
+
+    def _load_media_pass(self):
+        """lists the directories the next pass will check, the store's shard directories and anything else"""
+        pending = []
+        if os.path.exists(self.media_dir):
+            for name in sorted(os.listdir(self.media_dir)):
+                if name == THUMBNAILS_DIR:
+                    # cleared along with the objects they were made from
+                    continue
+                if name == OBJECTS_DIR:
+                    for outer in sorted(os.listdir(self.media_store.objects_dir)):
+                        outer_dir = os.path.join(self.media_store.objects_dir, outer)
+                        if os.path.isdir(outer_dir):
+                            pending.extend(os.path.join(outer_dir, inner) for inner in sorted(os.listdir(outer_dir)))
+                else:
+                    pending.append(os.path.join(self.media_dir, name))
+        self.media_pending = pending
+        self.media_referenced = None
+
+    def _load_legacy_references(self, session: Session) -> Set[str]:
+        """directories under the media folder that rows still point at outside the store"""
+        media_root = os.path.normpath(self.media_dir)
+        referenced = set()
+        for rows in iter_batches(session, select(UnifiedMessageFormat.file_paths)):
+            for file_paths in rows:
+                for file_path in file_paths or []:
+                    if self.media_store.get_content_hash(file_path) is None:
+                        relative = os.path.relpath(os.path.normpath(file_path), media_root)
+                        referenced.add(relative.split(os.sep)[0])
+        return referenced
+
+    def _collect_shard(self, session: Session, shard_dir: str, grace_cutoff: float) -> int:
+        names = [name for name in os.listdir(shard_dir) if os.path.getmtime(os.path.join(shard_dir, name)) < grace_cutoff]
+        hashes = {self.media_store.get_content_hash(os.path.join(shard_dir, name)): name for name in names}
+        hashes.pop(None, None)
+        if len(hashes) == 0:
+            return 0
+        known = set(session.exec(select(MediaObject.content_hash)
+                                 .where(MediaObject.content_hash.in_(list(hashes)))).all())
+        deleted = 0
+        for content_hash, name in hashes.items():
+            if content_hash not in known:
+                os.remove(os.path.join(shard_dir, name))
+                deleted += 1
+        return deleted
+
+    def collect_media(self, session: Session, budget: int) -> int:
+        """deletes media files the database doesn't reference, checking at most budget directories"""
+        if len(self.media_pending) == 0:
+            self._load_media_pass()
+
+        deleted = 0
+        grace_cutoff = time.time() - self.config.media_grace_hours * 3600
+        checked = self.media_pending[:budget]
+        self.media_pending = self.media_pending[budget:]
+        for path in checked:
+            try:
+                if os.path.basename(path) == TMP_DIR and os.path.dirname(path) == self.media_dir:
+                    # interrupted downloads
+                    for name in os.listdir(path):
+                        if os.path.getmtime(os.path.join(path, name)) < grace_cutoff:
+                            os.remove(os.path.join(path, name))
+                            deleted += 1
+                elif os.path.dirname(os.path.dirname(path)) == self.media_store.objects_dir:
+                    deleted += self._collect_shard(session, path, grace_cutoff)
+                elif os.path.isdir(path) and os.path.getmtime(path) < grace_cutoff:
+                    # a directory from the old per message layout
+                    if self.media_referenced is None:
+                        self.media_referenced = self._load_legacy_references(session)
+                    if os.path.basename(path) not in self.media_referenced:
+                        deleted += len(os.listdir(path))
+                        shutil.rmtree(path)
+            except OSError as e:
+                print(f"Error collecting media in {path}: {str(e)}")
+        return deleted
+
+    def run_once(self) -> RetentionReport:
+        """one bounded step of every policy"""
+        start = time.time()
+        report = RetentionReport()
+        with Session(self.db_engine) as session:
+            report.deleted_drafts = self.expire_drafts(session, self.config.max_rows_per_run)
+            self.archive_messages(session, self.config.max_rows_per_run, self.config.max_archive_bytes_per_run, report)
+            report.deleted_media_objects = self.collect_media_objects(session, self.config.max_media_objects_per_run)
+            report.deleted_media_files = self.collect_media(session, self.config.max_media_dirs_per_run)
+        report.seconds = time.time() - start
+        return report
@@ -0,0 +1,111 @@
+import time
+from typing import Dict, List, Optional
+from pydantic import BaseModel
+
+
+def get_poll_key(service_name: str, folder: Optional[str]) -> str:
+    return f"{service_name}/{folder or '*'}"
+
+
+class PollState(BaseModel):
+    key: str
+    arrival_rate: float = 0.0 # messages per second, exponentially weighted
+    interval: float # seconds until the next poll
+    last_poll: Optional[float] = None
+    next_poll: float = 0.0
+    empty_polls: int = 0
+
+
+class PollScheduler:
+    """
+    Decides when each service folder is polled and when drafting runs.
+
+    Every poll updates an EWMA of the folder's arrival rate. A poll that finds messages sets the
+    interval to the time in which target_per_poll messages are expected to arrive, capped at the
+    base interval, an empty poll multiplies the interval by backoff, both clamped to
+    [min_interval, max_interval]. New folders are polled right away. Drafting runs on its own cadence, at most every draft_interval seconds and only
+    when a poll brought in something new since the last drafting pass.
+    """
+
+    def __init__(self, base_interval: float = 300, min_interval: float = 30, max_interval: float = 3600,
+                 alpha: float = 0.3, target_per_poll: float = 2.0, backoff: float = 2.0,
+                 draft_interval: float = 60, retention_interval: float = 1800):
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.alpha = alpha
+        self.target_per_poll = target_per_poll
+        self.backoff = backoff
+        self.draft_interval = draft_interval
+        self.retention_interval = retention_interval
+        self.states: Dict[str, PollState] = {}
+        self.drafting_pending = True
+        self.last_draft = 0.0
+        self.last_retention = 0.0
+        # set while later stages are behind, every folder then waits max_interval between polls
+        self.backpressure = False
+
+    def _state(self, key: str) -> PollState:
+        state = self.states.get(key)
+        if state is None:
+            state = PollState(key=key, interval=self.base_interval)
+            self.states[key] = state
+        return state
+
+    def _next_poll(self, state: PollState) -> float:
+        if self.backpressure and state.last_poll is not None:
+            return max(state.next_poll, state.last_poll + self.max_interval)
+        return state.next_poll
+
+    def is_due(self, key: str, now: float = None) -> bool:
+        now = now or time.time()
+        return self._next_poll(self._state(key)) <= now
+
+    def record_poll(self, key: str, new_messages: int, now: float = None):
+        now = now or time.time()
+        state = self._state(key)
+        if state.last_poll is not None:
+            elapsed = max(now - state.last_poll, 1.0)
+            state.arrival_rate = self.alpha * (new_messages / elapsed) + (1 - self.alpha) * state.arrival_rate
+        if new_messages > 0:
+            state.empty_polls = 0
+            expected_wait = self.target_per_poll / state.arrival_rate if state.arrival_rate > 0 else self.base_interval
+            # activity means a reply is likely soon, never poll an active folder slower than the base interval
+            state.interval = min(expected_wait, self.base_interval)
+            self.drafting_pending = True
+        else:
+            state.empty_polls += 1
+            state.interval = state.interval * self.backoff
+        state.interval = min(self.max_interval, max(self.min_interval, state.interval))
+        state.last_poll = now
+        state.next_poll = now + state.interval
+
+    def is_drafting_due(self, now: float = None) -> bool:
+        now = now or time.time()
+        return self.drafting_pending and now - self.last_draft >= self.draft_interval
+
+    def record_drafting(self, now: float = None, backlog: bool = False):
+        """backlog keeps drafting pending, for a pass that stopped at its budget"""
+        self.drafting_pending = backlog
+        self.last_draft = now or time.time()
+
+    def is_retention_due(self, now: float = None) -> bool:
+        return (now or time.time()) - self.last_retention >= self.retention_interval
+
+    def record_retention(self, now: float = None):
+        self.last_retention = now or time.time()
+
+    def seconds_until_next(self, now: float = None) -> float:
+        """how long the loop can sleep before anything is due"""
+        now = now or time.time()
+        wakeups = [self._next_poll(state) for state in self.states.values()]
+        if self.drafting_pending:
+            wakeups.append(self.last_draft + self.draft_interval)
+        wakeups.append(self.last_retention + self.retention_interval)
+        if len(self.states) == 0:
+            # no folders yet, e.g. no account is set up, look for new ones after the base interval
+            wakeups.append(now + self.base_interval)
+        return max(0.0, min(wakeups) - now)
+
+    def snapshot(self) -> List[PollState]:
+        return sorted(self.states.values(), key=lambda state: state.next_poll)
@@ -0,0 +1,142 @@
+import re
+from datetime import datetime
+from typing import List, Optional
+from pydantic import BaseModel
+from sqlalchemy import text
+
+from messaging_manager.libs.bulk import get_dialect_name
+
+# On sqlite: an external content FTS5 table over unifiedmessageformat, the text is not stored twice.
+# Triggers keep it in sync with every insert, update and delete on the message table.
+# unifiedmessageformat has a text primary key, so its rowid is implicit and a full VACUUM
+# can renumber it, call rebuild_search_index after vacuuming.
+# On postgresql: a GIN expression index over the same tsvector the search query uses,
+# postgres maintains it on every write.
+FTS_TABLE = "message_fts"
+MESSAGE_TABLE = "unifiedmessageformat"
+PG_SEARCH_INDEX = "ix_unifiedmessageformat_search"
+PG_DOCUMENT = "to_tsvector('simple', coalesce(message_content, '') || ' ' || sender_name)"
+
+CREATE_STATEMENTS = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        message_content, sender_name,
+        content='{MESSAGE_TABLE}', content_rowid='rowid',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {MESSAGE_TABLE}_fts_insert AFTER INSERT ON {MESSAGE_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, message_content, sender_name)
+        VALUES (new.rowid, new.message_content, new.sender_name);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {MESSAGE_TABLE}_fts_delete AFTER DELETE ON {MESSAGE_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, message_content, sender_name)
+        VALUES ('delete', old.rowid, old.message_content, old.sender_name);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {MESSAGE_TABLE}_fts_update AFTER UPDATE ON {MESSAGE_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, message_content, sender_name)
+        VALUES ('delete', old.rowid, old.message_content, old.sender_name);
+        INSERT INTO {FTS_TABLE}(rowid, message_content, sender_name)
+        VALUES (new.rowid, new.message_content, new.sender_name);
+    END""",
+]
+
+
+class SearchResult(BaseModel):
+    message_id: str
+    service_name: str
+    source_id: str
+    sender_name: str
+    message_timestamp: datetime
+    snippet: str
+    score: float
+
+class SearchResults(BaseModel):
+    query: str
+    results: List[SearchResult]
+    next_offset: Optional[int] = None
+
+
+def create_search_index(connection):
+    """creates the fts table and triggers if needed, indexing existing messages the first time"""
+    if get_dialect_name(connection) == "postgresql":
+        connection.execute(text(f"CREATE INDEX IF NOT EXISTS {PG_SEARCH_INDEX} ON {MESSAGE_TABLE} USING GIN ({PG_DOCUMENT})"))
+        return
+
+    exists = connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                                {"name": FTS_TABLE}).first()
+    for statement in CREATE_STATEMENTS:
+        connection.execute(text(statement))
+    if exists is None:
+        connection.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+
+def rebuild_search_index(engine):
+    if get_dialect_name(engine) != "sqlite":
+        return
+    with engine.begin() as connection:
+        connection.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+
+def build_match_query(query: str) -> str:
+    """turns free text into an fts5 query, every word must match and the last one may be a prefix"""
+    terms = re.findall(r"\w+", query, flags=re.UNICODE)
+    if len(terms) == 0:
+        return ""
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+def build_tsquery(query: str) -> str:
+    """the postgres equivalent of build_match_query, for to_tsquery"""
+    terms = [term.lower() for term in re.findall(r"\w+", query, flags=re.UNICODE)]
+    if len(terms) == 0:
+        return ""
+    terms[-1] += ":*"
+    return " & ".join(terms)
+
+def search_messages(session, query: str, limit: int = 20, offset: int = 0,
+                    service_name: Optional[str] = None) -> SearchResults:
+    """ranked full text search over message content and sender names"""
+    if get_dialect_name(session) == "postgresql":
+        match_query = build_tsquery(query)
+    else:
+        match_query = build_match_query(query)
+    if match_query == "":
+        return SearchResults(query=query, results=[])
+
+    service_filter = "AND m.service_name = :service_name" if service_name else ""
+    # fetch one extra row to know whether there is another page without counting every match
+    if get_dialect_name(session) == "postgresql":
+        statement = text(f"""
+        SELECT m.message_id, m.service_name, m.source_id, m.sender_name, m.message_timestamp,
+               ts_headline('simple', coalesce(m.message_content, ''), q.query,
+                           'StartSel=[, StopSel=], MaxWords=16, MinWords=8') AS snippet,
+               -ts_rank({PG_DOCUMENT}, q.query) AS score
+        FROM {MESSAGE_TABLE} m, to_tsquery('simple', :match_query) AS q(query)
+        WHERE {PG_DOCUMENT} @@ q.query {service_filter}
+        ORDER BY score
+        LIMIT :limit OFFSET :offset
+        """)
+    else:
+        statement = text(f"""
+        SELECT m.message_id, m.service_name, m.source_id, m.sender_name, m.message_timestamp,
+               snippet({FTS_TABLE}, 0, '[', ']', '...', 16) AS snippet,
+               bm25({FTS_TABLE}) AS score
+        FROM {FTS_TABLE}
+        JOIN {MESSAGE_TABLE} m ON m.rowid = {FTS_TABLE}.rowid
+        WHERE {FTS_TABLE} MATCH :match_query {service_filter}
+        ORDER BY rank
+        LIMIT :limit OFFSET :offset
+        """)
+    rows = session.execute(statement, {"match_query": match_query, "service_name": service_name,
+                                       "limit": limit + 1, "offset": offset}).all()
+
+    results = [SearchResult(message_id=row.message_id,
+                            service_name=row.service_name,
+                            source_id=row.source_id,
+                            sender_name=row.sender_name,
+                            message_timestamp=row.message_timestamp,
+                            snippet=row.snippet or "",
+                            # both queries sort lower-is-better, flip it so higher scores rank first
+                            score=-row.score)
+               for row in rows[:limit]]
+    return SearchResults(query=query,
+                         results=results,
+                         next_offset=offset + limit if len(rows) > limit else None)
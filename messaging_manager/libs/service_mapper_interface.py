@@ -5,7 +5,7 @@ from abc import ABC, abstractmethod
 
 from pydantic import BaseModel
 from datetime import datetime
-from typing import Optional, Dict, List
+from typing import AsyncIterator, Optional, Dict, List
 from sqlmodel import Field, SQLModel, create_engine, select, Column, JSON
 
 from messaging_manager.libs.database_models import UnifiedMessageFormat, ServiceMetadata
@@ -14,6 +14,14 @@ def get_source_id(source_keys: dict[str, str]) -> str:
     # sha256 hash the source_keys
     return hashlib.sha256(json.dumps(source_keys).encode()).hexdigest()
 
+def get_account_service_name(service_name: str, account_id: Optional[str]) -> str:
+    """service name of one account, the .env account keeps the bare name so its stored ids stay valid"""
+    return service_name if account_id is None else f"{service_name}:{account_id}"
+
+def get_account_scoped_key(key: str, account_id: Optional[str]) -> str:
+    """prefixes a key that is hashed into an id, so two accounts that see the same mail or chat get different ids"""
+    return key if account_id is None else f"{account_id} {key}"
+
 class ServiceMapperInterface(ABC):
     @abstractmethod
     async def get_service_metadata(self) -> ServiceMetadata:
@@ -21,9 +29,21 @@ class ServiceMapperInterface(ABC):
     
     @abstractmethod
     async def get_new_messages(self, latest_message: UnifiedMessageFormat) -> List[UnifiedMessageFormat]:
-        """gets messages from service since last message retrieval"""
+        """gets messages from service since last message retrieval, mappers with poll folders also take folder="""
         pass
 
+    async def iter_new_messages(self, latest_message: UnifiedMessageFormat, limit_per_source: int = 40,
+                                folder: Optional[str] = None) -> AsyncIterator[List[UnifiedMessageFormat]]:
+        """new messages in batches, mappers that can fetch incrementally override this so a big sync is never held in memory at once"""
+        if folder is None:
+            yield await self.get_new_messages(latest_message, limit_per_source=limit_per_source)
+        else:
+            yield await self.get_new_messages(latest_message, limit_per_source=limit_per_source, folder=folder)
+
+    def get_poll_folders(self) -> List[Optional[str]]:
+        """folders, boxes or dialogs the scheduler can poll separately, None means the whole service in one call"""
+        return [None]
+
     @abstractmethod
     async def reply_to_message(self, message: UnifiedMessageFormat, reply_content: str) -> str:
         """replies to a message"""
@@ -0,0 +1,84 @@
+import os
+import uuid
+import hashlib
+from typing import Optional, Tuple
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from messaging_manager.libs.media_store import MediaStore
+
+THUMBNAILS_DIR = "thumbnails"
+# longest side in pixels
+THUMBNAIL_SIZES = {"small": 160, "medium": 480, "large": 1024}
+THUMBNAIL_QUALITY = 80
+# decompression bomb guard, larger images are refused instead of decoded
+MAX_SOURCE_PIXELS = 80_000_000
+
+
+class ThumbnailError(Exception):
+    pass
+
+
+class ThumbnailCache:
+    """
+    Resized copies of media images, generated on first request and kept on disk.
+
+    Store objects are keyed by their content hash so their thumbnails never go stale,
+    files outside the store are keyed by path, size and mtime.
+    """
+
+    def __init__(self, media_store: MediaStore):
+        self.media_store = media_store
+        self.thumbnails_dir = os.path.join(media_store.media_dir, THUMBNAILS_DIR)
+
+    def get_source_key(self, source_path: str) -> str:
+        content_hash = self.media_store.get_content_hash(source_path)
+        if content_hash is not None:
+            return content_hash
+        stat = os.stat(source_path)
+        return hashlib.sha256(f"{source_path} {stat.st_size} {stat.st_mtime_ns}".encode()).hexdigest()
+
+    def thumbnail_path(self, source_key: str, size_name: str, extension: str) -> str:
+        return os.path.join(self.thumbnails_dir, size_name, source_key[:2], f"{source_key}{extension}")
+
+    def get(self, source_path: str, size_name: str) -> Tuple[str, str]:
+        """(thumbnail path, source key), generating the thumbnail if it isn't cached yet"""
+        if size_name not in THUMBNAIL_SIZES:
+            raise ThumbnailError(f"Unknown thumbnail size: {size_name}")
+        source_key = self.get_source_key(source_path)
+        for extension in [".jpg", ".png"]:
+            path = self.thumbnail_path(source_key, size_name, extension)
+            if os.path.exists(path):
+                return path, source_key
+        return self._generate(source_path, source_key, size_name), source_key
+
+    def _generate(self, source_path: str, source_key: str, size_name: str) -> str:
+        try:
+            with Image.open(source_path) as image:
+                if image.width * image.height > MAX_SOURCE_PIXELS:
+                    raise ThumbnailError("Image is too large to thumbnail")
+                # draft() lets jpeg decode at a reduced scale, much cheaper for camera photos
+                image.draft("RGB", (THUMBNAIL_SIZES[size_name], THUMBNAIL_SIZES[size_name]))
+                image = ImageOps.exif_transpose(image)
+                image.thumbnail((THUMBNAIL_SIZES[size_name], THUMBNAIL_SIZES[size_name]))
+                has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+                extension = ".png" if has_alpha else ".jpg"
+                path = self.thumbnail_path(source_key, size_name, extension)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # written beside the target and renamed, concurrent requests never see a partial file
+                tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+                if has_alpha:
+                    image.save(tmp_path, "PNG", optimize=True)
+                else:
+                    image.convert("RGB").save(tmp_path, "JPEG", quality=THUMBNAIL_QUALITY, optimize=True, progressive=True)
+                os.replace(tmp_path, path)
+                return path
+        except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+            raise ThumbnailError(f"Cannot thumbnail {source_path}: {str(e)}")
+
+    def remove(self, source_key: str):
+        """drops every cached size of a source, called when its media object is deleted"""
+        for size_name in THUMBNAIL_SIZES:
+            for extension in [".jpg", ".png"]:
+                path = self.thumbnail_path(source_key, size_name, extension)
+                if os.path.exists(path):
+                    os.remove(path)
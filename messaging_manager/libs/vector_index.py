@@ -0,0 +1,217 @@
+import os
+import json
+import fcntl
+import numpy as np
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class VectorIndex:
+    """
+    Append-only vector index backed by a memory-mapped float32 file.
+
+    Layout inside index_dir:
+        meta.json    - {"dim": int, "model": str}
+        vectors.f32  - row-major float32 matrix, one L2-normalized row per message
+        ids.txt      - one message_id per line, line N belongs to row N
+
+    Rows are only ever appended, so an embedded message is never embedded again.
+    Because rows are normalized at insert time, cosine similarity is a plain dot product.
+    One process writes an index, it holds writer.lock while the index is open. Others can open it
+    read_only and refresh() to pick up new rows.
+    """
+
+    def __init__(self, index_dir: str, model: str = "nomic-embed-text", read_only: bool = False):
+        self.index_dir = index_dir
+        self.model = model
+        self.read_only = read_only
+        self.meta_path = os.path.join(index_dir, "meta.json")
+        self.vectors_path = os.path.join(index_dir, "vectors.f32")
+        self.ids_path = os.path.join(index_dir, "ids.txt")
+        self.lock_path = os.path.join(index_dir, "writer.lock")
+
+        if not os.path.exists(index_dir):
+            os.makedirs(index_dir)
+
+        self._lock_file = None
+        if not read_only:
+            # the crash repair in _load truncates both files, which would cut off rows another writer is appending
+            self._lock_file = open(self.lock_path, "a")
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self._lock_file.close()
+                raise RuntimeError(f"{index_dir} is already open for writing in another process, open it read_only")
+
+        self.dim = None
+        self.ids: List[str] = []
+        self.id_to_row: Dict[str, int] = {}
+        # bytes of ids.txt read so far, refresh() continues from here
+        self.ids_offset = 0
+        self._vectors = None
+        self._load()
+
+    def _read_ids(self, offset: int, limit: Optional[int] = None) -> Tuple[List[str], int]:
+        """up to limit complete lines of ids.txt after offset, and the offset after them"""
+        ids = []
+        if not os.path.exists(self.ids_path):
+            return ids, offset
+        with open(self.ids_path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        for line in data.splitlines(keepends=True):
+            # a line without its newline is still being written
+            if not line.endswith(b"\n") or (limit is not None and len(ids) >= limit):
+                break
+            offset += len(line)
+            if line.strip():
+                ids.append(line.strip().decode())
+        return ids, offset
+
+    def _vector_rows(self) -> int:
+        return os.path.getsize(self.vectors_path) // (self.dim * 4) if os.path.exists(self.vectors_path) else 0
+
+    def _load(self):
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r") as f:
+                meta = json.load(f)
+            self.dim = meta["dim"]
+            self.model = meta.get("model", self.model)
+
+        if self.dim is None:
+            self.ids = []
+            return
+
+        vector_rows = self._vector_rows()
+        if self.read_only:
+            # the writer may be appending right now, only rows with both parts written are used
+            self.ids, self.ids_offset = self._read_ids(0, limit=vector_rows)
+        else:
+            self.ids, self.ids_offset = self._read_ids(0)
+            # vectors are written before ids, so after a crash there may be trailing rows without an id
+            rows = min(vector_rows, len(self.ids))
+            if vector_rows != rows:
+                with open(self.vectors_path, "r+b") as f:
+                    f.truncate(rows * self.dim * 4)
+            if len(self.ids) != rows or (os.path.exists(self.ids_path) and os.path.getsize(self.ids_path) != self.ids_offset):
+                self.ids = self.ids[:rows]
+                with open(self.ids_path, "w") as f:
+                    f.write("".join(f"{message_id}\n" for message_id in self.ids))
+                self.ids_offset = os.path.getsize(self.ids_path)
+
+        self.id_to_row = {message_id: row for row, message_id in enumerate(self.ids)}
+        self._remap()
+
+    def close(self):
+        """releases the writer lock, the index can't be added to after this"""
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+        self.read_only = True
+
+    def refresh(self) -> int:
+        """picks up the rows the writing process appended since the last load or refresh, returns how many"""
+        if self.dim is None:
+            self._load()
+            return len(self.ids)
+        new_ids, self.ids_offset = self._read_ids(self.ids_offset, limit=max(0, self._vector_rows() - len(self.ids)))
+        if len(new_ids) == 0:
+            return 0
+        for message_id in new_ids:
+            self.id_to_row[message_id] = len(self.ids)
+            self.ids.append(message_id)
+        self._remap()
+        return len(new_ids)
+
+    def _remap(self):
+        if self.dim is None or len(self.ids) == 0:
+            self._vectors = None
+            return
+        self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(len(self.ids), self.dim))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, message_id: str) -> bool:
+        return message_id in self.id_to_row
+
+    def missing(self, message_ids: Iterable[str]) -> List[str]:
+        """returns the message ids that have not been embedded yet"""
+        return [message_id for message_id in message_ids if message_id not in self.id_to_row]
+
+    def add(self, message_ids: List[str], vectors: List[List[float]]) -> int:
+        """appends vectors for message ids that are not in the index yet, returns the number of rows added"""
+        if self.read_only:
+            raise ValueError("This vector index is read only, rows are added by the process that writes it")
+        if len(message_ids) != len(vectors):
+            raise ValueError("message_ids and vectors must be the same length")
+
+        new_ids = []
+        new_vectors = []
+        for message_id, vector in zip(message_ids, vectors):
+            if message_id in self.id_to_row or message_id in new_ids:
+                continue
+            new_ids.append(message_id)
+            new_vectors.append(vector)
+        if len(new_ids) == 0:
+            return 0
+
+        matrix = np.asarray(new_vectors, dtype=np.float32)
+        if self.dim is None:
+            self.dim = int(matrix.shape[1])
+            with open(self.meta_path, "w") as f:
+                json.dump({"dim": self.dim, "model": self.model}, f)
+        elif matrix.shape[1] != self.dim:
+            raise ValueError(f"Expected vectors of dimension {self.dim}, got {matrix.shape[1]}")
+
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix = matrix / norms
+
+        with open(self.vectors_path, "ab") as f:
+            f.write(matrix.astype(np.float32).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.ids_path, "a") as f:
+            f.write("".join(f"{message_id}\n" for message_id in new_ids))
+        self.ids_offset = os.path.getsize(self.ids_path)
+
+        for message_id in new_ids:
+            self.id_to_row[message_id] = len(self.ids)
+            self.ids.append(message_id)
+        self._remap()
+        return len(new_ids)
+
+    def get_vector(self, message_id: str) -> Optional[np.ndarray]:
+        row = self.id_to_row.get(message_id)
+        if row is None or self._vectors is None:
+            return None
+        return np.array(self._vectors[row])
+
+    def search(self, query_vector, k: int = 5, exclude_ids: Optional[Iterable[str]] = None) -> List[Tuple[str, float]]:
+        """top-k cosine search, returns [(message_id, score)] best first"""
+        if self._vectors is None or k <= 0:
+            return []
+
+        query = np.asarray(query_vector, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+        query = query / norm
+
+        exclude_ids = set(exclude_ids or [])
+        scores = self._vectors @ query
+
+        # over-fetch so excluded rows don't shrink the result below k
+        candidates = min(len(scores), k + len(exclude_ids))
+        top_rows = np.argpartition(-scores, candidates - 1)[:candidates]
+        top_rows = top_rows[np.argsort(-scores[top_rows])]
+
+        results = []
+        for row in top_rows:
+            message_id = self.ids[row]
+            if message_id in exclude_ids:
+                continue
+            results.append((message_id, float(scores[row])))
+            if len(results) >= k:
+                break
+        return results
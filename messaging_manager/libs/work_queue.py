@@ -0,0 +1,112 @@
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional
+from sqlalchemy import update, delete, or_
+from sqlmodel import Session, select, func
+
+from messaging_manager.libs.database_models import DraftQueueItem
+from messaging_manager.libs.bulk import bulk_insert_ignore
+
+# source ids per UPDATE
+MARK_BATCH_SIZE = 500
+
+
+def get_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class DraftWorkQueue:
+    """
+    Conversations waiting for a draft, shared by every worker through the DraftQueueItem table.
+
+    Ingest marks conversations dirty, draft workers claim them with a lease. Claiming is a
+    conditional UPDATE on an expired or missing lease, so two workers can never hold the same
+    conversation on sqlite or postgresql. If new messages arrive while a conversation is leased
+    its version moves on and completing the old version keeps it queued. A worker that dies
+    loses its leases after lease_seconds, a failed draft is retried with exponential backoff.
+    """
+
+    def __init__(self, db_engine, lease_seconds: float = 900, retry_seconds: float = 60, max_retry_seconds: float = 3600):
+        self.db_engine = db_engine
+        self.lease_seconds = lease_seconds
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+
+    def mark_dirty(self, session: Session, source_ids: Iterable[str]):
+        """queues conversations that got new messages, the caller commits the session"""
+        source_ids = sorted(set(source_ids))
+        if len(source_ids) == 0:
+            return
+        now = datetime.now()
+        # insert first and bump every row after, two ingest processes queueing the same new conversation
+        # both bump its version instead of one of them finding it missing and its insert being ignored
+        bulk_insert_ignore(session, DraftQueueItem.__table__,
+                           [{"source_id": source_id, "version": 0, "dirty_at": now, "attempts": 0}
+                            for source_id in source_ids])
+        for start in range(0, len(source_ids), MARK_BATCH_SIZE):
+            session.exec(update(DraftQueueItem)
+                         .where(DraftQueueItem.source_id.in_(source_ids[start:start + MARK_BATCH_SIZE]))
+                         .values(version=DraftQueueItem.version + 1, dirty_at=now))
+
+    def _available(self, now: datetime):
+        return or_(DraftQueueItem.lease_expires_at == None, DraftQueueItem.lease_expires_at < now)
+
+    def get_available(self, session: Session) -> List[str]:
+        """source ids nobody holds a lease on"""
+        return session.exec(select(DraftQueueItem.source_id)
+                            .where(self._available(datetime.now()))).all()
+
+    def count_pending(self, session: Session) -> int:
+        return session.exec(select(func.count()).select_from(DraftQueueItem)).one()
+
+    def claim(self, worker_id: str, source_ids: List[str], limit: int) -> List[str]:
+        """leases up to limit of source_ids in the given order, skipping ones another worker got first"""
+        claimed = []
+        for source_id in source_ids:
+            if len(claimed) >= limit:
+                break
+            now = datetime.now()
+            with self.db_engine.begin() as connection:
+                result = connection.execute(update(DraftQueueItem)
+                                            .where(DraftQueueItem.source_id == source_id, self._available(now))
+                                            .values(leased_by=worker_id,
+                                                    leased_version=DraftQueueItem.version,
+                                                    lease_expires_at=now + timedelta(seconds=self.lease_seconds)))
+            if result.rowcount == 1:
+                claimed.append(source_id)
+        return claimed
+
+    def complete(self, worker_id: str, source_id: str):
+        """removes a drafted conversation, unless it got new messages while it was leased"""
+        with self.db_engine.begin() as connection:
+            deleted = connection.execute(delete(DraftQueueItem)
+                                         .where(DraftQueueItem.source_id == source_id,
+                                                DraftQueueItem.leased_by == worker_id,
+                                                DraftQueueItem.version == DraftQueueItem.leased_version)).rowcount
+            if deleted == 0:
+                connection.execute(update(DraftQueueItem)
+                                   .where(DraftQueueItem.source_id == source_id, DraftQueueItem.leased_by == worker_id)
+                                   .values(leased_by=None, leased_version=None, lease_expires_at=None, attempts=0))
+
+    def release(self, worker_id: str, source_id: str, error: Optional[str] = None):
+        """gives a lease back, after an error the conversation waits out a backoff before it can be claimed again"""
+        with self.db_engine.begin() as connection:
+            if error is None:
+                connection.execute(update(DraftQueueItem)
+                                   .where(DraftQueueItem.source_id == source_id, DraftQueueItem.leased_by == worker_id)
+                                   .values(leased_by=None, leased_version=None, lease_expires_at=None))
+                return
+            attempts = connection.execute(select(DraftQueueItem.attempts)
+                                          .where(DraftQueueItem.source_id == source_id)).scalar() or 0
+            delay = min(self.max_retry_seconds, self.retry_seconds * 2 ** attempts)
+            connection.execute(update(DraftQueueItem)
+                               .where(DraftQueueItem.source_id == source_id, DraftQueueItem.leased_by == worker_id)
+                               .values(leased_by=None, leased_version=None, attempts=attempts + 1,
+                                       lease_expires_at=datetime.now() + timedelta(seconds=delay)))
+
+    def discard(self, session: Session, source_ids: Iterable[str]):
+        """drops queue items of conversations that no longer have messages, the caller commits the session"""
+        source_ids = list(source_ids)
+        if len(source_ids) > 0:
+            session.exec(delete(DraftQueueItem).where(DraftQueueItem.source_id.in_(source_ids)))
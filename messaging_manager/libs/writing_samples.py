@@ -0,0 +1,176 @@
+from collections import deque
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from sqlmodel import Session, select
+
+from messaging_manager.libs.database_models import UnifiedMessageFormat, WritingSample
+from messaging_manager.libs.bulk import iter_batches
+from messaging_manager.libs.graph_index import REFRESH_OVERLAP
+
+
+def get_recipient_id(message: UnifiedMessageFormat) -> str:
+    """the other party of a conversation, falls back to the conversation id"""
+    source_keys = message.source_keys or {}
+    return str(source_keys.get("peer_id") or source_keys.get("other_party_id") or message.source_id)
+
+
+class WritingSampleIndex:
+    """
+    Index of the user's own outgoing messages, used as style examples when drafting.
+
+    WritingSample rows are the persisted index, they are written alongside new messages so
+    the message table is only scanned once to backfill an empty index. In memory the newest
+    samples are kept in bounded deques per (service, recipient) and per service, so lookups
+    never touch the database and cost the same no matter how much mail has been stored.
+    """
+
+    def __init__(self, db_engine, samples_per_key: int = 20):
+        self.db_engine = db_engine
+        self.samples_per_key = samples_per_key
+        self._reset()
+
+    def _reset(self):
+        self.by_recipient: Dict[Tuple[str, str], deque] = {}
+        self.by_service: Dict[str, deque] = {}
+        # newest created_at read from the database, refresh() continues from there
+        self.created_through: Optional[datetime] = None
+        self.loaded = False
+
+    def _push(self, buckets: dict, key, sample: WritingSample):
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = deque(maxlen=self.samples_per_key)
+            buckets[key] = bucket
+        if any(existing.message_id == sample.message_id for existing in bucket):
+            return
+        if len(bucket) > 0 and sample.message_timestamp < bucket[-1].message_timestamp:
+            # out of order arrival, e.g. the sent folder is pulled before the inbox
+            ordered = sorted(list(bucket) + [sample], key=lambda s: s.message_timestamp)
+            bucket.clear()
+            bucket.extend(ordered[-self.samples_per_key:])
+        else:
+            bucket.append(sample)
+
+    def _remember(self, sample: WritingSample):
+        self._push(self.by_recipient, (sample.service_name, sample.recipient_id), sample)
+        self._push(self.by_service, sample.service_name, sample)
+
+    def load(self):
+        """
+        loads the index, backfilling it from stored messages the first time. the backfill writes
+        through its own session, so load before opening a session that writes
+        """
+        self._reset()
+        try:
+            with Session(self.db_engine) as session:
+                if session.exec(select(WritingSample.message_id).limit(1)).first() is None:
+                    # committed once, an interrupted backfill doesn't leave a partial index that looks complete
+                    with Session(self.db_engine) as write_session:
+                        for sent_messages in iter_batches(session, select(UnifiedMessageFormat)
+                                                          .where(UnifiedMessageFormat.sender_name == "user")):
+                            self._add(write_session, sent_messages)
+                            write_session.flush()
+                            write_session.expunge_all()
+                        write_session.commit()
+                    self._seen(datetime.now())
+                else:
+                    self._read(session, None)
+        except Exception:
+            self._reset()
+            raise
+        self.loaded = True
+
+    def _read(self, session: Session, since: Optional[datetime]) -> int:
+        """reads the samples stored since, all of them for None, returns how many"""
+        query = select(WritingSample).order_by(WritingSample.message_timestamp)
+        if since is not None:
+            query = query.where(WritingSample.created_at >= since)
+        read = 0
+        for samples in iter_batches(session, query):
+            for sample in samples:
+                self._remember(WritingSample.model_validate(sample))
+                self._seen(sample.created_at)
+                read += 1
+        return read
+
+    def _seen(self, created_at: Optional[datetime]):
+        if created_at is not None and (self.created_through is None or created_at > self.created_through):
+            self.created_through = created_at
+
+    def refresh(self) -> int:
+        """picks up the samples another process stored since the last load or refresh, returns how many were read"""
+        if not self.loaded:
+            self.load()
+            return sum(len(bucket) for bucket in self.by_service.values())
+        # samples committed a little after newer ones were read are read again instead of missed
+        since = self.created_through - REFRESH_OVERLAP if self.created_through is not None else None
+        with Session(self.db_engine) as session:
+            return self._read(session, since)
+
+    def add_messages(self, session: Session, messages: Iterable[UnifiedMessageFormat]) -> int:
+        """adds the user's outgoing messages to the index, the caller commits the session"""
+        if not self.loaded:
+            # rows written before the first load would make it skip the backfill of older messages
+            raise RuntimeError("load the writing sample index before adding messages")
+        return self._add(session, messages)
+
+    def _add(self, session: Session, messages: Iterable[UnifiedMessageFormat]) -> int:
+        samples = []
+        for message in messages:
+            if message.sender_name != "user" or not message.message_content:
+                continue
+            samples.append(WritingSample(
+                message_id=message.message_id,
+                service_name=message.service_name,
+                recipient_id=get_recipient_id(message),
+                source_id=message.source_id,
+                message_content=message.message_content,
+                message_timestamp=message.message_timestamp
+            ))
+        if len(samples) == 0:
+            return 0
+
+        existing_ids = set(session.exec(select(WritingSample.message_id)
+                                        .where(WritingSample.message_id.in_([s.message_id for s in samples]))).all())
+        samples = [sample for sample in samples if sample.message_id not in existing_ids]
+        samples.sort(key=lambda s: s.message_timestamp)
+        for sample in samples:
+            session.add(WritingSample(**sample.model_dump()))
+            self._remember(sample)
+        return len(samples)
+
+    def get_samples(self, service_name: str, recipient_id: str, k: int = 5,
+                    query_vector=None, vector_index=None,
+                    exclude_ids: Optional[Iterable[str]] = None) -> List[WritingSample]:
+        """
+        Returns up to k samples, preferring ones sent to this recipient and topping up from the service.
+        With a query vector and vector index the candidates are ranked by similarity, otherwise newest first.
+        """
+        if not self.loaded:
+            self.load()
+
+        exclude_ids = set(exclude_ids or [])
+        candidates = []
+        seen = set()
+        for bucket in (self.by_recipient.get((service_name, recipient_id)), self.by_service.get(service_name)):
+            if bucket is None:
+                continue
+            for sample in reversed(bucket):
+                if sample.message_id in exclude_ids or sample.message_id in seen:
+                    continue
+                seen.add(sample.message_id)
+                candidates.append(sample)
+
+        if query_vector is not None and vector_index is not None:
+            query = np.asarray(query_vector, dtype=np.float32)
+            scored = []
+            for position, sample in enumerate(candidates):
+                vector = vector_index.get_vector(sample.message_id)
+                score = float(vector @ query) if vector is not None else -1.0
+                # recipient samples come first in candidates, keep that as the tie breaker
+                scored.append((score, -position, sample))
+            scored.sort(key=lambda item: (item[0], item[1]), reverse=True)
+            candidates = [sample for _, _, sample in scored]
+
+        return candidates[:k]
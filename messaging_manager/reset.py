@@ -1,9 +1,18 @@
 import os
 import shutil
-from sqlmodel import create_engine, SQLModel
+from sqlalchemy.engine import make_url
+from sqlmodel import SQLModel
+from messaging_manager.libs.migrations import migrate_database
+from messaging_manager.libs.database import create_database_engine, get_database_url
 
 def reset_database_and_media():
-    """Reset the database and media directory"""
+    """Reset the database, media and vector index directories"""
+    # the vector index only holds vectors of the messages deleted below
+    memory_dir = "memory"
+    if os.path.exists(memory_dir):
+        print(f"Removing memory directory: {memory_dir}")
+        shutil.rmtree(memory_dir)
+
     media_dir = "media"
     if os.path.exists(media_dir):
         print(f"Removing media directory: {media_dir}")
@@ -11,16 +20,25 @@ def reset_database_and_media():
     os.makedirs(media_dir)
     print(f"Created fresh media directory: {media_dir}")
 
-    # Delete the messages.db file
-    db_path = "messages.db"
-    if os.path.exists(db_path):
-        print(f"Removing database file: {db_path}")
-        os.remove(db_path)
+    database_url = get_database_url()
+    url = make_url(database_url)
+    if url.get_backend_name() == "sqlite":
+        # Delete the messages.db file
+        db_path = url.database
+        # the -wal and -shm files belong to the database in WAL mode and must go with it
+        for path in [db_path, f"{db_path}-wal", f"{db_path}-shm"]:
+            if os.path.exists(path):
+                print(f"Removing database file: {path}")
+                os.remove(path)
+        engine = create_database_engine(database_url)
+    else:
+        engine = create_database_engine(database_url)
+        print(f"Dropping all tables in: {url.render_as_string(hide_password=True)}")
+        SQLModel.metadata.drop_all(engine)
 
     # Create a new empty database
-    engine = create_engine(f"sqlite:///{db_path}")
-    SQLModel.metadata.create_all(engine)
-    print(f"Created fresh database: {db_path}")
+    migrate_database(engine)
+    print(f"Created fresh database: {url.render_as_string(hide_password=True)}")
     
     print("Reset complete!")
 
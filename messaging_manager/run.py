@@ -1,21 +1,52 @@
 import os
+import time
 import shutil
 import asyncio
 from pydantic import BaseModel
-from typing import Optional
+from typing import Dict, Optional, Tuple
 from messaging_manager.service_mappers.telegram import TelegramServiceMapper
 from messaging_manager.service_mappers.gmail import GmailServiceMapper
-from messaging_manager.libs.common import call_ollama_chat, Message, call_ollama_vision, ToolSchema
+from messaging_manager.libs.common import call_ollama_chat, Message, call_ollama_vision, ToolSchema, embed_batch_with_ollama
+from messaging_manager.libs.vector_index import VectorIndex
+from messaging_manager.libs.writing_samples import WritingSampleIndex, get_recipient_id
+from messaging_manager.libs.graph_index import GraphIndex, REFRESH_OVERLAP
+from messaging_manager.libs.database import get_engine, get_async_session
+from messaging_manager.libs.drafts import DraftSummary, link_draft_messages, load_draft_messages_async, summarize_draft
+from messaging_manager.libs.events import event_bus, DRAFT_CREATED, DRAFT_STATUS_CHANGED, PIPELINE_PROGRESS
+from messaging_manager.libs.bulk import bulk_insert_ignore, iter_batches
+from messaging_manager.libs.retention import RetentionManager
+from messaging_manager.libs.media_store import MediaStore
+from messaging_manager.libs.scheduler import PollScheduler, get_poll_key
+from messaging_manager.libs.drafting_queue import DraftPriority, DraftBudget
+from messaging_manager.libs.work_queue import DraftWorkQueue, get_worker_id
+from messaging_manager.libs.accounts import AccountsConfig, load_accounts_config
+from messaging_manager.libs.backpressure import BoundedBuffer
+from messaging_manager.libs.email_threading import EmailThreadIndex
 import json
 from messaging_manager.libs.service_mapper_interface import ServiceMapperInterface
 from datetime import datetime, timedelta
-from sqlmodel import create_engine, Session, SQLModel, select
+from sqlmodel import create_engine, Session, SQLModel, select, func
 import uuid
 from typing import List
 from sqlmodel import Field,  Column, JSON
 import hashlib
+import numpy as np
 from messaging_manager.libs.database_models import DraftResponse, UnifiedMessageFormat, ServiceMetadata
 
+# drafting limits of one scheduled pass, the model calls dominate so these bound gpu time
+DRAFT_BUDGET_DRAFTS = 20
+DRAFT_BUDGET_SECONDS = 600
+# messages buffered between fetching and persisting, fetching pauses at the high watermark until the low one
+BUFFER_HIGH_WATERMARK = 1000
+BUFFER_LOW_WATERMARK = 250
+# messages per commit while pulling
+PERSIST_BATCH_SIZE = 200
+# queued conversations at which polling slows down, and where it returns to normal
+DRAFT_BACKLOG_HIGH = 500
+DRAFT_BACKLOG_LOW = 100
+# conversations leased per claim, small so messages arriving mid pass are ranked in quickly
+DRAFT_CLAIM_BATCH = 4
+
 def get_system_prompt():
     # TODO: add in extra context, like user name and profile
     return """You will be provided recent messages between User A and User B, your task is to determine if User A needs to respond next in the conversation and if so draft an appropriate response.
@@ -60,11 +91,15 @@ def get_contextual_caption(server_url, image_path, chat_context):
     print("~" * 100)
     return parsed_response.final_description
 
+def get_embedding_text(message: UnifiedMessageFormat) -> str:
+    return f"{message.sender_name}: {message.message_content or ''}"
 
+def publish_progress(stage: str, **data):
+    event_bus.publish(PIPELINE_PROGRESS, {"stage": stage, **data})
 
     
 class LoopManager:
-    def __init__(self, db_engine, media_dir):
+    def __init__(self, db_engine, media_dir, memory_dir="memory", read_only_vectors=False):
         import dotenv
         dotenv.load_dotenv()
         self.server_url = os.getenv("OLLAMA_SERVER_URL")
@@ -77,17 +112,44 @@ class LoopManager:
         session_key = "session one"
 
         self.media_dir = media_dir
+        self.media_store = MediaStore(media_dir)
+        # draft workers read the index the ingesting process writes
+        self.vector_index = VectorIndex(os.path.join(memory_dir, "vectors"), read_only=read_only_vectors)
+        # newest created_at the embedding scan has read, later scans start there
+        self.embedded_through: Optional[datetime] = None
     
         self.db_engine = db_engine
-        self.service_mappers = [
-            GmailServiceMapper(
-                init_keys={"email": email_address, 
-                        "password": password,
-                        "credentials_file_path": gmail_credentials_file_path,
-                        "latest_message_timestamp": datetime.now() - timedelta(days=30)},
-                media_dir=media_dir
-            )            
-        ]
+        self.writing_samples = WritingSampleIndex(db_engine)
+        self.graph_index = GraphIndex(db_engine)
+        self.thread_index = EmailThreadIndex()
+        self.retention = RetentionManager(db_engine, media_dir)
+        # held by whatever runs the pipeline, scheduled cycles and queued jobs never overlap
+        self.pipeline_lock = asyncio.Lock()
+        self.draft_priority = DraftPriority()
+        self.work_queue = DraftWorkQueue(db_engine)
+        self.worker_id = get_worker_id()
+        # per pass limits of the scheduled loop, a backlog is worked off over several passes
+        self.draft_budget = DraftBudget(max_drafts=DRAFT_BUDGET_DRAFTS, max_seconds=DRAFT_BUDGET_SECONDS)
+        # set by run_continuous_loop, None when nothing runs on a schedule
+        self.scheduler: Optional[PollScheduler] = None
+        # accounts.json lists the accounts, without it the single account from .env is used
+        self.accounts_config = load_accounts_config()
+        if self.accounts_config is not None:
+            self.service_mappers = create_service_mappers(self.accounts_config, media_dir)
+        else:
+            self.accounts_config = AccountsConfig(max_concurrency=1)
+            self.service_mappers = [
+                GmailServiceMapper(
+                    init_keys={"email": email_address, 
+                            "password": password,
+                            "credentials_file_path": gmail_credentials_file_path,
+                            "latest_message_timestamp": datetime.now() - timedelta(days=30)},
+                    media_dir=media_dir
+                )            
+            ]
+        self.global_account_limit = asyncio.Semaphore(self.accounts_config.max_concurrency)
+        self.account_concurrency = {account.account_id: account.max_concurrency for account in self.accounts_config.accounts}
+        self.account_limits: Dict[ServiceMapperInterface, asyncio.Semaphore] = {}
 
         """
         TelegramServiceMapper(
@@ -101,141 +163,476 @@ class LoopManager:
     def add_service_mapper(self, service_mapper: ServiceMapperInterface):
         self.service_mappers.append(service_mapper)
                
-    async def pull_latest_messages(self):
-        latest_messages = []
-        service_metadata = {}
+    def get_account_limit(self, service_mapper: ServiceMapperInterface) -> asyncio.Semaphore:
+        """per account limit, pulls and sends on one mapper share its connection"""
+        if service_mapper not in self.account_limits:
+            account_id = getattr(service_mapper, "account_id", None)
+            self.account_limits[service_mapper] = asyncio.Semaphore(self.account_concurrency.get(account_id, 1))
+        return self.account_limits[service_mapper]
+
+    def get_latest_message(self, service_name: str, folder: Optional[str] = None) -> Optional[UnifiedMessageFormat]:
+        """the newest stored message of an account, or of one of its folders"""
+        query = (select(UnifiedMessageFormat)
+                 .where(UnifiedMessageFormat.service_name == service_name)
+                 .order_by(UnifiedMessageFormat.message_timestamp.desc()))
+        if folder is not None:
+            # walks the (service_name, message_timestamp) index from the newest message to the newest one in the folder
+            query = query.where(UnifiedMessageFormat.source_keys["box"].as_string() == folder)
         with Session(self.db_engine) as session:
-            for service_mapper in self.service_mappers:
-                if not await service_mapper.is_logged_in():
-                    await service_mapper.login()
-                
+            return session.exec(query).first()
+
+    async def fetch_account(self, service_mapper: ServiceMapperInterface, buffer: BoundedBuffer,
+                            scheduler: PollScheduler = None) -> List[str]:
+        """streams the new messages of one account into buffer, returns the poll keys it polled"""
+        polled_keys = []
+        async with self.global_account_limit, self.get_account_limit(service_mapper):
+            try:
                 metadata = await service_mapper.get_service_metadata()
-                service_metadata[metadata.service_name] = metadata
+                folders = service_mapper.get_poll_folders()
+                if scheduler is not None:
+                    folders = [folder for folder in folders
+                               if scheduler.is_due(get_poll_key(metadata.service_name, folder))]
+                if len(folders) == 0:
+                    return polled_keys
+                # folders that fail count as empty polls, so a broken account backs off instead of being retried every second
+                polled_keys = [get_poll_key(metadata.service_name, folder) for folder in folders]
 
-                # get the latest message from the database
-                latest_message = session.exec(select(UnifiedMessageFormat)
-                                            .where(UnifiedMessageFormat.service_name == metadata.service_name)
-                                            .order_by(UnifiedMessageFormat.message_timestamp.desc())).first()
+                if not await service_mapper.is_logged_in():
+                    await service_mapper.login()
 
-                latest_messages.extend(await service_mapper.get_new_messages(latest_message, limit_per_source=40))
+                for folder in folders:
+                    key = get_poll_key(metadata.service_name, folder)
+                    # every folder continues from its own newest stored message, the sent folder can lag behind the inbox
+                    latest_message = await asyncio.to_thread(self.get_latest_message, metadata.service_name, folder)
+                    # put() waits while the buffer is above its high watermark, that is what slows fetching down
+                    async for messages in service_mapper.iter_new_messages(latest_message, limit_per_source=40, folder=folder):
+                        if len(messages) > 0:
+                            await buffer.put((key, messages), len(messages))
                 await service_mapper.logout()
-            
-            # get the messages from all the message ids
-            message_ids = [message.message_id for message in latest_messages]
-            existing_messages = session.exec(select(UnifiedMessageFormat)
-                                            .where(UnifiedMessageFormat.message_id.in_(message_ids))).all()
-            existing_message_ids = [message.message_id for message in existing_messages]
+            except Exception as e:
+                print(f"Error pulling {getattr(service_mapper, 'service_name', type(service_mapper).__name__)}: {str(e)}")
+        return polled_keys
+
+    def load_indexes(self):
+        """loads the indexes that are written alongside new messages"""
+        if not self.writing_samples.loaded:
+            self.writing_samples.load()
+        if not self.graph_index.loaded:
+            self.graph_index.load()
+
+    def persist_messages(self, keyed_messages: List[Tuple[str, UnifiedMessageFormat]]) -> Dict[str, int]:
+        """stores one batch of fetched messages and everything derived from them in one commit, returns new messages per poll key"""
+        keys_by_id = {}
+        messages_by_id = {}
+        for key, message in keyed_messages:
+            keys_by_id.setdefault(message.message_id, key)
+            messages_by_id.setdefault(message.message_id, message)
+
+        # a first load backfills through a session of its own, so it has to happen before this one takes the write lock
+        self.load_indexes()
+        with Session(self.db_engine) as session:
+            existing_message_ids = set(session.exec(select(UnifiedMessageFormat.message_id)
+                                                    .where(UnifiedMessageFormat.message_id.in_(list(messages_by_id)))).all())
+            # emails stored before they were keyed by Message-ID are stored under their legacy id
+            legacy_ids = {message.source_keys["legacy_message_id"]: message_id for message_id, message in messages_by_id.items()
+                          if (message.source_keys or {}).get("legacy_message_id")}
+            if len(legacy_ids) > 0:
+                existing_message_ids.update(legacy_ids[legacy_id] for legacy_id in session.exec(
+                    select(UnifiedMessageFormat.message_id).where(UnifiedMessageFormat.message_id.in_(list(legacy_ids)))).all())
             # NOTE: this will only add new messages to the database, it will not update the latest message id for the service mapper
-            latest_messages = [message for message in latest_messages if message.message_id not in existing_message_ids]
+            new_messages = [message for message_id, message in messages_by_id.items() if message_id not in existing_message_ids]
+            # emails move to the conversation their reply headers point at before anything is keyed on it
+            self.thread_index.assign(session, new_messages)
             
-            session.add_all(latest_messages)
+            # stamped at commit time rather than at fetch time, the embedding scan reads messages by it
+            stored_at = datetime.now()
+            for message in new_messages:
+                message.created_at = stored_at
+            bulk_insert_ignore(session, UnifiedMessageFormat.__table__,
+                               [message.model_dump() for message in new_messages])
+            self.media_store.add_references(session, new_messages)
+            self.writing_samples.add_messages(session, new_messages)
+            self.graph_index.add_messages(session, new_messages)
+            self.work_queue.mark_dirty(session, [message.source_id for message in new_messages])
             session.commit()
-        return latest_messages
-    
-    async def process_messages(self):
-        # get all messages, group by source ID, limited to 40 messages per source
-        with Session(self.db_engine) as session:
-            all_messages = select(UnifiedMessageFormat)
-            all_messages = session.exec(all_messages).all()
-            messages_by_source_id = {}
-            for message in all_messages:
-                if message.source_id not in messages_by_source_id:
-                    messages_by_source_id[message.source_id] = []
-                messages_by_source_id[message.source_id].append(message)
-                if len(messages_by_source_id[message.source_id]) > 40:
-                    messages_by_source_id[message.source_id].pop(0)
-            
-            
 
-            for source_id, messages in messages_by_source_id.items():
-                # sha256 hash the message ids
-                message_ids = [message.message_id for message in messages]
-                message_ids_hash = hashlib.sha256(json.dumps(message_ids).encode()).hexdigest()
-
-                # check if the draft response already exists, if the messages havent changed, we can skip the draft response
-                draft_response = session.exec(select(DraftResponse)
-                                            .where(DraftResponse.draft_response_id == message_ids_hash)).first()
-                if draft_response:
-                    print("Draft response already exists")
-                    continue
-
-                system_prompt = get_system_prompt()
-                user_prompt = """Please determine if User A needs to respond next in the conversion and if so draft an appropriate response.
-                If you determine that User A does not need to respond, set the response_needed to False.
-                """
-
-                # TODO: pull in writing samples from stored messages
-
-                file_paths = []
-                for message in messages:
-                    # TODO add time as "minutes ago" "hours ago" "days ago" etc
-                    # TODO add media to the prompt
-                    user_name = "User A"
-                    if message.sender_name != "user":
-                        user_name = "User B"
-                    
-                    user_prompt += f"{user_name}: {message.message_content}\n"
-                    
-                    image_extensions = [".jpg", ".png", ".JPG", ".PNG", ".jpeg", ".JPEG"]
-
-                    for file_path in message.file_paths:
-                        file_paths.append(file_path)
-                        if any(file_path.endswith(ext) for ext in image_extensions):    
-                            caption = get_contextual_caption(self.server_url, file_path, user_prompt)
-                            user_prompt += f"{user_name}: shared an image. Description: [{caption}]\n"
-                        elif file_path.endswith(".txt"):
-                            with open(file_path, "r") as f:
-                                user_prompt += f"{user_name}: shared a file. File content: [{f.read()}]\n"
-                        elif file_path.endswith(".mp4"):
-                            pass
-                        else:
-                            user_prompt += f"{user_name}: shared file: [{file_path}]\n"
-                    
-                user_prompt += f"\nPlease respond with the following JSON format: \n{DraftResponseSchema.model_json_schema()}"
-
-                ollama_messages = [Message(role="system", content=system_prompt)]
-                ollama_messages.append(Message(role="user", content=user_prompt))
-
-                response = call_ollama_chat(self.server_url, "Qwen2.5-14B-Instruct-1M-GGUF", ollama_messages, json_schema=DraftResponseSchema.model_json_schema())
-                parsed_draft_response = DraftResponseSchema.model_validate_json(response)    
+        new_by_key = {}
+        for message in new_messages:
+            key = keys_by_id[message.message_id]
+            new_by_key[key] = new_by_key.get(key, 0) + 1
+        return new_by_key
 
+    async def pull_latest_messages(self, scheduler: PollScheduler = None) -> int:
+        """
+        pulls every folder of every account, or only the folders the scheduler says are due, returns the number of new messages.
+        accounts stream into a bounded buffer and batches are committed as they arrive, so a big first sync keeps memory flat
+        """
+        buffer = BoundedBuffer(BUFFER_HIGH_WATERMARK, BUFFER_LOW_WATERMARK)
 
-                
+        async def fetch_all():
+            try:
+                # accounts are fetched concurrently within the global and per account limits
+                return await asyncio.gather(*[self.fetch_account(service_mapper, buffer, scheduler)
+                                              for service_mapper in self.service_mappers])
+            finally:
+                await buffer.close()
+
+        fetching = asyncio.create_task(fetch_all())
+        new_by_key: Dict[str, int] = {}
+        new_count = 0
+        pending = []
+        try:
+            while True:
+                item = await buffer.get()
+                if item is not None:
+                    key, messages = item
+                    pending.extend((key, message) for message in messages)
+                # commit when a batch is full or nothing else is ready to join it
+                if len(pending) > 0 and (len(pending) >= PERSIST_BATCH_SIZE or buffer.empty()):
+                    for key, count in (await asyncio.to_thread(self.persist_messages, pending)).items():
+                        new_by_key[key] = new_by_key.get(key, 0) + count
+                        new_count += count
+                    pending = []
+                    publish_progress("pull", new_messages=new_count, buffered=buffer.size)
+                if item is None:
+                    break
+            polled_keys = [key for keys in await fetching for key in keys]
+        finally:
+            if not fetching.done():
+                fetching.cancel()
+
+        if scheduler is not None:
+            for key in polled_keys:
+                scheduler.record_poll(key, new_by_key.get(key, 0))
+        publish_progress("pull", new_messages=new_count, polled=polled_keys,
+                         peak_buffered=buffer.peak_size, fetch_pauses=buffer.pauses)
+        return new_count
+
+    def count_pending(self) -> int:
+        """conversations waiting for a draft"""
+        with Session(self.db_engine) as session:
+            return self.work_queue.count_pending(session)
+
+    async def update_backpressure(self, scheduler: PollScheduler):
+        """slows polling while the draft queue is above its high watermark, until drafting brings it down to the low one"""
+        pending = await asyncio.to_thread(self.count_pending)
+        if pending >= DRAFT_BACKLOG_HIGH and not scheduler.backpressure:
+            print(f"{pending} conversations waiting for drafts, slowing down polling")
+            scheduler.backpressure = True
+        elif pending <= DRAFT_BACKLOG_LOW and scheduler.backpressure:
+            print(f"Draft queue down to {pending} conversations, polling normally again")
+            scheduler.backpressure = False
+    
+    def get_unembedded_ids(self) -> Tuple[List[str], Optional[datetime]]:
+        """
+        ids of messages stored since embedded_through that are not in the vector index yet, every message's
+        on the first scan, and the newest created_at scanned
+        """
+        query = select(UnifiedMessageFormat.message_id, UnifiedMessageFormat.created_at)
+        if self.embedded_through is not None:
+            # messages committed a little after newer ones were scanned are scanned again instead of missed
+            query = query.where(UnifiedMessageFormat.created_at >= self.embedded_through - REFRESH_OVERLAP)
+        missing_ids = []
+        newest = self.embedded_through
+        with Session(self.db_engine) as session:
+            # only ids are streamed to find the gap, full rows are loaded one batch at a time
+            for rows in iter_batches(session, query):
+                missing_ids.extend(self.vector_index.missing([message_id for message_id, _ in rows]))
+                for _, created_at in rows:
+                    if created_at is not None and (newest is None or created_at > newest):
+                        newest = created_at
+        return missing_ids, newest
+
+    def get_messages(self, message_ids: List[str]) -> List[UnifiedMessageFormat]:
+        with Session(self.db_engine) as session:
+            return session.exec(select(UnifiedMessageFormat)
+                                .where(UnifiedMessageFormat.message_id.in_(message_ids))).all()
 
-                draft_response = DraftResponse(
-                    draft_response_id=message_ids_hash,
-                    messages=[message.model_dump(mode="json") for message in messages],
-                    thoughts=parsed_draft_response.thoughts,
-                    summary_of_chat=parsed_draft_response.summary_of_chat,
-                    reasoning_for_decision=parsed_draft_response.reasoning_for_decision,
-                    response_suggested=parsed_draft_response.response_suggested,
-                    response=parsed_draft_response.response,
-                    # pending if reponse is needed, ignored if not
-                    status="pending" if parsed_draft_response.response_suggested else "ignored"
-                )
-                print("~" * 100)
-                print("draft response:")
-                print(draft_response.model_dump_json(indent=4))
-                print("~" * 100)
-                session.add(draft_response)
-                session.commit()
+    async def embed_new_messages(self, batch_size=64):
+        """embeds messages that are not in the vector index yet, batch_size messages per embed call"""
+        embedded = 0
+        try:
+            missing_ids, newest = await asyncio.to_thread(self.get_unembedded_ids)
+            for start in range(0, len(missing_ids), batch_size):
+                batch = await asyncio.to_thread(self.get_messages, missing_ids[start:start + batch_size])
+                vectors = await asyncio.to_thread(embed_batch_with_ollama, self.server_url,
+                                                  [get_embedding_text(message) for message in batch],
+                                                  model=self.vector_index.model)
+                embedded += self.vector_index.add([message.message_id for message in batch], vectors)
+            # only moves on once everything it found is embedded, a failed batch is found again next time
+            self.embedded_through = newest
+        except Exception as e:
+            print(f"Error embedding messages: {str(e)}")
+        print(f"Embedded {embedded} new messages, vector index size: {len(self.vector_index)}")
+        publish_progress("embed", embedded=embedded)
+        return embedded
+
+    async def run_scheduled(self, scheduler: PollScheduler):
+        """polls the folders that are due, then drafts and applies retention when their cadence allows"""
+        # importers and other ingest workers write samples and graph edges from their own processes
+        await asyncio.to_thread(self.refresh_indexes)
+        await self.update_backpressure(scheduler)
+        new_count = await self.pull_latest_messages(scheduler)
+        if new_count > 0:
+            print(f"Pulled {new_count} new messages at {datetime.now()}")
+            await self.embed_new_messages()
+
+        if scheduler.is_drafting_due():
+            remaining = await self.process_messages(self.draft_budget)
+            scheduler.record_drafting(backlog=remaining > 0)
+
+        if scheduler.is_retention_due():
+            await self.apply_retention()
+            scheduler.record_retention()
+
+    async def apply_retention(self):
+        """one bounded retention step, runs in a worker thread since it is file and database i/o"""
+        try:
+            report = await asyncio.to_thread(self.retention.run_once)
+            print(f"Retention: {report.model_dump_json()}")
+            publish_progress("retention", **report.model_dump())
+            return report
+        except Exception as e:
+            print(f"Error applying retention: {str(e)}")
+
+    def refresh_indexes(self):
+        """picks up what other processes (ingest and draft workers, importers) stored since the last refresh"""
+        self.writing_samples.refresh()
+        self.graph_index.refresh()
+        self.vector_index.refresh()
+
+    def get_conversation_vector(self, messages: List[UnifiedMessageFormat]):
+        """mean of the stored vectors of the latest messages, nothing is re-embedded"""
+        query_vectors = [self.vector_index.get_vector(message.message_id) for message in messages[-3:]]
+        query_vectors = [vector for vector in query_vectors if vector is not None]
+        if len(query_vectors) == 0:
+            return None
+        return np.mean(query_vectors, axis=0)
+
+    def get_related_messages(self, session, messages: List[UnifiedMessageFormat], query_vector, k=5) -> List[UnifiedMessageFormat]:
+        """finds older messages from any conversation that are similar to the end of this conversation"""
+        if query_vector is None:
+            return []
+        window_ids = [message.message_id for message in messages]
+        hits = self.vector_index.search(query_vector, k=k, exclude_ids=window_ids)
+        if len(hits) == 0:
+            return []
+        related = session.exec(select(UnifiedMessageFormat)
+                               .where(UnifiedMessageFormat.message_id.in_([message_id for message_id, _ in hits]))).all()
+        related_by_id = {message.message_id: message for message in related}
+        return [related_by_id[message_id] for message_id, _ in hits if message_id in related_by_id]
+
+    def rank_conversations(self) -> List[str]:
+        """the queued conversations nobody holds a lease on, most urgent first"""
+        with Session(self.db_engine) as session:
+            available = set(self.work_queue.get_available(session))
+            if len(available) == 0:
+                return []
+            # only the available conversations are scored, not every stored one
+            ranked = [candidate.source_id for candidate in self.draft_priority.get_queue(session, self.graph_index, source_ids=available)]
+            # conversations whose messages were all archived have nothing left to draft
+            self.work_queue.discard(session, available - set(ranked))
+            session.commit()
+        return ranked
+
+    def claim_conversations(self, ranked: List[str], limit: int) -> List[str]:
+        """leases the next conversations of ranked for this worker, the ones it tried are taken off ranked"""
+        claimed = []
+        while len(claimed) < limit and len(ranked) > 0:
+            batch = ranked[:limit - len(claimed)]
+            del ranked[:len(batch)]
+            # ones another worker leased in the meantime are skipped
+            claimed.extend(self.work_queue.claim(self.worker_id, batch, len(batch)))
+        return claimed
+
+    async def process_messages(self, budget: DraftBudget = None) -> int:
+        """
+        drafts queued conversations most urgent first until the queue is empty or the budget runs out,
+        returns how many conversations are still queued
+        """
+        budget = budget or DraftBudget()
+        started = time.time()
+        drafted = 0
+        done = 0
+        # queue reads and writes run in a worker thread, the pipeline shares its event loop with the api
+        total = await asyncio.to_thread(self.count_pending)
+        publish_progress("draft", done=0, total=total)
+
+        # ranked once per pass, conversations queued during the pass are ranked by the next one
+        ranked = await asyncio.to_thread(self.rank_conversations)
+        while True:
+            source_ids = await asyncio.to_thread(self.claim_conversations, ranked, DRAFT_CLAIM_BATCH)
+            if len(source_ids) == 0:
+                break
+            for index, source_id in enumerate(source_ids):
+                if ((budget.max_drafts is not None and drafted >= budget.max_drafts)
+                        or (budget.max_seconds is not None and time.time() - started >= budget.max_seconds)):
+                    for unprocessed_id in source_ids[index:]:
+                        await asyncio.to_thread(self.work_queue.release, self.worker_id, unprocessed_id)
+                    remaining = await asyncio.to_thread(self.count_pending)
+                    print(f"Drafting budget used up, {remaining} conversations left for the next pass")
+                    publish_progress("draft", done=done, total=total, remaining=remaining)
+                    return remaining
+                try:
+                    if await self.draft_conversation(source_id):
+                        drafted += 1
+                    await asyncio.to_thread(self.work_queue.complete, self.worker_id, source_id)
+                except Exception as e:
+                    print(f"Error drafting {source_id}: {str(e)}")
+                    await asyncio.to_thread(self.work_queue.release, self.worker_id, source_id, error=str(e))
+                done += 1
+                publish_progress("draft", done=done, total=total)
+
+        remaining = await asyncio.to_thread(self.count_pending)
+        publish_progress("draft", done=done, total=total, remaining=remaining)
+        return remaining
+
+    def prepare_draft(self, source_id: str) -> Optional[Tuple[List[UnifiedMessageFormat], str, str]]:
+        """
+        reads the latest window of a conversation and builds the prompt up to the conversation itself,
+        returns (messages, draft id, prompt) or None if that window already has a draft
+        """
+        # latest 40 messages, served by the (source_id, message_timestamp) index
+        with Session(self.db_engine) as session:
+            messages = session.exec(select(UnifiedMessageFormat)
+                                    .where(UnifiedMessageFormat.source_id == source_id)
+                                    .order_by(UnifiedMessageFormat.message_timestamp.desc())
+                                    .limit(40)).all()
+            messages = list(reversed(messages))
+
+            # sha256 hash the message ids
+            message_ids = [message.message_id for message in messages]
+            message_ids_hash = hashlib.sha256(json.dumps(message_ids).encode()).hexdigest()
+
+            # check if the draft response already exists, if the messages havent changed, we can skip the draft response
+            draft_response = session.exec(select(DraftResponse)
+                                        .where(DraftResponse.draft_response_id == message_ids_hash)).first()
+            if draft_response:
+                print("Draft response already exists")
+                return None
+
+            user_prompt = """Please determine if User A needs to respond next in the conversion and if so draft an appropriate response.
+            If you determine that User A does not need to respond, set the response_needed to False.
+            """
+
+            other_party = next((message for message in reversed(messages) if message.sender_name != "user"), None)
+            if other_party is not None:
+                contact = self.graph_index.get_contact(other_party.service_name, other_party.sender_id)
+                if contact is not None:
+                    user_prompt += (f"\nAbout User B: {contact.name}, {contact.interaction_count} messages across "
+                                    f"{len(contact.conversations)} conversations since {contact.first_interaction.strftime('%Y-%m-%d')}\n")
+
+            query_vector = self.get_conversation_vector(messages)
+
+            writing_samples = self.writing_samples.get_samples(messages[-1].service_name,
+                                                               get_recipient_id(messages[-1]),
+                                                               query_vector=query_vector,
+                                                               vector_index=self.vector_index,
+                                                               exclude_ids=message_ids)
+            if len(writing_samples) > 0:
+                user_prompt += "\nExamples of messages User A has written, match their tone and style:\n"
+                for sample in writing_samples:
+                    user_prompt += f"User A: {sample.message_content}\n"
+
+            related_messages = self.get_related_messages(session, messages, query_vector)
+            if len(related_messages) > 0:
+                user_prompt += "\nRelated older messages, for context only:\n"
+                for message in related_messages:
+                    related_name = "User A" if message.sender_name == "user" else message.sender_name
+                    user_prompt += f"[{message.message_timestamp.strftime('%Y-%m-%d')}] {related_name}: {message.message_content}\n"
+                user_prompt += "\nConversation:\n"
+        return messages, message_ids_hash, user_prompt
+
+    def save_draft(self, draft_response: DraftResponse, messages: List[UnifiedMessageFormat]) -> DraftSummary:
+        """stores a draft with its conversation window, returns its summary"""
+        with Session(self.db_engine) as session:
+            session.add(draft_response)
+            link_draft_messages(session, draft_response.draft_response_id, messages)
+            # summarized before the commit expires the draft's attributes
+            summary = summarize_draft(draft_response, len(messages), messages[-1])
+            session.commit()
+        return summary
+
+    async def draft_conversation(self, source_id: str) -> bool:
+        """drafts a response for the latest window of a conversation, False if that window already has a draft"""
+        # database reads and index lookups run in a worker thread, the pipeline shares its event loop with the api
+        prepared = await asyncio.to_thread(self.prepare_draft, source_id)
+        if prepared is None:
+            return False
+        messages, message_ids_hash, user_prompt = prepared
+        system_prompt = get_system_prompt()
+
+        file_paths = []
+        for message in messages:
+            # TODO add time as "minutes ago" "hours ago" "days ago" etc
+            # TODO add media to the prompt
+            user_name = "User A"
+            if message.sender_name != "user":
+                user_name = "User B"
+            
+            user_prompt += f"{user_name}: {message.message_content}\n"
+            
+            image_extensions = [".jpg", ".png", ".JPG", ".PNG", ".jpeg", ".JPEG"]
+
+            for file_path in message.file_paths:
+                file_paths.append(file_path)
+                if any(file_path.endswith(ext) for ext in image_extensions):    
+                    caption = await asyncio.to_thread(get_contextual_caption, self.server_url, file_path, user_prompt)
+                    user_prompt += f"{user_name}: shared an image. Description: [{caption}]\n"
+                elif file_path.endswith(".txt"):
+                    with open(file_path, "r") as f:
+                        user_prompt += f"{user_name}: shared a file. File content: [{f.read()}]\n"
+                elif file_path.endswith(".mp4"):
+                    pass
+                else:
+                    user_prompt += f"{user_name}: shared file: [{file_path}]\n"
+            
+        user_prompt += f"\nPlease respond with the following JSON format: \n{DraftResponseSchema.model_json_schema()}"
+
+        ollama_messages = [Message(role="system", content=system_prompt)]
+        ollama_messages.append(Message(role="user", content=user_prompt))
+
+        # model calls run in a worker thread, the pipeline shares its event loop with the api
+        response = await asyncio.to_thread(call_ollama_chat, self.server_url, "Qwen2.5-14B-Instruct-1M-GGUF", ollama_messages,
+                                           json_schema=DraftResponseSchema.model_json_schema())
+        parsed_draft_response = DraftResponseSchema.model_validate_json(response)    
+
+        draft_response = DraftResponse(
+            draft_response_id=message_ids_hash,
+            thoughts=parsed_draft_response.thoughts,
+            summary_of_chat=parsed_draft_response.summary_of_chat,
+            reasoning_for_decision=parsed_draft_response.reasoning_for_decision,
+            response_suggested=parsed_draft_response.response_suggested,
+            response=parsed_draft_response.response,
+            # pending if reponse is needed, ignored if not
+            status="pending" if parsed_draft_response.response_suggested else "ignored",
+            source_id=source_id
+        )
+        print("~" * 100)
+        print("draft response:")
+        print(draft_response.model_dump_json(indent=4))
+        print("~" * 100)
+        summary = await asyncio.to_thread(self.save_draft, draft_response, messages)
+        event_bus.publish(DRAFT_CREATED, summary)
+        return True
     
     async def send_approved_response(self, draft_response_id: str, response_text: str):
         """Send an approved response through the appropriate service mapper"""
 
-        with Session(self.db_engine) as session:
-            draft_response = session.exec(select(DraftResponse).where(
-                DraftResponse.draft_response_id == draft_response_id)).first()
+        async with get_async_session() as session:
+            draft_response = (await session.exec(select(DraftResponse).where(
+                DraftResponse.draft_response_id == draft_response_id))).first()
             
             if not draft_response:
                 return {"success": False, "message": "Draft response not found"}
             
             # Get the first message to determine which service to use
-            if not draft_response.messages:
+            draft_messages = (await load_draft_messages_async(session, [draft_response_id])).get(draft_response_id)
+            if not draft_messages:
                 return {"success": False, "message": "No messages found in draft response"}
             
             # Parse the first message to get service details
-            first_message = UnifiedMessageFormat.model_validate(draft_response.messages[0])
+            first_message = draft_messages[0]
             service_name = first_message.service_name
             source_id = first_message.source_id
             
@@ -250,75 +647,82 @@ class LoopManager:
             if not service_mapper:
                 return {"success": False, "message": f"Service mapper for {service_name} not found"}
             
-            # Login to the service
-            if not await service_mapper.is_logged_in():
-                await service_mapper.login()
+            # one operation at a time per account, a pull must not log the mapper out mid send
+            async with self.get_account_limit(service_mapper):
+                # Login to the service
+                if not await service_mapper.is_logged_in():
+                    await service_mapper.login()
             
-            # Send the message
-            try:
-                # reply_to_message(self, message: UnifiedMessageFormat, reply_content: str) -> str:
-                # should be the last message in the draft response
-                last_message = UnifiedMessageFormat.model_validate(draft_response.messages[-1])
-                result = await service_mapper.reply_to_message(last_message, response_text)
+                # Send the message
+                try:
+                    # reply_to_message(self, message: UnifiedMessageFormat, reply_content: str) -> str:
+                    # should be the last message in the draft response
+                    last_message = draft_messages[-1]
+                    result = await service_mapper.reply_to_message(last_message, response_text)
                 
-                # Update the draft response status
-                draft_response.status = "sent"
-                draft_response.response = response_text
-                session.add(draft_response)
-                session.commit()
+                    # Update the draft response status
+                    draft_response.status = "sent"
+                    draft_response.updated_at = datetime.now()
+                    draft_response.response = response_text
+                    session.add(draft_response)
+                    await session.commit()
+                    event_bus.publish(DRAFT_STATUS_CHANGED, {"draft_response_id": draft_response_id, "status": draft_response.status})
                 
-                await service_mapper.logout()
-                return {"success": True, "message": "Response sent successfully"}
-            except Exception as e:
-                await service_mapper.logout()
-                return {"success": False, "message": f"Failed to send message: {str(e)}"}
-
-# todo: embed the messages and the response
-# todo: save the embedding to a vector database
-# todo: call vector database for more context
-
-async def pull_loop(engine, loop_manager: LoopManager):
-    await loop_manager.pull_latest_messages()
+                    await service_mapper.logout()
+                    return {"success": True, "message": "Response sent successfully"}
+                except Exception as e:
+                    await service_mapper.logout()
+                    return {"success": False, "message": f"Failed to send message: {str(e)}"}
+
+def create_service_mappers(accounts_config: AccountsConfig, media_dir: str) -> List[ServiceMapperInterface]:
+    """one mapper per enabled account, an account that fails to initialize is skipped"""
+    service_mappers = []
+    for account in accounts_config.accounts:
+        if not account.enabled:
+            continue
+        init_keys = dict(account.init_keys)
+        try:
+            if account.service == "gmail":
+                init_keys.setdefault("latest_message_timestamp", datetime.now() - timedelta(days=30))
+                service_mappers.append(GmailServiceMapper(init_keys=init_keys, media_dir=media_dir, account_id=account.account_id))
+            elif account.service == "telegram":
+                init_keys.setdefault("latest_message_id", 0)
+                # every telegram account needs its own session file
+                init_keys.setdefault("session_name", account.account_id)
+                service_mappers.append(TelegramServiceMapper(init_keys=init_keys, media_dir=media_dir, account_id=account.account_id))
+        except Exception as e:
+            print(f"Error setting up account {account.account_id}: {str(e)}")
+    return service_mappers
 
 # Create a global instance of LoopManager
-def get_loop_manager():
+def get_loop_manager(memory_dir="memory", read_only_vectors=False):
     media_dir = "media"
     if not os.path.exists(media_dir):
         os.makedirs(media_dir)
     
-    engine = create_engine("sqlite:///messages.db")
-    SQLModel.metadata.create_all(engine)
-    
-    return LoopManager(engine, media_dir)
-
-# Global instance for server use
-loop_manager = None
-
-async def run_continuous_loop(interval_seconds=300):
-    """Run the message processing loop continuously with a specified interval"""
-    engine = create_engine("sqlite:///messages.db")
-    SQLModel.metadata.create_all(engine)
-    
-    loop_manager = LoopManager(engine, "media")
+    return LoopManager(get_engine(media_dir), media_dir, memory_dir=memory_dir, read_only_vectors=read_only_vectors)
+
+async def run_continuous_loop(loop_manager: LoopManager = None, interval_seconds=300):
+    """
+    Runs the pipeline on the adaptive schedule, the server passes in its LoopManager.
+    interval_seconds is where every folder starts, busy folders are polled more often and quiet ones back off.
+    """
+    if loop_manager is None:
+        loop_manager = get_loop_manager()
+    loop_manager.scheduler = PollScheduler(base_interval=interval_seconds)
     
     while True:
         try:
-            print(f"Running message pull and processing cycle at {datetime.now()}")
-            await loop_manager.pull_latest_messages()
-            
-            # Get message count from sqlite db
-            with Session(engine) as session:
-                messages = select(UnifiedMessageFormat)
-                message_count = session.exec(messages).all()
-                print(f"Message count: {len(message_count)}")
-            
-            await loop_manager.process_messages()
-            print(f"Completed processing cycle, waiting {interval_seconds} seconds until next cycle")
+            async with loop_manager.pipeline_lock:
+                await loop_manager.run_scheduled(loop_manager.scheduler)
+            # Wait until the next folder is due
+            wait_seconds = max(1.0, loop_manager.scheduler.seconds_until_next())
         except Exception as e:
             print(f"Error in processing cycle: {str(e)}")
+            # a failed poll isn't recorded, so its folder would look due straight away
+            wait_seconds = loop_manager.scheduler.min_interval
         
-        # Wait for the next cycle
-        await asyncio.sleep(interval_seconds)
+        await asyncio.sleep(wait_seconds)
 
 if __name__ == "__main__":
     # Run the continuous loop
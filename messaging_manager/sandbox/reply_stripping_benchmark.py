@@ -0,0 +1,84 @@
+"""
+Times strip_reply on worst case inputs, the reply formats it handles are checked in tests/test_reply_stripping.py.
+
+python -m messaging_manager.sandbox.reply_stripping_benchmark
+
+Every case is timed at doubling sizes, the time per character has to stay flat. --old also times the
+regex the mapper used before, which backtracks on long quoted threads.
+"""
+import re
+import time
+from typing import Callable, Dict, List
+
+from messaging_manager.libs.reply_stripping import strip_reply
+
+OLD_REPLY_PATTERN = re.compile(r'On.*?wrote:.*?((?:\r\n>|\r\n>>)(?:.(?!(?:\r\n>|\r\n>>)))*$)', flags=re.DOTALL)
+# the old regex isn't timed past this, it would run for minutes
+OLD_TIME_LIMIT_SECONDS = 2.0
+# allowed growth of the time per character from the smallest to the largest size, timer noise included
+MAX_SLOWDOWN = 4.0
+
+
+def strip_reply_old(text: str) -> str:
+    return OLD_REPLY_PATTERN.sub('', text).strip()
+
+
+WORST_CASES: Dict[str, Callable[[int], str]] = {
+    # one attribution and a long quoted thread, the old regex checks its lookahead at every character
+    "long quoted thread": lambda n: "ok\r\n\r\nOn Mon, Jan 1, 2024 Bob <bob@example.com> wrote:\r\n" + "> quoted line of an older message\r\n" * n,
+    # attributions that are never followed by a quote, each one is checked and rejected
+    "attributions without quotes": lambda n: "On Monday, as Bob wrote:\r\nnothing quoted here\r\n" * (n // 2),
+    # outlook header candidates that never complete
+    "from lines": lambda n: "From: someone who is not a header\r\n" * n,
+    # nested quote markers on every line
+    "deep quotes": lambda n: "On Mon, Bob wrote:\r\n" + "".join(">" * (i % 20 + 1) + " text\r\n" for i in range(n)),
+    # no line breaks at all
+    "single long line": lambda n: "On and on it wrote: " + "x" * (n * 40),
+}
+
+
+def time_once(function: Callable[[str], str], text: str) -> float:
+    start = time.perf_counter()
+    function(text)
+    return time.perf_counter() - start
+
+
+def run_benchmark(sizes: List[int], include_old: bool) -> int:
+    failures = 0
+    for name, make_text in WORST_CASES.items():
+        print(f"\n{name}")
+        per_char = []
+        old_done = not include_old
+        for n in sizes:
+            text = make_text(n)
+            # best of three, the first run warms caches
+            seconds = min(time_once(strip_reply, text) for _ in range(3))
+            per_char.append(seconds / len(text))
+            row = f"  {n:>7} lines {len(text):>10} chars  {seconds * 1000:9.2f} ms"
+            if not old_done:
+                old_seconds = time_once(strip_reply_old, text)
+                row += f"  old regex {old_seconds * 1000:10.2f} ms"
+                old_done = old_seconds > OLD_TIME_LIMIT_SECONDS
+            print(row)
+        slowdown = per_char[-1] / per_char[0]
+        if slowdown > MAX_SLOWDOWN:
+            failures += 1
+            print(f"  FAIL time per character grew {slowdown:.1f}x")
+    return failures
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark the quoted reply stripper")
+    parser.add_argument("--max_lines", type=int, default=64000, help="Largest input size in lines")
+    parser.add_argument("--old", action="store_true", help="Also time the old regex")
+    args = parser.parse_args()
+
+    sizes = []
+    n = 1000
+    while n <= args.max_lines:
+        sizes.append(n)
+        n *= 2
+    failures = run_benchmark(sizes, args.old)
+    if failures > 0:
+        raise SystemExit(1)
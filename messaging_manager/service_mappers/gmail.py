@@ -1,11 +1,17 @@
 try:
     from libs.service_mapper_interface import ServiceMapperInterface, ServiceMetadata, get_source_id
+    from libs.service_mapper_interface import get_account_service_name, get_account_scoped_key
     from libs.service_mapper_interface import UnifiedMessageFormat
     from libs.gmail_oauth_utils import get_gmail_oauth_token
+    from libs.media_store import MediaStore, MEDIA_DIR
+    from libs.email_parsing import parse_emails, build_email_message, extract_email, get_legacy_email_message_id
 except ImportError:
     from messaging_manager.libs.service_mapper_interface import ServiceMapperInterface, ServiceMetadata, get_source_id
+    from messaging_manager.libs.service_mapper_interface import get_account_service_name, get_account_scoped_key
     from messaging_manager.libs.service_mapper_interface import UnifiedMessageFormat
     from messaging_manager.libs.gmail_oauth_utils import get_gmail_oauth_token
+    from messaging_manager.libs.media_store import MediaStore, MEDIA_DIR
+    from messaging_manager.libs.email_parsing import parse_emails, build_email_message, extract_email, get_legacy_email_message_id
 
 from datetime import datetime
 from typing import List, Optional, Dict
@@ -15,6 +21,7 @@ import os
 import imaplib
 import smtplib
 import email
+import email.utils
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.header import decode_header
@@ -26,11 +33,18 @@ from datetime import datetime, timedelta, timezone
 import traceback
 
 
+# emails fetched and parsed per step of iter_new_messages
+FETCH_BATCH_SIZE = 25
+
 class GmailServiceMapper(ServiceMapperInterface):
-    def __init__(self, init_keys: dict[str, str], media_dir: str = None):
+    def __init__(self, init_keys: dict[str, str], media_dir: str = None, account_id: str = None):
         super().__init__()
         self.init_keys = init_keys
+        # None for the single .env account, set for accounts from accounts.json
+        self.account_id = account_id
+        self.service_name = get_account_service_name("email", account_id)
         self.media_dir = media_dir
+        self.media_store = MediaStore(media_dir or MEDIA_DIR)
         self.latest_message_timestamp = self.init_keys.get('latest_message_timestamp', datetime.now() - timedelta(days=30))
         self.latest_message_ids = {}
         # TODO: run get_gmail_oauth_token rather than using the env variable
@@ -295,7 +309,8 @@ class GmailServiceMapper(ServiceMapperInterface):
             return False
 
     def process_emails(self, email_ids: List[str], box: str) -> List[UnifiedMessageFormat]:
-        results = []
+        # fetching is imap round trips, parsing is cpu work that runs on every core in the parse pool
+        fetched = [] # (email_id_str, email_body) in cursor order
         for email_id in sorted(email_ids, key=lambda x: int(x)):
                 # Convert bytes to string if needed
                 if isinstance(email_id, bytes):
@@ -310,9 +325,6 @@ class GmailServiceMapper(ServiceMapperInterface):
                 else:
                     self.latest_message_ids[box] = int(email_id)
 
-                generated_email_id = hashlib.sha256(f"{box} {email_id_str}".encode()).hexdigest()
-                media_dir = os.path.join(self.media_dir, generated_email_id)
-                
                 # Correctly fetch the email using RFC822
                 status, msg_data = self.imap_conn.fetch(email_id, '(RFC822)')
                 if status != 'OK' or not msg_data or msg_data[0] is None:
@@ -330,153 +342,26 @@ class GmailServiceMapper(ServiceMapperInterface):
                 if not email_body:
                     print(f"Empty email body for email {email_id}")
                     continue
-                    
-                message = email.message_from_bytes(email_body)
+                fetched.append((email_id_str, email_body))
 
-                # Get other party's id
-                sender_email = self.extract_email(message['From'])
-                other_party_id = sender_email
-                sender_name = message['From']
-                
-                if sender_email == self.email:
-                    sender_name = "user"
-                    other_party_id = self.extract_email(message['To'])
+        parsed = parse_emails([email_body for _, email_body in fetched], box, self.email, self.account_id)
 
-                # Get subject
-                subject = message['Subject'] or ""
-                # Get thread id by stripping out RE: from the subject and hashing that with the other party's id
-                stripped_subject = re.sub(r'(?i)^Re:\s*', '', subject)
+        results = []
+        for (email_id_str, _), parsed_email in zip(fetched, parsed):
+                if parsed_email is None:
+                    continue
+                record, attachments = parsed_email
 
-                source_id = hashlib.sha256(f"{stripped_subject} {other_party_id}".encode()).hexdigest()
                 file_paths = []
-                
-                # Process attachments and message content
-                if message.is_multipart():
-                    message_text = ""
-                    for part in message.walk():
-                        content_type = part.get_content_type()
-                        content_disposition = str(part.get("Content-Disposition"))
-                        
-                        # Handle attachments
-                        if "attachment" in content_disposition:
-                            filename = part.get_filename()
-                            if filename:
-                                if not os.path.exists(media_dir):
-                                    os.makedirs(media_dir)
-                                filepath = os.path.join(media_dir, filename)
-                                print(f"Saving attachment to {filepath}")
-                                message_text += f"\n[Attachment: {filename}]"
-                                with open(filepath, 'wb') as f:
-                                    f.write(part.get_payload(decode=True))
-                                file_paths.append(filepath)
-                        
-                        # Handle inline images with Content-ID, only if not in a reply block
-                        elif "Content-ID" in part:
-                            content_id = part["Content-ID"].strip("<>")
-                            if content_id and part.get_payload(decode=True):
-                                # Try to get original filename
-                                filename = None
-                                
-                                # Try Content-Disposition first
-                                content_disposition = str(part.get("Content-Disposition", ""))
-                                if "filename=" in content_disposition:
-                                    filename_match = re.search(r'filename=["\'](.*?)["\']', content_disposition)
-                                    if filename_match:
-                                        filename = filename_match.group(1)
-                                
-                                # If no filename found, try Content-Type header
-                                if not filename:
-                                    content_type = str(part.get("Content-Type", ""))
-                                    if "name=" in content_type:
-                                        name_match = re.search(r'name=["\'](.*?)["\']', content_type)
-                                        if name_match:
-                                            filename = name_match.group(1)
-                                
-                                # If still no filename, fallback to Content-ID, but try to extract a meaningful name
-                                if not filename:
-                                    # Sometimes Content-IDs follow patterns like image001.jpg@01D... or filename.ext@...
-                                    cid_filename_match = re.search(r'^([^@]+)@', content_id)
-                                    if cid_filename_match:
-                                        cid_filename = cid_filename_match.group(1)
-                                        if '.' in cid_filename:  # Looks like it might have an extension
-                                            filename = cid_filename
-                                        else:
-                                            # Determine extension based on MIME type
-                                            mime_to_ext = {
-                                                'image/jpeg': '.jpg',
-                                                'image/png': '.png',
-                                                'image/gif': '.gif',
-                                                'image/bmp': '.bmp',
-                                            }
-                                            ext = mime_to_ext.get(part.get_content_type(), '.bin')
-                                            filename = f"{content_id}{ext}"
-                                    else:
-                                        # Just use the content_id with appropriate extension
-                                        mime_to_ext = {
-                                            'image/jpeg': '.jpg',
-                                            'image/png': '.png',
-                                            'image/gif': '.gif',
-                                            'image/bmp': '.bmp',
-                                        }
-                                        ext = mime_to_ext.get(part.get_content_type(), '.bin')
-                                        filename = f"{content_id}{ext}"
-                                
-                                if not os.path.exists(media_dir):
-                                    os.makedirs(media_dir)
-                                    
-                                filepath = os.path.join(media_dir, filename)
-                                print(f"Saving inline image to {filepath}")
-                                with open(filepath, 'wb') as f:
-                                    payload = part.get_payload(decode=True)
-                                    print(f"Payload: {len(payload)}")
-                                    f.write(payload)
-                                file_paths.append(filepath)
-                        
-                        # Get text content
-                        elif content_type == "text/plain" and "attachment" not in content_disposition:
-                            payload = part.get_payload(decode=True)
-                            if payload:
-                                message_text += payload.decode('utf-8', errors='replace')
-                else:
-                    # For non-multipart messages
-                    payload = message.get_payload(decode=True)
-                    message_text = payload.decode('utf-8', errors='replace') if payload else ""
-                
-                # Clean the message text
-                # strip out reply blocks start with "On" and ALWAYS ends with TWO or more \r\n> or \r\n>>
-                # needs to the last of this pattern
-                # Clean the message text
-                message_text = re.sub(r'On.*?wrote:.*?((?:\r\n>|\r\n>>)(?:.(?!(?:\r\n>|\r\n>>)))*$)', '', message_text, flags=re.DOTALL)
-                message_text = message_text.strip()
-
-                # for each file path, see if the filename is in the message_text, if not, remove the file path
-                file_paths = [fp for fp in file_paths if os.path.basename(fp) in message_text]
-                # remove any files from media_dir that are not in the file_paths
-                if os.path.exists(media_dir):
-                    for file in os.listdir(media_dir):
-                        if os.path.join(media_dir, file) not in file_paths:
-                            os.remove(os.path.join(media_dir, file))
-                    
-                    # if the media_dir exists, is empty, remove it
-                    if not os.listdir(media_dir):
-                        os.rmdir(media_dir)
+                for filename, payload in attachments:
+                    file_path = self.media_store.put_bytes(payload, filename)
+                    print(f"Saved {filename} to {file_path}")
+                    file_paths.append(file_path)
 
-                    
-                # Create unified message format
-                unified_message = UnifiedMessageFormat(
-                    message_id=generated_email_id,
-                    service_name="email",
-                    source_id=source_id,
-                    source_keys={
-                        "email_id": email_id_str,
-                        "box": box
-                    },
-                    message_content=message_text,
-                    sender_id=sender_email,
-                    sender_name=sender_name,
-                    message_timestamp=email.utils.parsedate_to_datetime(message['Date']) if message['Date'] else datetime.now(),
-                    file_paths=file_paths
-                )
+                # rows stored before emails were keyed by Message-ID are found by this id, so an upgrade doesn't store them twice
+                legacy_message_id = get_legacy_email_message_id(box, email_id_str, self.account_id)
+                unified_message = build_email_message(record, self.service_name, file_paths,
+                                                      {"email_id": email_id_str, "legacy_message_id": legacy_message_id})
 
                 # if the message_timestamp is greater than the latest_message_timestamp, update the latest_message_timestamp
                 if unified_message.message_timestamp.replace(tzinfo=timezone.utc) > self.latest_message_timestamp.replace(tzinfo=timezone.utc):
@@ -487,74 +372,65 @@ class GmailServiceMapper(ServiceMapperInterface):
 
         return results
     
-    async def get_new_messages(self, latest_message: UnifiedMessageFormat = None, limit_per_source: int = 5) -> List[UnifiedMessageFormat]:
+    POLL_FOLDERS = ['"[Gmail]/Sent Mail"', "INBOX"]
+
+    def get_poll_folders(self) -> List[Optional[str]]:
+        return list(self.POLL_FOLDERS)
+
+    async def get_new_messages(self, latest_message: UnifiedMessageFormat = None, limit_per_source: int = 5, folder: Optional[str] = None) -> List[UnifiedMessageFormat]:
         """Get email messages from both INBOX and Sent folders with thread organization
         
         Args:
             latest_message: The most recent message we've processed (optional)
             limit_per_source: Maximum number of messages to retrieve per folder
+            folder: Only check this folder, all poll folders when None
             
         Returns:
             List of UnifiedMessageFormat objects representing emails with consistent thread IDs
         """
+        results = []
+        async for batch in self.iter_new_messages(latest_message, limit_per_source=limit_per_source, folder=folder):
+            results.extend(batch)
+        return results
+
+    async def iter_new_messages(self, latest_message: UnifiedMessageFormat = None, limit_per_source: int = 5,
+                                folder: Optional[str] = None, batch_size: int = FETCH_BATCH_SIZE):
+        """like get_new_messages, but yields batch_size emails at a time so a large sync never sits in memory at once"""
         if not await self.is_logged_in():
             await self.login()
             
-        results = []
         min_date = self.latest_message_timestamp
-        # Default to checking the last 30 days if no latest message
-        from datetime import timedelta
         if latest_message:
             min_date = latest_message.message_timestamp
 
         try:
             latest_date_str = min_date.strftime("%d-%b-%Y")
-            # Process Sent folder
-            status, message_count = self.imap_conn.select('"[Gmail]/Sent Mail"')
-            if status != 'OK':
-                print(f"Failed to select Sent: {message_count}")
-                return results
-            
-            print(f"Searching for emails since {latest_date_str}")
-            status, data = self.imap_conn.search(None, f'(SINCE "{latest_date_str}")')
-            if status != 'OK':
-                print(f"Failed to search for emails: {data}")
-                return results
-            
-            sent_email_ids = data[0].split()[-limit_per_source:] if data[0] else []
-            print(f"Found {len(sent_email_ids)} sent emails")
-            results.extend(self.process_emails(sent_email_ids, '"[Gmail]/Sent Mail"'))
-
-            # Process INBOX
-            status, message_count = self.imap_conn.select('INBOX')
-            if status != 'OK':
-                print(f"Failed to select INBOX: {message_count}")
-                return results
+            for box in ([folder] if folder is not None else self.POLL_FOLDERS):
+                status, message_count = self.imap_conn.select(box)
+                if status != 'OK':
+                    print(f"Failed to select {box}: {message_count}")
+                    return
                 
-            # Search with SINCE criterion
-            status, data = self.imap_conn.search(None, f'(SINCE "{latest_date_str}")')
-            if status != 'OK':
-                print(f"Failed to search for emails: {data}")
-                return results
+                # Search with SINCE criterion
+                print(f"Searching {box} for emails since {latest_date_str}")
+                status, data = self.imap_conn.search(None, f'(SINCE "{latest_date_str}")')
+                if status != 'OK':
+                    print(f"Failed to search for emails: {data}")
+                    return
                 
-            inbox_email_ids = data[0].split()[-limit_per_source:] if data[0] else []
-            print(f"Found {len(inbox_email_ids)} inbox emails")
-            results.extend(self.process_emails(inbox_email_ids, "INBOX"))
+                email_ids = data[0].split()[-limit_per_source:] if data[0] else []
+                print(f"Found {len(email_ids)} emails in {box}")
+                for start in range(0, len(email_ids), batch_size):
+                    # fetching and parsing is blocking imap work, keep it off the event loop
+                    yield await asyncio.to_thread(self.process_emails, email_ids[start:start + batch_size], box)
 
         except Exception as e:
             print(f"Error getting new messages: {e}")
             print(traceback.format_exc())
-            
-        return results
         
     def extract_email(self, header_value):
         """Extract email address from a header value like 'Name <email@example.com>'"""
-        if not header_value:
-            return ""
-        match = re.search(r'<([^>]+)>', header_value)
-        if match:
-            return match.group(1)
-        return header_value.strip()
+        return extract_email(header_value)
     
     async def reply_to_message(self, message: UnifiedMessageFormat, reply_content: str) -> str:
         """Reply to an email message"""
@@ -566,21 +442,23 @@ class GmailServiceMapper(ServiceMapperInterface):
             subject = message.source_keys.get("subject", "")
             
             # Check if it already has Re: prefix
-            if not subject.startswith("Re:"):
+            if not subject.lower().startswith("re:"):
                 subject = f"Re: {subject}"
             
             # Create email message
             msg = MIMEMultipart()
             msg["From"] = self.email
-            msg["To"] = message.sender_id
+            # the other party, also when the latest message of the conversation is one of ours
+            msg["To"] = message.source_keys.get("other_party_id") or message.sender_id
             msg["Subject"] = subject
+            msg["Message-ID"] = email.utils.make_msgid(domain=self.email.split("@")[-1])
             
-            message_to_reply_to = message.source_keys.get("email_id", "")
-            box_name = message.source_keys.get("box", "") # inbox, sent, etc
-            
-            if message_to_reply_to and box_name:
-                msg["In-Reply-To"] = f"<{message_to_reply_to}@{box_name}>"
-                msg["References"] = f"<{message_to_reply_to}@{box_name}>"            
+            # thread the reply under the message, the References chain is what clients group by
+            message_id_header = message.source_keys.get("message_id_header", "")
+            if message_id_header:
+                references = message.source_keys.get("references", "")
+                msg["In-Reply-To"] = message_id_header
+                msg["References"] = f"{references} {message_id_header}".strip()
             
             # Add text content
             msg.attach(MIMEText(reply_content, "plain"))
@@ -628,7 +506,7 @@ class GmailServiceMapper(ServiceMapperInterface):
             reinitialize_keys["smtp_port"] = self.init_keys.get("smtp_port", "587")
         
         return ServiceMetadata(
-            service_name="email",
+            service_name=self.service_name,
             init_keys=required_keys,
             reinitialize_keys=reinitialize_keys
         )
@@ -1,8 +1,10 @@
 
 from messaging_manager.libs.service_mapper_interface import ServiceMapperInterface, ServiceMetadata, get_source_id
+from messaging_manager.libs.service_mapper_interface import get_account_service_name, get_account_scoped_key
 from messaging_manager.libs.service_mapper_interface import UnifiedMessageFormat
+from messaging_manager.libs.media_store import MediaStore, MEDIA_DIR
 from datetime import datetime
-from typing import List
+from typing import List, Optional
 import uuid
 from qrcode import QRCode
 import asyncio
@@ -22,13 +24,17 @@ def display_url_as_qr(url):
     gen_qr(url)
 
 class TelegramServiceMapper(ServiceMapperInterface):
-    def __init__(self, init_keys: dict[str, str], media_dir: str = None):
+    def __init__(self, init_keys: dict[str, str], media_dir: str = None, account_id: str = None):
         super().__init__()
+        # None for the single .env account, set for accounts from accounts.json
+        self.account_id = account_id
+        self.service_name = get_account_service_name("telegram", account_id)
         # hash the init keys
         
         self.client = None
         self.init_keys = init_keys
         self.media_dir = media_dir
+        self.media_store = MediaStore(media_dir or MEDIA_DIR)
         self.latest_message_id = self.init_keys['latest_message_id']
 
         self.session_name = self.init_keys['session_name']
@@ -72,18 +78,27 @@ class TelegramServiceMapper(ServiceMapperInterface):
     async def is_logged_in(self) -> bool:
         return self.client.is_connected()
     
-    async def get_new_messages(self, latest_message: UnifiedMessageFormat = None, limit_per_source: int = 5) -> List[UnifiedMessageFormat]:
+    async def get_new_messages(self, latest_message: UnifiedMessageFormat = None, limit_per_source: int = 5, folder: Optional[str] = None) -> List[UnifiedMessageFormat]:
         results = []
+        async for batch in self.iter_new_messages(latest_message, limit_per_source=limit_per_source, folder=folder):
+            results.extend(batch)
+        return results
+
+    async def iter_new_messages(self, latest_message: UnifiedMessageFormat = None, limit_per_source: int = 5, folder: Optional[str] = None):
+        """yields the new messages one dialog at a time"""
+        # dialogs can't be listed without fetching them, so telegram is polled as one folder and folder is unused
         min_id = 0
         me = await self.client.get_me()
 
         parent_posts = {} # grouped_id -> parent_post_id
         if latest_message is not None:
             min_id = int(latest_message.source_keys["message_id"])
+        newest_timestamp = None
         async for dialog in self.client.iter_dialogs(limit=2):
             if dialog.name is None or dialog.name == "":
                 continue
 
+            results = []
             all_messages = []
             async for message in self.client.iter_messages(entity=dialog.message.peer_id, limit=limit_per_source, min_id=min_id):
                 all_messages.append(message)
@@ -92,14 +107,12 @@ class TelegramServiceMapper(ServiceMapperInterface):
                 print("~" * 100)
                 print(message)
                 print("~" * 100)
-                generated_message_id = hashlib.sha256((str(message.id) + "telegram").encode()).hexdigest()                
+                generated_message_id = hashlib.sha256(get_account_scoped_key(str(message.id) + "telegram", self.account_id).encode()).hexdigest()                
                 source_keys={"peer_id": str(dialog.message.peer_id.user_id), "message_id": str(message.id)}                               
 
-                media_dir = os.path.join(self.media_dir, str(generated_message_id))
+                file_paths = []
 
                 if message.grouped_id:
-                    generated_grouped_message_id = hashlib.sha256((str(message.grouped_id) + "telegram").encode()).hexdigest()
-                    media_dir = os.path.join(self.media_dir, str(generated_grouped_message_id))
                     source_keys["grouped_id"] = str(message.grouped_id)
  
                 from_id = message.peer_id.user_id
@@ -117,12 +130,6 @@ class TelegramServiceMapper(ServiceMapperInterface):
                 final_message = message.message
 
                 if message.media:
-                    # make media dir if it doesn't exist
-                    if not os.path.exists(media_dir):
-                        os.makedirs(media_dir)
-                    
-                    source_keys["media_dir"] = media_dir
-
                     media_type = type(message.media)
                     if media_type == telethon.tl.types.MessageMediaWebPage:
                         if type(message.media.webpage) == telethon.tl.types.WebPageEmpty:
@@ -134,40 +141,48 @@ class TelegramServiceMapper(ServiceMapperInterface):
                             final_message += f"comment: {message.message}"
                             
                         # TODO: scrape page
-                    elif media_type == telethon.tl.types.MessageMediaPhoto:
-                        # download media
-                        await message.download_media(media_dir)
-                    elif media_type == telethon.tl.types.MessageMediaDocument:
-                        await message.download_media(media_dir)
+                    elif media_type in (telethon.tl.types.MessageMediaPhoto, telethon.tl.types.MessageMediaDocument):
+                        # download media straight into the store, hashed as it streams in
+                        filename = message.file.name or f"media{message.file.ext or ''}"
+                        with self.media_store.writer(filename) as writer:
+                            await message.download_media(file=writer)
+                        file_paths.append(writer.path)
 
 
                     source_keys["media_type"] = str(media_type)
                         
                 source_id = get_source_id(dialog.message.peer_id.user_id)
+                if self.account_id is not None:
+                    source_id = get_source_id([self.account_id, dialog.message.peer_id.user_id])
                 result_message = UnifiedMessageFormat(
                     message_id=generated_message_id,
-                    service_name="telegram",
+                    service_name=self.service_name,
                     source_id=source_id,
                     source_keys=source_keys,
                     message_content=final_message,
                     sender_id=str(from_id),
                     sender_name=sender_name,
                     message_timestamp=message.date,
-                    file_paths=[]
+                    file_paths=file_paths
                 )
                 
                 results.append(result_message)
 
+            # albums never span dialogs, so they can be grouped per dialog
+            final_messages = self.group_albums(results)
+            # find the latest message
+            if len(final_messages) > 0:
+                newest_message = max(final_messages, key=lambda x: x.message_timestamp)
+                if newest_timestamp is None or newest_message.message_timestamp > newest_timestamp:
+                    newest_timestamp = newest_message.message_timestamp
+                    self.latest_message_id = newest_message.message_id
+            yield final_messages
+
+    def group_albums(self, results: List[UnifiedMessageFormat]) -> List[UnifiedMessageFormat]:
+        """merges the messages of an album into its first message"""
         final_messages = []
         processed_grouped_ids = []
-        # get file paths for each file in media_dir
         for message in results:
-            if "media_dir" in message.source_keys:
-                media_dir = message.source_keys["media_dir"]
-                if os.path.exists(media_dir):
-                    for file in os.listdir(media_dir):
-                        message.file_paths.append(os.path.join(media_dir, file))
-
             if "grouped_id" not in message.source_keys:
                 final_messages.append(message)
             else:
@@ -178,14 +193,10 @@ class TelegramServiceMapper(ServiceMapperInterface):
                     grouped_messages.sort(key=lambda x: x.message_timestamp)
                     # concat all message_content
                     message.message_content = "\n".join([m.message_content for m in grouped_messages])
+                    # every file of the album goes on the message that is kept
+                    message.file_paths = [path for m in grouped_messages for path in m.file_paths]
                     final_messages.append(message)
                     processed_grouped_ids.append(message.source_keys["grouped_id"])
-
-
-        # find the latest message
-        if len(final_messages) > 0:
-            latest_message = max(final_messages, key=lambda x: x.message_timestamp)
-            self.latest_message_id = latest_message.message_id
         return final_messages
     
     async def reply_to_message(self, message: UnifiedMessageFormat, reply_content: str) -> str:
@@ -196,7 +207,7 @@ class TelegramServiceMapper(ServiceMapperInterface):
     
     async def get_service_metadata(self) -> ServiceMetadata:
         return ServiceMetadata(
-            service_name="telegram",
+            service_name=self.service_name,
             init_keys=["api_id", "api_hash", "latest_message_id", "session_name"],
             reinitialize_keys={
                 "latest_message_id": self.latest_message_id,
@@ -0,0 +1,91 @@
+"""
+Runs one role of the pipeline as its own process, start the server with EXTERNAL_WORKERS=true so it doesn't run the pipeline too.
+
+    python -m messaging_manager.worker ingest
+    python -m messaging_manager.worker draft --name gpu1 --ollama_url http://gpu1:11434
+
+Ingest workers poll the services, store messages and queue the conversations that changed.
+Draft workers claim queued conversations with a lease and draft them, any number can run against
+one database. Ingest embeds new messages into memory/vectors, draft workers read that index.
+"""
+
+import os
+import time
+import socket
+import asyncio
+from sqlmodel import Session
+
+from messaging_manager.run import LoopManager, get_loop_manager
+from messaging_manager.libs.scheduler import PollScheduler
+
+
+async def run_ingest_worker(loop_manager: LoopManager, interval_seconds=300):
+    """polls on the adaptive schedule and applies retention, drafting is left to the draft workers"""
+    scheduler = PollScheduler(base_interval=interval_seconds)
+    loop_manager.scheduler = scheduler
+    while True:
+        try:
+            # importers and other ingest workers write samples and graph edges too
+            await asyncio.to_thread(loop_manager.refresh_indexes)
+            # draft workers drain the queue, polling slows down while they are behind
+            await loop_manager.update_backpressure(scheduler)
+            new_count = await loop_manager.pull_latest_messages(scheduler)
+            if new_count > 0:
+                print(f"Stored {new_count} new messages")
+                # the one writer of the vector index the draft workers read
+                await loop_manager.embed_new_messages()
+            # no drafting happens here, don't let a pending pass shorten the sleep
+            scheduler.record_drafting()
+            if scheduler.is_retention_due():
+                await loop_manager.apply_retention()
+                scheduler.record_retention()
+            wait_seconds = max(1.0, scheduler.seconds_until_next())
+        except Exception as e:
+            print(f"Error in ingest cycle: {str(e)}")
+            wait_seconds = scheduler.min_interval
+        await asyncio.sleep(wait_seconds)
+
+def get_available(loop_manager: LoopManager):
+    with Session(loop_manager.db_engine) as session:
+        return loop_manager.work_queue.get_available(session)
+
+async def run_draft_worker(loop_manager: LoopManager, idle_seconds=10, refresh_seconds=60):
+    """claims and drafts queued conversations until cancelled, sleeps idle_seconds when the queue is empty"""
+    last_refresh = 0.0
+    while True:
+        available = 0
+        try:
+            available = len(await asyncio.to_thread(get_available, loop_manager))
+            if available > 0:
+                # ingest writes samples, graph edges, messages and vectors in another process
+                if time.time() - last_refresh >= refresh_seconds:
+                    await asyncio.to_thread(loop_manager.refresh_indexes)
+                    last_refresh = time.time()
+                await loop_manager.process_messages(loop_manager.draft_budget)
+        except Exception as e:
+            print(f"Error in draft cycle: {str(e)}")
+            available = 0
+        # conversations leased by other workers or waiting out a retry are not available
+        if available == 0:
+            await asyncio.sleep(idle_seconds)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Run one pipeline role as a worker process")
+    parser.add_argument("role", choices=["ingest", "draft"])
+    parser.add_argument("--name", default="draft", help="Draft worker name, used in its worker id")
+    parser.add_argument("--ollama_url", help="Ollama server for this worker, defaults to OLLAMA_SERVER_URL")
+    parser.add_argument("--interval_seconds", type=int, default=300, help="Starting poll interval of the ingest worker")
+    args = parser.parse_args()
+
+    if args.role == "ingest":
+        loop_manager = get_loop_manager()
+        asyncio.run(run_ingest_worker(loop_manager, args.interval_seconds))
+    else:
+        loop_manager = get_loop_manager(read_only_vectors=True)
+        loop_manager.worker_id = f"{socket.gethostname()}-{args.name}-{os.getpid()}"
+        if args.ollama_url:
+            loop_manager.server_url = args.ollama_url
+        print(f"Draft worker {loop_manager.worker_id} using {loop_manager.server_url}")
+        asyncio.run(run_draft_worker(loop_manager))
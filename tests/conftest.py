@@ -0,0 +1,14 @@
+import pytest
+
+from messaging_manager.libs.database import create_database_engine
+from messaging_manager.libs.migrations import migrate_database
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    # migrations look for legacy media relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    engine = create_database_engine(f"sqlite:///{tmp_path / 'messages.db'}")
+    migrate_database(engine)
+    yield engine
+    engine.dispose()
@@ -0,0 +1,47 @@
+import json
+import pytest
+
+from messaging_manager.libs.accounts import load_accounts_config
+from messaging_manager.libs.email_parsing import get_email_message_id, get_email_source_id
+from messaging_manager.libs.service_mapper_interface import get_account_service_name
+
+
+def write_config(tmp_path, accounts, **config):
+    path = tmp_path / "accounts.json"
+    path.write_text(json.dumps({"accounts": accounts, **config}))
+    return str(path)
+
+
+def test_accounts_are_loaded_with_defaults(tmp_path):
+    path = write_config(tmp_path, [{"account_id": "work", "service": "gmail", "init_keys": {"email": "me@work.com"}},
+                                   {"account_id": "phone", "service": "telegram", "max_concurrency": 2,
+                                    "enabled": False}], max_concurrency=2)
+    config = load_accounts_config(path)
+    assert config.max_concurrency == 2
+    assert [(account.account_id, account.max_concurrency, account.enabled) for account in config.accounts] == \
+        [("work", 1, True), ("phone", 2, False)]
+
+
+def test_without_a_file_the_env_account_is_used(tmp_path):
+    assert load_accounts_config(str(tmp_path / "accounts.json")) is None
+
+
+@pytest.mark.parametrize("accounts", [
+    [{"account_id": "work", "service": "outlook"}],
+    [{"account_id": "work", "service": "gmail"}, {"account_id": "work", "service": "telegram"}],
+    [{"account_id": "work:2", "service": "gmail"}],
+    [{"account_id": "a/b", "service": "gmail"}],
+])
+def test_invalid_accounts_are_refused(tmp_path, accounts):
+    with pytest.raises(ValueError):
+        load_accounts_config(write_config(tmp_path, accounts))
+
+
+def test_ids_are_scoped_per_account():
+    assert get_account_service_name("email", None) == "email"
+    assert get_account_service_name("email", "work") == "email:work"
+    # the .env account keeps the ids it always had, other accounts get their own
+    ids = {get_email_message_id("INBOX", "<a@x>", "", account_id) for account_id in [None, "work", "personal"]}
+    assert len(ids) == 3
+    assert get_email_source_id("Re: Hello", "bob@x.com", "work") == get_email_source_id("Hello", "bob@x.com", "work")
+    assert get_email_source_id("Hello", "bob@x.com", "work") != get_email_source_id("Hello", "bob@x.com")
@@ -0,0 +1,45 @@
+import asyncio
+
+from messaging_manager.libs.backpressure import BoundedBuffer
+
+
+def test_producer_pauses_until_the_buffer_drains_to_the_low_watermark():
+    async def run():
+        buffer = BoundedBuffer(high_watermark=10, low_watermark=4)
+        await buffer.put("a", 6)
+        await buffer.put("b", 6)
+        assert buffer.paused
+
+        blocked = asyncio.create_task(buffer.put("c", 1))
+        await asyncio.sleep(0.01)
+        assert not blocked.done()
+        assert await buffer.get() == "a"
+        # 6 buffered is still above the low watermark
+        await asyncio.sleep(0.01)
+        assert not blocked.done()
+        assert await buffer.get() == "b"
+        await asyncio.wait_for(blocked, 1)
+        assert (buffer.peak_size, buffer.pauses) == (12, 1)
+    asyncio.run(run())
+
+
+def test_consumer_finishes_the_buffer_after_close():
+    async def run():
+        buffer = BoundedBuffer()
+        consumed = []
+
+        async def consume():
+            while True:
+                item = await buffer.get()
+                if item is None:
+                    return
+                consumed.append(item)
+
+        consumer = asyncio.create_task(consume())
+        for item in range(5):
+            await buffer.put(item, 100)
+        await buffer.close()
+        await asyncio.wait_for(consumer, 1)
+        assert consumed == [0, 1, 2, 3, 4]
+        assert buffer.empty()
+    asyncio.run(run())
@@ -0,0 +1,42 @@
+from datetime import datetime
+import pytest
+from sqlmodel import Session, select, func
+
+from messaging_manager.libs.bulk import bulk_insert_ignore, iter_batches
+from messaging_manager.libs.database import get_driver_url
+from messaging_manager.libs.database_models import UnifiedMessageFormat
+
+
+def make_row(message_id, message_content="hello"):
+    return UnifiedMessageFormat(message_id=message_id, service_name="email", source_id="conversation",
+                                message_content=message_content, sender_id="bob", sender_name="Bob",
+                                message_timestamp=datetime(2024, 1, 1)).model_dump()
+
+
+def test_bulk_insert_skips_stored_rows(engine):
+    with Session(engine) as session:
+        bulk_insert_ignore(session, UnifiedMessageFormat.__table__, [make_row("1"), make_row("2")])
+        session.commit()
+        rows = [make_row("2", "changed")] + [make_row(str(i)) for i in range(3, 8)]
+        bulk_insert_ignore(session, UnifiedMessageFormat.__table__, rows, batch_size=2)
+        session.commit()
+        assert session.exec(select(func.count()).select_from(UnifiedMessageFormat)).one() == 7
+        assert session.get(UnifiedMessageFormat, "2").message_content == "hello"
+
+
+def test_iter_batches_streams_everything_once(engine):
+    with Session(engine) as session:
+        bulk_insert_ignore(session, UnifiedMessageFormat.__table__, [make_row(f"{i:02}") for i in range(25)])
+        session.commit()
+        batches = list(iter_batches(session, select(UnifiedMessageFormat.message_id)
+                                    .order_by(UnifiedMessageFormat.message_id), batch_size=10))
+    assert [len(batch) for batch in batches] == [10, 10, 5]
+    assert [message_id for batch in batches for message_id in batch] == [f"{i:02}" for i in range(25)]
+
+
+def test_driver_urls():
+    assert get_driver_url("sqlite:///messages.db") == "sqlite:///messages.db"
+    assert get_driver_url("sqlite:///messages.db", use_async=True) == "sqlite+aiosqlite:///messages.db"
+    assert get_driver_url("postgresql://user:secret@db/messages") == "postgresql+psycopg://user:secret@db/messages"
+    with pytest.raises(ValueError):
+        get_driver_url("mysql://db/messages")
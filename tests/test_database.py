@@ -0,0 +1,42 @@
+import asyncio
+from datetime import datetime
+from sqlalchemy import text
+from sqlmodel import Session, select, func
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from messaging_manager.libs.database import create_database_engine
+from messaging_manager.libs.database_models import UnifiedMessageFormat
+
+
+def test_sqlite_connections_use_wal(engine):
+    with engine.connect() as connection:
+        assert connection.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert connection.execute(text("PRAGMA busy_timeout")).scalar() == 30000
+
+
+def test_readers_see_committed_rows_while_a_write_is_open(engine):
+    with Session(engine) as writer, Session(engine) as reader:
+        writer.add(UnifiedMessageFormat(message_id="1", service_name="email", source_id="conversation", sender_id="bob",
+                                        sender_name="Bob", message_timestamp=datetime(2024, 1, 1)))
+        writer.flush()
+        # the uncommitted write doesn't block the reader or show up for it
+        assert reader.exec(select(func.count()).select_from(UnifiedMessageFormat)).one() == 0
+        writer.commit()
+        reader.rollback()
+        assert reader.exec(select(func.count()).select_from(UnifiedMessageFormat)).one() == 1
+
+
+def test_async_engine_reads_the_same_database(engine):
+    with Session(engine) as session:
+        session.add(UnifiedMessageFormat(message_id="1", service_name="email", source_id="conversation", sender_id="bob",
+                                         sender_name="Bob", message_timestamp=datetime(2024, 1, 1)))
+        session.commit()
+
+    async def count():
+        async_engine = create_database_engine(str(engine.url), use_async=True)
+        async with AsyncSession(async_engine) as session:
+            result = (await session.exec(select(func.count()).select_from(UnifiedMessageFormat))).one()
+            journal_mode = (await session.exec(text("PRAGMA journal_mode"))).scalar()
+        await async_engine.dispose()
+        return result, journal_mode
+    assert asyncio.run(count()) == (1, "wal")
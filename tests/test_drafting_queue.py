@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+from sqlmodel import Session
+
+from messaging_manager.libs.database_models import UnifiedMessageFormat
+from messaging_manager.libs.drafting_queue import DraftPriority
+from messaging_manager.libs.graph_index import GraphIndex, to_epoch
+
+NOW = datetime(2024, 6, 1, 12, tzinfo=timezone.utc)
+
+
+def make_message(message_id, source_id, sender_id, hours_ago):
+    return UnifiedMessageFormat(message_id=message_id, service_name="email", source_id=source_id,
+                                message_content=f"text of {message_id}", sender_id=sender_id,
+                                sender_name="user" if sender_id == "me" else sender_id.capitalize(),
+                                message_timestamp=(NOW - timedelta(hours=hours_ago)).replace(tzinfo=None))
+
+
+def store(engine, messages):
+    graph_index = GraphIndex(engine)
+    graph_index.load()
+    with Session(engine) as session:
+        session.add_all(messages)
+        graph_index.add_messages(session, messages)
+        session.commit()
+    return graph_index
+
+
+def ranked(engine, graph_index, **kwargs):
+    with Session(engine) as session:
+        return [candidate.source_id for candidate in
+                DraftPriority().get_queue(session, graph_index, now=to_epoch(NOW), **kwargs)]
+
+
+def test_recency_halves_every_half_life():
+    priority = DraftPriority(recency_half_life_hours=24, importance_weight=0)
+    day_old = (NOW - timedelta(hours=24)).replace(tzinfo=None)
+    assert priority.score(day_old, False, 0.0, now=to_epoch(NOW)) == pytest.approx(0.5)
+    assert priority.score(None, True, 0.0, now=to_epoch(NOW)) == 1.0
+
+
+def test_owed_recent_replies_come_first(engine):
+    graph_index = store(engine, [
+        make_message("1", "answered", "bob", 1),
+        make_message("2", "answered", "me", 0.5),
+        make_message("3", "owed old", "ann", 72),
+        make_message("4", "owed recent", "cy", 2),
+        make_message("5", "only sent", "me", 1),
+    ])
+    assert ranked(engine, graph_index) == ["owed recent", "owed old", "answered", "only sent"]
+    assert ranked(engine, graph_index, source_ids=["only sent", "owed old", "unknown"]) == ["owed old", "only sent"]
+
+
+def test_a_reply_at_the_same_time_as_the_user_is_still_owed(engine):
+    graph_index = store(engine, [make_message("1", "tie", "me", 1), make_message("2", "tie", "bob", 1)])
+    with Session(engine) as session:
+        candidate = DraftPriority().get_queue(session, graph_index, now=to_epoch(NOW))[0]
+    assert candidate.awaiting_reply
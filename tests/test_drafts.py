@@ -0,0 +1,78 @@
+import asyncio
+from datetime import datetime, timedelta
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from messaging_manager.libs.database import create_database_engine
+from messaging_manager.libs.database_models import DraftResponse, UnifiedMessageFormat
+from messaging_manager.libs.drafts import link_draft_messages, list_drafts_async, load_draft_messages
+
+START = datetime(2024, 1, 1)
+
+
+def make_message(message_id, minutes):
+    return UnifiedMessageFormat(message_id=message_id, service_name="email", source_id="conversation",
+                                message_content=f"text of {message_id}", sender_id="bob", sender_name="Bob",
+                                message_timestamp=START + timedelta(minutes=minutes))
+
+
+def make_draft(draft_response_id, minutes, status="pending"):
+    return DraftResponse(draft_response_id=draft_response_id, thoughts="", summary_of_chat="summary",
+                         reasoning_for_decision="", response_suggested=True, response="hi", status=status,
+                         source_id="conversation", created_at=START + timedelta(minutes=minutes))
+
+
+def store_drafts(engine, drafts, messages):
+    with Session(engine) as session:
+        session.add_all(messages)
+        for draft in drafts:
+            session.add(draft)
+            link_draft_messages(session, draft.draft_response_id, messages)
+        session.commit()
+
+
+def list_pages(engine, **kwargs):
+    async def run():
+        async_engine = create_database_engine(str(engine.url), use_async=True)
+        pages = []
+        cursor = None
+        async with AsyncSession(async_engine) as session:
+            while True:
+                page = await list_drafts_async(session, cursor=cursor, **kwargs)
+                pages.append(page)
+                cursor = page.next_cursor
+                if cursor is None:
+                    break
+        await async_engine.dispose()
+        return pages
+    return asyncio.run(run())
+
+
+def test_drafts_reference_their_messages_in_order(engine):
+    messages = [make_message("b", 1), make_message("a", 2)]
+    store_drafts(engine, [make_draft("d1", 1), make_draft("d2", 2)], messages)
+    with Session(engine) as session:
+        loaded = load_draft_messages(session, ["d1", "d2", "missing"])
+        # editing a message shows in every draft that references it
+        message = session.get(UnifiedMessageFormat, "a")
+        message.message_content = "edited"
+        session.add(message)
+        session.commit()
+        edited = load_draft_messages(session, ["d1"])
+    assert [message.message_id for message in loaded["d1"]] == ["b", "a"]
+    assert [message.message_id for message in loaded["d2"]] == ["b", "a"]
+    assert loaded["missing"] == []
+    assert edited["d1"][1].message_content == "edited"
+
+
+def test_listing_pages_newest_first(engine):
+    # d3 and d4 were created at the same time, the id breaks the tie
+    drafts = [make_draft("d1", 1), make_draft("d2", 2), make_draft("d3", 3), make_draft("d4", 3),
+              make_draft("d5", 4, status="sent")]
+    store_drafts(engine, drafts, [make_message("a", 1), make_message("b", 2)])
+    pages = list_pages(engine, limit=2)
+    assert [[draft.draft_response_id for draft in page.drafts] for page in pages] == [["d4", "d3"], ["d2", "d1"]]
+    summary = pages[0].drafts[0]
+    assert summary.message_count == 2
+    assert summary.last_message_preview == "text of b"
+    assert [draft.draft_response_id for page in list_pages(engine, status="sent") for draft in page.drafts] == ["d5"]
@@ -0,0 +1,69 @@
+from email.message import EmailMessage
+
+from messaging_manager.libs.email_parsing import (INBOX, MAX_REFERENCES, SENT_BOX, parse_email, parse_emails,
+                                                  reset_parse_pool)
+
+OWN_EMAIL = "me@example.com"
+
+
+def make_email(name, sender="Bob <bob@x.com>", recipient=OWN_EMAIL, body="hello", references=(), message_id=True):
+    message = EmailMessage()
+    message["From"] = sender
+    message["To"] = recipient
+    message["Subject"] = "Re: Plans"
+    message["Date"] = "Mon, 01 Jan 2024 10:00:00 +0000"
+    if message_id:
+        message["Message-ID"] = f"<{name}@x.com>"
+    if references:
+        message["In-Reply-To"] = f"<{references[-1]}@x.com>"
+        message["References"] = " ".join(f"<{reference}@x.com>" for reference in references)
+    message.set_content(body)
+    return message
+
+
+def test_inbound_and_sent_emails():
+    inbound, _ = parse_email(make_email("a").as_bytes(), INBOX, OWN_EMAIL)
+    sent, _ = parse_email(make_email("b", sender=OWN_EMAIL, recipient="Bob <bob@x.com>").as_bytes(), SENT_BOX, OWN_EMAIL)
+    assert (inbound["sender_id"], inbound["sender_name"], inbound["other_party_id"]) == ("bob@x.com", "Bob <bob@x.com>", "bob@x.com")
+    assert (sent["sender_name"], sent["other_party_id"]) == ("user", "bob@x.com")
+    # both sides of the conversation share the subject based source id, Re: ignored
+    assert inbound["source_id"] == sent["source_id"]
+    assert inbound["message_id_header"] == "<a@x.com>"
+
+
+def test_ids_are_stable_without_a_message_id_header():
+    raw = make_email("a", message_id=False).as_bytes()
+    assert parse_email(raw, INBOX, OWN_EMAIL)[0]["message_id"] == parse_email(raw, INBOX, OWN_EMAIL)[0]["message_id"]
+    assert parse_email(raw, INBOX, OWN_EMAIL)[0]["message_id"] != parse_email(raw, SENT_BOX, OWN_EMAIL)[0]["message_id"]
+
+
+def test_quotes_are_stripped_and_references_trimmed():
+    references = [f"r{number}" for number in range(MAX_REFERENCES + 5)]
+    record, _ = parse_email(make_email("a", body="sounds good\n\nOn Mon, Bob wrote:\n> plans?\n",
+                                       references=references).as_bytes(), INBOX, OWN_EMAIL)
+    assert record["message_content"] == "sounds good"
+    assert record["in_reply_to"] == f"<r{MAX_REFERENCES + 4}@x.com>"
+    kept = record["references"].split()
+    assert len(kept) == MAX_REFERENCES
+    assert kept[0] == "<r0@x.com>"
+
+
+def test_only_attachments_the_text_mentions_are_kept():
+    message = make_email("a", body="see the attached")
+    message.add_attachment(b"photo", maintype="image", subtype="jpeg", filename="photo.jpg")
+    record, attachments = parse_email(message.as_bytes(), INBOX, OWN_EMAIL)
+    assert record["message_content"].endswith("[Attachment: photo.jpg]")
+    assert attachments == [("photo.jpg", b"photo")]
+
+
+def test_pool_keeps_the_order_and_skips_broken_emails(monkeypatch):
+    monkeypatch.setattr("os.cpu_count", lambda: 2)
+    raw_emails = [make_email(str(number)).as_bytes() for number in range(6)]
+    raw_emails[3] = None
+    try:
+        parsed = parse_emails(raw_emails, INBOX, OWN_EMAIL)
+    finally:
+        reset_parse_pool()
+    assert parsed[3] is None
+    assert [record["message_id_header"] for record, _ in parsed[:3] + parsed[4:]] == \
+        [f"<{number}@x.com>" for number in [0, 1, 2, 4, 5]]
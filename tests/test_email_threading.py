@@ -0,0 +1,72 @@
+from email.message import EmailMessage
+from sqlmodel import Session, select
+
+from messaging_manager.libs.database_models import EmailThreadLink
+from messaging_manager.libs.email_parsing import build_email_message, parse_email
+from messaging_manager.libs.email_threading import EmailThreadIndex
+
+OWN_EMAIL = "me@example.com"
+
+
+def make_email(name, sender, recipient, subject, in_reply_to=None, references=(), box="INBOX"):
+    message = EmailMessage()
+    message["From"] = sender
+    message["To"] = recipient
+    message["Subject"] = subject
+    message["Date"] = "Mon, 01 Jan 2024 10:00:00 +0000"
+    message["Message-ID"] = f"<{name}@example.com>"
+    if in_reply_to:
+        message["In-Reply-To"] = f"<{in_reply_to}@example.com>"
+    if references:
+        message["References"] = " ".join(f"<{reference}@example.com>" for reference in references)
+    message.set_content(f"body of {name}")
+    record, _ = parse_email(message.as_bytes(), box, OWN_EMAIL)
+    return build_email_message(record, "email", [])
+
+
+def assign(engine, thread_index, messages):
+    with Session(engine) as session:
+        thread_index.assign(session, messages)
+        session.commit()
+    return messages
+
+
+def test_replies_join_the_thread_and_same_subjects_stay_apart(engine):
+    thread_index = EmailThreadIndex()
+    first = make_email("a", "Bob <bob@x.com>", OWN_EMAIL, "Hello")
+    reply = make_email("b", OWN_EMAIL, "bob@x.com", "Re: Hello", "a", ["a"], box="Sent")
+    forward = make_email("c", "Bob <bob@x.com>", OWN_EMAIL, "Fwd: Hello", "b", ["a", "b"])
+    unrelated = make_email("d", "Bob <bob@x.com>", OWN_EMAIL, "Hello")
+    assign(engine, thread_index, [first, reply, forward, unrelated])
+
+    assert first.source_id == reply.source_id == forward.source_id
+    assert unrelated.source_id != first.source_id
+
+
+def test_links_are_read_back_from_the_database(engine):
+    first = assign(engine, EmailThreadIndex(), [make_email("a", "Bob <bob@x.com>", OWN_EMAIL, "Hello")])[0]
+    # a new process starts with an empty cache
+    reply = make_email("b", OWN_EMAIL, "bob@x.com", "Re: Hello", "a", ["a"], box="Sent")
+    assign(engine, EmailThreadIndex(), [reply])
+    assert reply.source_id == first.source_id
+
+
+def test_reply_to_an_unknown_thread_keeps_its_subject_conversation(engine):
+    thread_index = EmailThreadIndex()
+    reply = make_email("b", "Ann <ann@x.com>", OWN_EMAIL, "Re: Old", "z", ["z"])
+    subject_source_id = reply.source_id
+    assign(engine, thread_index, [reply])
+    assert reply.source_id == subject_source_id
+
+    # later replies to either message find the same conversation
+    answer = make_email("c", OWN_EMAIL, "ann@x.com", "Re: Old", "b", ["z", "b"], box="Sent")
+    assign(engine, thread_index, [answer])
+    assert answer.source_id == subject_source_id
+    with Session(engine) as session:
+        assert {link.source_id for link in session.exec(select(EmailThreadLink)).all()} == {subject_source_id}
+
+
+def test_cache_is_bounded(engine):
+    thread_index = EmailThreadIndex(cache_size=2)
+    assign(engine, thread_index, [make_email(name, "Bob <bob@x.com>", OWN_EMAIL, name) for name in "abc"])
+    assert len(thread_index.links) == 2
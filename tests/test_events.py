@@ -0,0 +1,49 @@
+import asyncio
+import threading
+
+from messaging_manager.libs.events import DRAFT_CREATED, RESYNC, EventBus
+
+
+def drain(queue):
+    events = []
+    while not queue.empty():
+        events.append(queue.get_nowait())
+    return events
+
+
+def test_events_reach_every_subscriber_from_any_thread():
+    async def run():
+        bus = EventBus()
+        first, second = bus.subscribe(), bus.subscribe()
+        publisher = threading.Thread(target=bus.publish, args=(DRAFT_CREATED, {"draft_response_id": "d1"}))
+        publisher.start()
+        publisher.join()
+        event = await asyncio.wait_for(first.get(), 1)
+        assert event.data == {"draft_response_id": "d1"}
+        assert (await asyncio.wait_for(second.get(), 1)).event_id == event.event_id
+        assert event.to_sse() == f'id: {event.event_id}\nevent: draft-created\ndata: {{"draft_response_id": "d1"}}\n\n'
+    asyncio.run(run())
+
+
+def test_reconnecting_client_catches_up_or_resyncs():
+    async def run():
+        bus = EventBus(history_size=3)
+        for number in range(5):
+            bus.publish(DRAFT_CREATED, {"number": number})
+        assert [event.data["number"] for event in drain(bus.subscribe(last_event_id=3))] == [3, 4]
+        # event 2 is no longer in the history
+        assert [event.event_type for event in drain(bus.subscribe(last_event_id=1))] == [RESYNC]
+        # ids from before a restart
+        assert [event.event_type for event in drain(bus.subscribe(last_event_id=50))] == [RESYNC]
+    asyncio.run(run())
+
+
+def test_slow_subscriber_gets_a_resync_instead_of_the_backlog():
+    async def run():
+        bus = EventBus(queue_size=2)
+        queue = bus.subscribe()
+        for number in range(3):
+            bus.publish(DRAFT_CREATED, {"number": number})
+        await asyncio.sleep(0)
+        assert [event.event_type for event in drain(queue)] == [RESYNC]
+    asyncio.run(run())
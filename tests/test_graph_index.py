@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta
+from sqlmodel import Session
+
+from messaging_manager.libs.database_models import UnifiedMessageFormat
+from messaging_manager.libs.graph_index import GraphIndex, sender_node_id
+
+START = datetime(2024, 1, 1)
+
+
+def make_message(message_id, source_id, sender_id, minutes):
+    return UnifiedMessageFormat(message_id=message_id, service_name="email", source_id=source_id,
+                                message_content=f"text of {message_id}", sender_id=sender_id,
+                                sender_name="user" if sender_id == "me" else sender_id.capitalize(),
+                                message_timestamp=START + timedelta(minutes=minutes))
+
+
+MESSAGES = [
+    make_message("1", "project", "bob", 1),
+    make_message("2", "project", "bob", 2),
+    make_message("3", "project", "me", 3),
+    make_message("4", "lunch", "bob", 4),
+    make_message("5", "lunch", "ann", 5),
+    make_message("6", "newsletter", "news", 6),
+    make_message("7", "newsletter", "me", 7),
+]
+
+
+def add(engine, graph_index, messages):
+    with Session(engine) as session:
+        graph_index.add_messages(session, messages)
+        session.commit()
+
+
+def test_contacts_and_related_conversations(engine):
+    graph_index = GraphIndex(engine)
+    graph_index.load()
+    add(engine, graph_index, MESSAGES)
+
+    contact = graph_index.get_contact("email", "bob")
+    assert contact.interaction_count == 3
+    # timestamps come back in utc, naive ones are taken as utc
+    assert contact.first_interaction.replace(tzinfo=None) == START + timedelta(minutes=1)
+    assert [link.source_id for link in contact.conversations] == ["lunch", "project"]
+
+    assert graph_index.get_participants("lunch") == [sender_node_id("email", "bob"), sender_node_id("email", "ann")]
+    # conversations are related through bob, not through the user
+    assert graph_index.related_conversations("project") == [("lunch", 1)]
+    assert graph_index.related_conversations("newsletter") == []
+    assert graph_index.contact_importance("email", "me") == 0.0
+    assert graph_index.conversation_importance("project") > graph_index.conversation_importance("newsletter") > 0.0
+
+
+def test_backfill_refresh_and_fresh_load_agree(engine):
+    with Session(engine) as session:
+        session.add_all(MESSAGES[:3])
+        session.commit()
+    writer = GraphIndex(engine)
+    writer.load()
+    reader = GraphIndex(engine)
+    reader.load()
+    assert reader.get_contact("email", "bob").interaction_count == 2
+
+    add(engine, writer, MESSAGES[3:])
+    assert reader.refresh() > 0
+    fresh = GraphIndex(engine)
+    fresh.load()
+    for graph_index in (writer, reader, fresh):
+        assert graph_index.get_contact("email", "bob").interaction_count == 3
+        assert graph_index.related_conversations("project") == [("lunch", 1)]
+
+
+def test_two_writers_add_to_the_stored_counters(engine):
+    first = GraphIndex(engine)
+    first.load()
+    second = GraphIndex(engine)
+    second.load()
+    # e.g. two ingest workers, neither has seen the other's messages
+    add(engine, first, [make_message("1", "project", "bob", 1), make_message("4", "lunch", "bob", 4)])
+    add(engine, second, [make_message("2", "project", "bob", 2)])
+    add(engine, first, [make_message("8", "project", "bob", 0)])
+
+    fresh = GraphIndex(engine)
+    fresh.load()
+    contact = fresh.get_contact("email", "bob")
+    assert contact.interaction_count == 4
+    assert contact.first_interaction.replace(tzinfo=None) == START
+    assert contact.last_interaction.replace(tzinfo=None) == START + timedelta(minutes=4)
+    assert [(link.source_id, link.interaction_count) for link in contact.conversations] == [("lunch", 1), ("project", 3)]
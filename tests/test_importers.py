@@ -0,0 +1,112 @@
+import json
+import time
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+import pytest
+from sqlmodel import Session, select
+
+from messaging_manager.importers import mbox, telegram_export
+from messaging_manager.importers.mbox import get_box, import_mbox, iter_mbox
+from messaging_manager.importers.telegram_export import import_telegram_export
+from messaging_manager.libs.database_models import DraftQueueItem, MediaObject, UnifiedMessageFormat
+from messaging_manager.libs.email_parsing import INBOX, SENT_BOX, parse_email
+
+OWN_EMAIL = "me@gmail.com"
+
+
+@pytest.fixture
+def import_engine(engine, monkeypatch):
+    monkeypatch.setattr(mbox, "get_engine", lambda media_dir=None: engine)
+    monkeypatch.setattr(telegram_export, "get_engine", lambda media_dir=None: engine)
+    return engine
+
+
+def make_email(name, sender, recipient, labels, body, days_old=1, attachment=None, in_reply_to=None):
+    message = EmailMessage()
+    message["From"] = sender
+    message["To"] = recipient
+    message["Subject"] = f"About {in_reply_to or name}"
+    message["Date"] = (datetime.now(timezone.utc) - timedelta(days=days_old)).strftime("%a, %d %b %Y %H:%M:%S +0000")
+    message["Message-ID"] = f"<{name}@example.com>"
+    if in_reply_to is not None:
+        message["In-Reply-To"] = f"<{in_reply_to}@example.com>"
+    message["X-Gmail-Labels"] = labels
+    message.set_content(body)
+    if attachment is not None:
+        message.add_attachment(b"image data", maintype="image", subtype="png", filename=attachment)
+    return message.as_bytes().replace(b"\r\n", b"\n")
+
+
+def write_mbox(path, raw_emails):
+    with open(path, "wb") as f:
+        for raw_email in raw_emails:
+            f.write(b"From 1234@xxx Mon Jan 01 00:00:00 +0000 2024\n")
+            # mboxrd escapes body lines that start with From
+            f.write(raw_email.replace(b"\nFrom ", b"\n>From ") + b"\n")
+    return str(path)
+
+
+def stored_messages(engine, service_name):
+    with Session(engine) as session:
+        return {message.source_keys["message_id_header"]: message for message in
+                session.exec(select(UnifiedMessageFormat).where(UnifiedMessageFormat.service_name == service_name)).all()}
+
+
+def test_mbox_emails_are_split_and_unescaped(tmp_path):
+    path = write_mbox(tmp_path / "mail.mbox", [make_email("a", "bob@x.com", OWN_EMAIL, "Inbox", "hi\nFrom now on\n"),
+                                               make_email("b", "bob@x.com", OWN_EMAIL, "Inbox", "bye")])
+    raw_emails = list(iter_mbox(path))
+    assert len(raw_emails) == 2
+    assert b"\r\nFrom now on\r\n" in raw_emails[0]
+    assert get_box("Archived,Opened") == INBOX
+    assert get_box("Sent,Opened") == SENT_BOX
+    assert get_box("Inbox,Spam") is None
+
+
+def test_mbox_import_matches_fetched_emails_and_runs_once(import_engine, tmp_path):
+    raw_emails = [make_email("a", "Bob <bob@x.com>", OWN_EMAIL, "Inbox,Opened", "see the attached pic.png", attachment="pic.png"),
+                  make_email("b", OWN_EMAIL, "bob@x.com", "Sent", "thanks", in_reply_to="a"),
+                  make_email("c", "spam@x.com", OWN_EMAIL, "Spam", "buy now"),
+                  make_email("d", "Ann <ann@x.com>", OWN_EMAIL, "Archived", "old news", days_old=400)]
+    path = write_mbox(tmp_path / "mail.mbox", raw_emails)
+    media_dir = str(tmp_path / "media")
+
+    assert import_mbox(path, OWN_EMAIL, media_dir=media_dir, workers=1, batch_size=2) == 3
+    assert import_mbox(path, OWN_EMAIL, media_dir=media_dir, workers=1, batch_size=2) == 0
+
+    messages = stored_messages(import_engine, "email")
+    assert sorted(messages) == ["<a@example.com>", "<b@example.com>", "<d@example.com>"]
+    # the same ids and conversation as the mapper gives the fetched email
+    fetched, _ = parse_email(raw_emails[0].replace(b"\n", b"\r\n"), INBOX, OWN_EMAIL)
+    assert messages["<a@example.com>"].message_id == fetched["message_id"]
+    assert messages["<b@example.com>"].source_id == messages["<a@example.com>"].source_id
+    assert messages["<b@example.com>"].sender_name == "user"
+    with Session(import_engine) as session:
+        assert session.exec(select(MediaObject.ref_count)).all() == [1]
+        # only the recently active conversation is queued
+        assert session.exec(select(DraftQueueItem.source_id)).all() == [messages["<a@example.com>"].source_id]
+
+
+def test_telegram_export_imports_private_chats(import_engine, tmp_path):
+    now = int(time.time())
+    export = {"chats": {"list": [
+        {"name": "Carol", "type": "personal_chat", "id": 55, "messages": [
+            {"id": 10, "type": "message", "date_unixtime": str(now - 100), "from_id": "user55",
+             "text": ["hey ", {"type": "bold", "text": "you"}]},
+            {"id": 11, "type": "message", "date_unixtime": str(now - 50), "from_id": "user1", "text": "look",
+             "photo": "chats/chat_01/photos/p.jpg"},
+            {"id": 12, "type": "service", "date_unixtime": str(now), "actor_id": "user1", "action": "phone_call"}]},
+        {"name": "Group", "type": "private_group", "id": 77, "messages": [
+            {"id": 13, "type": "message", "date_unixtime": str(now), "from_id": "user9", "text": "x"}]}]}}
+    (tmp_path / "export" / "chats" / "chat_01" / "photos").mkdir(parents=True)
+    (tmp_path / "export" / "chats" / "chat_01" / "photos" / "p.jpg").write_bytes(b"photo")
+    path = tmp_path / "export" / "result.json"
+    path.write_text(json.dumps(export))
+
+    assert import_telegram_export(str(path), account_id="phone", media_dir=str(tmp_path / "media")) == 2
+    with Session(import_engine) as session:
+        messages = session.exec(select(UnifiedMessageFormat).order_by(UnifiedMessageFormat.message_timestamp)).all()
+    assert [(message.sender_name, message.message_content) for message in messages] == [("Carol", "hey you"), ("user", "look")]
+    assert {message.service_name for message in messages} == {"telegram:phone"}
+    assert len(messages[1].file_paths) == 1
+    assert import_telegram_export(str(path), account_id="phone", media_dir=str(tmp_path / "media")) == 0
@@ -0,0 +1,88 @@
+import asyncio
+import pytest
+
+from messaging_manager.libs.events import event_bus, PIPELINE_PROGRESS
+from messaging_manager.libs.jobs import FAILED, QUEUED, SUCCEEDED, JobQueue
+
+
+async def wait_until_finished(jobs, *job_ids):
+    while any(jobs.get(job_id).finished_at is None for job_id in job_ids):
+        await asyncio.sleep(0.01)
+
+
+def test_jobs_run_in_order_and_queued_duplicates_are_merged():
+    async def run():
+        jobs = JobQueue()
+        started = asyncio.Event()
+        release = asyncio.Event()
+        ran = []
+
+        async def pull(job):
+            ran.append(job.job_id)
+            started.set()
+            await release.wait()
+            event_bus.publish(PIPELINE_PROGRESS, {"stage": "fetch", "count": len(ran)})
+
+        jobs.register("pull", pull)
+        first, created = jobs.submit("pull")
+        assert created
+        worker = asyncio.create_task(jobs.run())
+        await started.wait()
+        # the running job may have started before what the caller wants, so a new one is queued
+        second, created = jobs.submit("pull")
+        assert created
+        assert jobs.submit("pull") == (second, False)
+        assert second.status == QUEUED
+
+        release.set()
+        await asyncio.wait_for(wait_until_finished(jobs, first.job_id, second.job_id), 1)
+        worker.cancel()
+        assert ran == [first.job_id, second.job_id]
+        assert first.status == SUCCEEDED
+        assert first.progress["fetch"]["count"] == 1
+        assert [job.job_id for job in jobs.recent()] == [second.job_id, first.job_id]
+    asyncio.run(run())
+
+
+def test_failed_job_records_its_error_and_the_queue_carries_on():
+    async def run():
+        jobs = JobQueue()
+
+        async def fail(job):
+            raise RuntimeError("imap is down")
+
+        async def succeed(job):
+            pass
+
+        jobs.register("fail", fail)
+        jobs.register("succeed", succeed)
+        failed, _ = jobs.submit("fail")
+        succeeded, _ = jobs.submit("succeed")
+        worker = asyncio.create_task(jobs.run())
+        await asyncio.wait_for(wait_until_finished(jobs, failed.job_id, succeeded.job_id), 1)
+        worker.cancel()
+        assert (failed.status, failed.error) == (FAILED, "imap is down")
+        assert succeeded.status == SUCCEEDED
+    asyncio.run(run())
+
+
+def test_unknown_kinds_are_refused_and_history_is_bounded():
+    async def run():
+        jobs = JobQueue(history_size=2)
+
+        async def noop(job):
+            pass
+
+        jobs.register("noop", noop)
+        with pytest.raises(ValueError):
+            jobs.submit("reticulate")
+        worker = asyncio.create_task(jobs.run())
+        for _ in range(4):
+            job, _ = jobs.submit("noop")
+            await asyncio.wait_for(wait_until_finished(jobs, job.job_id), 1)
+        jobs.submit("noop")
+        worker.cancel()
+        # finished jobs make room for the new one
+        assert len(jobs.recent()) == 2
+        assert jobs.recent()[0].status == QUEUED
+    asyncio.run(run())
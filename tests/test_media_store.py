@@ -0,0 +1,94 @@
+import os
+from datetime import datetime
+from sqlmodel import Session, select
+
+from messaging_manager.libs.database_models import MediaObject, UnifiedMessageFormat
+from messaging_manager.libs.media_store import MediaStore, get_extension
+
+
+def make_message(message_id, file_paths):
+    return UnifiedMessageFormat(message_id=message_id, service_name="email", source_id="s", sender_id="bob",
+                                sender_name="Bob", message_timestamp=datetime.now(), file_paths=file_paths)
+
+
+def test_same_content_is_stored_once(tmp_path):
+    store = MediaStore(str(tmp_path / "media"))
+    first = store.put_bytes(b"picture", "a.PNG")
+    second = store.put_bytes(b"picture", "b.png")
+    assert first == second
+    assert first.endswith(".png")
+    assert store.get_content_hash(first) is not None
+    assert os.listdir(store.tmp_dir) == []
+    assert store.put_bytes(b"other picture", "a.png") != first
+
+
+def test_failed_write_leaves_nothing_behind(tmp_path):
+    store = MediaStore(str(tmp_path / "media"))
+    try:
+        with store.writer("a.png") as writer:
+            writer.write(b"half a file")
+            raise ValueError("connection lost")
+    except ValueError:
+        pass
+    assert os.listdir(store.tmp_dir) == []
+    assert not os.path.exists(store.objects_dir)
+
+
+def test_paths_outside_the_store_have_no_hash(tmp_path):
+    store = MediaStore(str(tmp_path / "media"))
+    assert store.get_content_hash(str(tmp_path / "media" / "abc" / "a.png")) is None
+    assert store.get_content_hash("/etc/passwd") is None
+    assert get_extension("archive.tar.GZ") == ".gz"
+    assert get_extension("no extension") == ""
+
+
+def test_references_count_messages_not_copies(engine, tmp_path):
+    store = MediaStore(str(tmp_path / "media"))
+    path = store.put_bytes(b"picture", "a.png")
+    messages = [make_message("m1", [path, path]), make_message("m2", [path])]
+    with Session(engine) as session:
+        store.add_references(session, messages)
+        session.commit()
+        media = session.exec(select(MediaObject)).one()
+        assert media.ref_count == 2
+        assert media.size == len(b"picture")
+
+        store.remove_references(session, messages[:1])
+        session.commit()
+        assert session.exec(select(MediaObject)).one().ref_count == 1
+
+
+def test_legacy_media_is_moved_into_the_store(engine, tmp_path):
+    store = MediaStore(str(tmp_path / "media"))
+    legacy_dir = tmp_path / "media" / "oldhash"
+    legacy_dir.mkdir()
+    (legacy_dir / "photo.jpg").write_bytes(b"old photo")
+    with Session(engine) as session:
+        session.add(make_message("m1", [str(legacy_dir / "photo.jpg")]))
+        session.commit()
+        assert store.migrate_legacy_media(session) == 1
+        message = session.get(UnifiedMessageFormat, "m1")
+        assert store.get_content_hash(message.file_paths[0]) is not None
+        assert session.exec(select(MediaObject)).one().ref_count == 1
+        # already migrated messages are left alone
+        assert store.migrate_legacy_media(session) == 0
+
+
+def test_references_are_counted_in_the_database(engine, tmp_path):
+    store = MediaStore(str(tmp_path / "media"))
+    path = store.put_bytes(b"picture", "a.png")
+    with Session(engine) as session:
+        store.add_references(session, [make_message("m1", [path]), make_message("m2", [path])])
+        session.commit()
+        # loaded here, then another process stores a message with the same file
+        assert session.exec(select(MediaObject)).one().ref_count == 2
+        with Session(engine) as other:
+            store.add_references(other, [make_message("m3", [path])])
+            other.commit()
+        store.remove_references(session, [make_message("m1", [path])])
+        session.commit()
+        assert session.exec(select(MediaObject)).one().ref_count == 2
+
+        store.remove_references(session, [make_message("m4", [path, path, path])] * 2)
+        session.commit()
+        assert session.exec(select(MediaObject)).one().ref_count == 0
@@ -0,0 +1,83 @@
+import json
+from datetime import datetime
+from sqlalchemy import text
+from sqlmodel import Session, select
+
+from messaging_manager.libs.database import create_database_engine
+from messaging_manager.libs.database_models import (DraftMessageLink, DraftQueueItem, DraftResponse, EmailThreadLink,
+                                                    SchemaMigration, UnifiedMessageFormat)
+from messaging_manager.libs.email_threading import get_thread_key
+from messaging_manager.libs.migrations import MIGRATIONS, migrate_database
+from messaging_manager.libs.search_index import search_messages
+
+
+def legacy_message(message_id, source_keys=None):
+    return {"message_id": message_id, "service_name": "gmail", "source_id": "conversation",
+            "source_keys": source_keys or {}, "message_content": f"hello from {message_id}", "sender_id": "bob",
+            "sender_name": "Bob", "message_timestamp": "2024-01-01T10:00:00", "file_paths": []}
+
+
+def create_legacy_database(engine):
+    """the schema from before migrations existed, drafts held full copies of their messages"""
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE unifiedmessageformat (message_id VARCHAR PRIMARY KEY, service_name VARCHAR, "
+                                "source_id VARCHAR, source_keys JSON, message_content VARCHAR, sender_id VARCHAR, "
+                                "sender_name VARCHAR, message_timestamp DATETIME, file_paths JSON)"))
+        connection.execute(text("CREATE TABLE draftresponse (draft_response_id VARCHAR PRIMARY KEY, messages JSON, "
+                                "thoughts VARCHAR, summary_of_chat VARCHAR, reasoning_for_decision VARCHAR, "
+                                "response_suggested BOOLEAN, response VARCHAR, status VARCHAR)"))
+        stored = legacy_message("m1", {"message_id_header": "<m1@example.com>"})
+        connection.execute(text("INSERT INTO unifiedmessageformat VALUES (:message_id, :service_name, :source_id, "
+                                ":source_keys, :message_content, :sender_id, :sender_name, :message_timestamp, :file_paths)"),
+                           dict(stored, source_keys=json.dumps(stored["source_keys"]), file_paths="[]"))
+        # m2 is only left in the draft
+        connection.execute(text("INSERT INTO draftresponse VALUES ('d1', :messages, 'thoughts', 'summary', 'reasoning', 1, 'hi', 'pending')"),
+                           {"messages": json.dumps([stored, legacy_message("m2")])})
+
+
+def test_legacy_database_is_migrated_in_place(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    engine = create_database_engine(f"sqlite:///{tmp_path / 'messages.db'}")
+    create_legacy_database(engine)
+    migrate_database(engine, media_dir=str(tmp_path / "media"))
+
+    with Session(engine) as session:
+        versions = session.exec(select(SchemaMigration.version).order_by(SchemaMigration.version)).all()
+        assert versions == [version for version, *_ in MIGRATIONS]
+
+        links = session.exec(select(DraftMessageLink).order_by(DraftMessageLink.position)).all()
+        assert [link.message_id for link in links] == ["m1", "m2"]
+        assert session.get(UnifiedMessageFormat, "m2").message_content == "hello from m2"
+        draft = session.get(DraftResponse, "d1")
+        assert draft.source_id == "conversation"
+        assert draft.created_at is not None
+
+        assert session.get(DraftQueueItem, "conversation") is not None
+        link = session.get(EmailThreadLink, get_thread_key("gmail", "<m1@example.com>"))
+        assert link.source_id == "conversation"
+        assert session.get(UnifiedMessageFormat, "m1").created_at is None
+        assert [result.message_id for result in search_messages(session, "m2").results] == ["m2"]
+    engine.dispose()
+
+
+def test_migrations_run_once(engine):
+    with Session(engine) as session:
+        applied = session.exec(select(SchemaMigration)).all()
+    migrate_database(engine)
+    with Session(engine) as session:
+        assert session.exec(select(SchemaMigration)).all() == applied
+
+
+def test_media_migration_waits_for_a_media_dir(tmp_path):
+    engine = create_database_engine(f"sqlite:///{tmp_path / 'messages.db'}")
+    # e.g. check_database against a database whose media lives on another machine
+    migrate_database(engine)
+    media_versions = [version for version, _, _, _, uses_media_dir in MIGRATIONS if uses_media_dir]
+    with Session(engine) as session:
+        applied = session.exec(select(SchemaMigration.version)).all()
+    assert len(media_versions) > 0 and not set(media_versions) & set(applied)
+
+    migrate_database(engine, media_dir=str(tmp_path / "media"))
+    with Session(engine) as session:
+        assert set(media_versions) <= set(session.exec(select(SchemaMigration.version)).all())
+    engine.dispose()
@@ -0,0 +1,173 @@
+import asyncio
+from datetime import datetime, timedelta
+import pytest
+from sqlmodel import Session, select, func
+
+import messaging_manager.run as run
+from messaging_manager.libs.database_models import DraftQueueItem, ServiceMetadata, UnifiedMessageFormat
+from messaging_manager.libs.graph_index import GraphIndex
+from messaging_manager.libs.scheduler import PollScheduler, get_poll_key
+from messaging_manager.libs.service_mapper_interface import ServiceMapperInterface
+
+START = datetime(2024, 1, 1)
+
+
+class FolderMapper(ServiceMapperInterface):
+    """serves a fixed mailbox, every folder returns the messages after the latest one it is given"""
+
+    def __init__(self, messages_per_folder):
+        self.service_name = "email"
+        self.mailbox = {}
+        for folder, count in messages_per_folder.items():
+            self.mailbox[folder] = [UnifiedMessageFormat(
+                message_id=f"{folder}-{number}", service_name="email", source_id=f"conversation {number % 7}",
+                source_keys={"box": folder, "other_party_id": f"contact {number % 7}"},
+                message_content=f"message {number}", sender_id="me" if folder == "Sent" else f"contact {number % 7}",
+                sender_name="user" if folder == "Sent" else f"Contact {number % 7}",
+                message_timestamp=START + timedelta(minutes=number)) for number in range(count)]
+        self.latest_seen = {}
+
+    def get_poll_folders(self):
+        return list(self.mailbox)
+
+    async def iter_new_messages(self, latest_message, limit_per_source=40, folder=None):
+        self.latest_seen[folder] = latest_message.message_id if latest_message else None
+        after = latest_message.message_timestamp if latest_message else None
+        messages = [message.model_copy() for message in self.mailbox[folder] if after is None or message.message_timestamp > after]
+        for start in range(0, len(messages), 100):
+            yield messages[start:start + 100]
+
+    async def get_new_messages(self, latest_message, limit_per_source=40):
+        return []
+
+    async def get_service_metadata(self):
+        return ServiceMetadata(service_name=self.service_name)
+
+    async def reply_to_message(self, message, reply_content):
+        return "sent"
+
+    async def login(self):
+        return True
+
+    async def logout(self):
+        return True
+
+    async def is_logged_in(self):
+        return True
+
+
+@pytest.fixture
+def loop_manager(engine, tmp_path, monkeypatch):
+    mapper = FolderMapper({"INBOX": 450, "Sent": 30})
+    monkeypatch.setattr(run, "GmailServiceMapper", lambda **kwargs: mapper)
+    monkeypatch.setattr(run, "embed_batch_with_ollama",
+                        lambda server_url, texts, model=None: [[1.0, float(len(text))] for text in texts])
+    return run.LoopManager(engine, str(tmp_path / "media"), memory_dir=str(tmp_path / "memory"))
+
+
+def count(engine, model):
+    with Session(engine) as session:
+        return session.exec(select(func.count()).select_from(model)).one()
+
+
+def test_pull_stores_new_messages_once_and_queues_their_conversations(engine, loop_manager):
+    scheduler = PollScheduler()
+    assert asyncio.run(loop_manager.pull_latest_messages(scheduler)) == 480
+    assert count(engine, UnifiedMessageFormat) == 480
+    assert count(engine, DraftQueueItem) == 7
+    assert scheduler.states[get_poll_key("email", "INBOX")].last_poll is not None
+
+    # every folder continues from its own newest message
+    assert asyncio.run(loop_manager.pull_latest_messages()) == 0
+    mapper = loop_manager.service_mappers[0]
+    assert mapper.latest_seen == {"INBOX": "INBOX-449", "Sent": "Sent-29"}
+    assert [sample.message_id for sample in loop_manager.writing_samples.get_samples("email", "contact 1", k=1)] == ["Sent-29"]
+
+
+def test_only_due_folders_are_polled(loop_manager):
+    scheduler = PollScheduler()
+    asyncio.run(loop_manager.pull_latest_messages(scheduler))
+    mapper = loop_manager.service_mappers[0]
+    mapper.latest_seen = {}
+    asyncio.run(loop_manager.pull_latest_messages(scheduler))
+    assert mapper.latest_seen == {}
+
+
+def test_embedding_scans_only_newly_stored_messages(engine, loop_manager):
+    asyncio.run(loop_manager.pull_latest_messages())
+    assert asyncio.run(loop_manager.embed_new_messages()) == 480
+    assert asyncio.run(loop_manager.embed_new_messages()) == 0
+    with Session(engine) as session:
+        session.add(UnifiedMessageFormat(message_id="late", service_name="email", source_id="conversation 1",
+                                         sender_id="contact 1", sender_name="Contact 1", message_content="one more",
+                                         message_timestamp=START + timedelta(days=1)))
+        session.commit()
+    missing_ids, _ = loop_manager.get_unembedded_ids()
+    assert missing_ids == ["late"]
+
+
+def test_failed_embedding_is_retried(loop_manager, monkeypatch):
+    asyncio.run(loop_manager.pull_latest_messages())
+
+    def unavailable(server_url, texts, model=None):
+        raise ConnectionError("ollama is down")
+
+    monkeypatch.setattr(run, "embed_batch_with_ollama", unavailable)
+    assert asyncio.run(loop_manager.embed_new_messages()) == 0
+    assert loop_manager.embedded_through is None
+    assert len(loop_manager.get_unembedded_ids()[0]) == 480
+
+
+def test_draft_workers_share_the_queue_and_the_ingest_indexes(engine, loop_manager, tmp_path):
+    asyncio.run(loop_manager.pull_latest_messages())
+    first = run.LoopManager(engine, str(tmp_path / "media"), memory_dir=str(tmp_path / "memory"), read_only_vectors=True)
+    second = run.LoopManager(engine, str(tmp_path / "media"), memory_dir=str(tmp_path / "memory"), read_only_vectors=True)
+    first.worker_id, second.worker_id = "first", "second"
+
+    ranked = first.rank_conversations()
+    assert len(ranked) == 7
+    # claiming takes the tried conversations off the list it is given
+    claimed = first.claim_conversations(list(ranked), 3)
+    assert claimed == ranked[:3]
+    # leased conversations are left out of the second worker's ranking
+    assert set(second.claim_conversations(second.rank_conversations(), 10)) == set(ranked[3:])
+
+    # vectors embedded by ingest show up after a refresh
+    asyncio.run(loop_manager.embed_new_messages())
+    assert len(first.vector_index) == 0
+    first.refresh_indexes()
+    assert len(first.vector_index) == 480
+
+
+def test_drafting_pass_stops_at_its_budget(loop_manager, monkeypatch):
+    asyncio.run(loop_manager.pull_latest_messages())
+    drafted = []
+
+    async def draft_conversation(source_id):
+        drafted.append(source_id)
+        return True
+
+    monkeypatch.setattr(loop_manager, "draft_conversation", draft_conversation)
+    assert asyncio.run(loop_manager.process_messages(run.DraftBudget(max_drafts=5))) == 2
+    assert asyncio.run(loop_manager.process_messages()) == 0
+    assert len(drafted) == len(set(drafted)) == 7
+
+
+def test_scheduled_cycle_picks_up_what_an_importer_stored(engine, loop_manager):
+    scheduler = PollScheduler()
+    asyncio.run(loop_manager.pull_latest_messages(scheduler))
+    assert loop_manager.graph_index.get_contact("email", "contact 1").interaction_count == 65
+
+    # an importer writes the graph from its own process
+    importer_graph = GraphIndex(engine)
+    importer_graph.load()
+    with Session(engine) as session:
+        importer_graph.add_messages(session, [UnifiedMessageFormat(
+            message_id="imported", service_name="email", source_id="conversation 1", sender_id="contact 1",
+            sender_name="Contact 1", message_content="old mail", message_timestamp=START - timedelta(days=400))])
+        session.commit()
+
+    scheduler.record_drafting()
+    scheduler.record_retention()
+    asyncio.run(loop_manager.run_scheduled(scheduler))
+    assert loop_manager.graph_index.get_contact("email", "contact 1").interaction_count == 66
@@ -0,0 +1,108 @@
+import pytest
+
+from messaging_manager.libs.reply_stripping import strip_reply
+
+# Reply formats seen in real mail, (name, text, expected strip_reply result).
+# Texts use \r\n like emails fetched over imap unless the client sends \n.
+
+REPLY_CORPUS = [
+    ("plain message",
+     "Hi Bob,\r\n\r\nThe report is attached.\r\n\r\nThanks",
+     "Hi Bob,\n\nThe report is attached.\n\nThanks"),
+
+    ("gmail",
+     "Sounds good, see you then.\r\n\r\nOn Mon, Jan 1, 2024 at 10:00 AM Bob Smith <bob@example.com> wrote:\r\n> Lunch on Friday?\r\n>\r\n> Bob\r\n",
+     "Sounds good, see you then."),
+
+    ("gmail wrapped attribution",
+     "Works for me.\r\n\r\nOn Mon, Jan 1, 2024 at 10:00 AM Bartholomew Longname-Smith <\r\nbartholomew.longname-smith@example.com> wrote:\r\n\r\n> Can we move the call?\r\n",
+     "Works for me."),
+
+    ("gmail nested quotes",
+     "Done.\r\n\r\nOn Tue, Jan 2, 2024 at 9:00 AM Ann <ann@example.com> wrote:\r\n> Did you send it?\r\n>\r\n> On Mon, Jan 1, 2024 at 8:00 AM Me <me@example.com> wrote:\r\n>> I'll send it tomorrow.\r\n>>\r\n",
+     "Done."),
+
+    ("apple mail",
+     "Thanks!\n\nSent from my iPhone\n\n> On Jan 1, 2024, at 10:00, Bob <bob@example.com> wrote:\n>\n> Here are the photos.\n",
+     "Thanks!"),
+
+    ("thunderbird",
+     "I'll take a look.\r\n\r\nOn 1/1/24 10:00, Bob wrote:\r\n> Can you review the PR?\r\n",
+     "I'll take a look."),
+
+    ("yahoo",
+     "Yes please.\r\n\r\nOn Monday, January 1, 2024, 10:00:00 AM EST, Bob <bob@example.com> wrote:\r\n\r\n> More coffee?\r\n",
+     "Yes please."),
+
+    ("outlook desktop",
+     "Approved.\r\n\r\n-----Original Message-----\r\nFrom: Bob <bob@example.com>\r\nSent: Monday, January 1, 2024 10:00 AM\r\nTo: Me <me@example.com>\r\nSubject: Budget\r\n\r\nPlease approve the budget.\r\n",
+     "Approved."),
+
+    ("outlook web",
+     "Approved.\r\n\r\n________________________________\r\nFrom: Bob <bob@example.com>\r\nSent: Monday, January 1, 2024 10:00 AM\r\nTo: Me\r\nSubject: Budget\r\n\r\nPlease approve the budget.\r\n",
+     "Approved."),
+
+    ("outlook headers without marker",
+     "Approved.\r\n\r\nFrom: Bob <bob@example.com>\r\nDate: Monday, January 1, 2024 at 10:00\r\nTo: Me <me@example.com>\r\nSubject: Budget\r\n\r\nPlease approve the budget.\r\n",
+     "Approved."),
+
+    ("french gmail",
+     "Merci !\r\n\r\nLe lun. 1 janv. 2024 à 10:00, Bob <bob@example.com> a écrit :\r\n> Bonjour\r\n",
+     "Merci !"),
+
+    ("german gmail",
+     "Danke!\r\n\r\nAm Mo., 1. Jan. 2024 um 10:00 Uhr schrieb Bob <bob@example.com>:\r\n> Hallo\r\n",
+     "Danke!"),
+
+    ("spanish gmail",
+     "Gracias.\r\n\r\nEl lun, 1 ene 2024 a las 10:00, Bob (<bob@example.com>) escribió:\r\n> Hola\r\n",
+     "Gracias."),
+
+    ("signature",
+     "See you there.\r\n\r\n-- \r\nBob Smith\r\nHead of Things\r\n",
+     "See you there."),
+
+    ("signature and quote",
+     "See you there.\r\n-- \r\nBob\r\n\r\nOn Mon, Jan 1, 2024 at 10:00 AM Ann <ann@example.com> wrote:\r\n> Party at 8\r\n",
+     "See you there."),
+
+    ("double dash without the space",
+     "Numbers are in.\r\n--\r\nRevenue up, costs down.\r\n",
+     "Numbers are in.\n--\nRevenue up, costs down."),
+
+    ("mobile signature",
+     "On my way\r\n\r\nGet Outlook for iOS\r\n",
+     "On my way"),
+
+    ("bottom posted",
+     "On Mon, Jan 1, 2024 at 10:00 AM Bob <bob@example.com> wrote:\r\n> Is the server back up?\r\n\r\nYes, since this morning.\r\n",
+     "Yes, since this morning."),
+
+    ("inline answers",
+     "On Mon, Jan 1, 2024 at 10:00 AM Bob <bob@example.com> wrote:\r\n> Can you make Friday?\r\nYes.\r\n> And bring the slides?\r\nSure, I'll bring them.\r\n",
+     "Yes.\nSure, I'll bring them."),
+
+    ("trailing quote without attribution",
+     "Agreed.\r\n\r\n> We should ship it.\r\n> Thoughts?\r\n",
+     "Agreed."),
+
+    ("quote in the middle without attribution",
+     "You said:\r\n> ship it on friday\r\nI think monday is safer.\r\n",
+     "You said:\n> ship it on friday\nI think monday is safer."),
+
+    ("wrote in the text",
+     "On Monday I wrote:\r\nthe draft of the plan, it's in the shared folder.\r\n",
+     "On Monday I wrote:\nthe draft of the plan, it's in the shared folder."),
+
+    ("forwarded message",
+     "FYI\r\n\r\n---------- Forwarded message ---------\r\nFrom: Bob <bob@example.com>\r\nDate: Mon, Jan 1, 2024 at 10:00 AM\r\nSubject: Outage\r\nTo: Ann <ann@example.com>\r\n\r\nThe server is down.\r\n",
+     "FYI\n\n---------- Forwarded message ---------\nFrom: Bob <bob@example.com>\nDate: Mon, Jan 1, 2024 at 10:00 AM\nSubject: Outage\nTo: Ann <ann@example.com>\n\nThe server is down."),
+
+    ("empty", "", ""),
+]
+
+
+@pytest.mark.parametrize("text, expected", [(text, expected) for _, text, expected in REPLY_CORPUS],
+                         ids=[name for name, _, _ in REPLY_CORPUS])
+def test_strip_reply(text, expected):
+    assert strip_reply(text) == expected
@@ -0,0 +1,95 @@
+import os
+from datetime import datetime, timedelta
+from sqlmodel import Session, select
+
+from messaging_manager.libs.database_models import DraftResponse, MediaObject, UnifiedMessageFormat
+from messaging_manager.libs.drafts import link_draft_messages
+from messaging_manager.libs.media_store import MediaStore
+from messaging_manager.libs.retention import (ArchiveWriter, DraftPolicy, MessagePolicy, RetentionConfig,
+                                              RetentionManager)
+
+NOW = datetime.now()
+
+
+def make_message(message_id, days_old, service_name="email", file_paths=None):
+    return UnifiedMessageFormat(message_id=message_id, service_name=service_name, source_id="conversation",
+                                message_content=f"text of {message_id}", sender_id="bob", sender_name="Bob",
+                                message_timestamp=NOW - timedelta(days=days_old), file_paths=file_paths or [])
+
+
+def make_draft(draft_response_id, days_old, status):
+    return DraftResponse(draft_response_id=draft_response_id, thoughts="", summary_of_chat="", reasoning_for_decision="",
+                         response_suggested=True, status=status, source_id="conversation",
+                         created_at=NOW - timedelta(days=days_old), updated_at=NOW - timedelta(days=days_old))
+
+
+def make_manager(engine, tmp_path, **config):
+    config = RetentionConfig(archive_dir=str(tmp_path / "archive"), media_grace_hours=0,
+                             messages={"*": MessagePolicy(archive_after_days=30)}, **config)
+    return RetentionManager(engine, str(tmp_path / "media"), config)
+
+
+def test_policies_fall_back_to_the_service_and_then_the_default(tmp_path):
+    config = RetentionConfig(messages={"*": MessagePolicy(), "email": MessagePolicy(archive_after_days=180),
+                                       "email:work": MessagePolicy(archive_after_days=30)})
+    manager = RetentionManager(None, str(tmp_path / "media"), config)
+    assert manager.get_message_policy("email:work").archive_after_days == 30
+    assert manager.get_message_policy("email:personal").archive_after_days == 180
+    assert manager.get_message_policy("telegram:phone").archive_after_days is None
+
+
+def test_old_messages_are_archived_with_their_media(engine, tmp_path):
+    manager = make_manager(engine, tmp_path)
+    store = manager.media_store
+    shared = store.put_bytes(b"shared", "shared.png")
+    archived_only = store.put_bytes(b"old", "old.png")
+    messages = [make_message("old", 60, file_paths=[shared, archived_only]),
+                make_message("in draft", 60),
+                make_message("recent", 1, file_paths=[shared])]
+    with Session(engine) as session:
+        session.add_all(messages)
+        store.add_references(session, messages)
+        session.add(make_draft("d1", 1, "pending"))
+        link_draft_messages(session, "d1", messages[1:2])
+        session.commit()
+
+    report = manager.run_once()
+    assert report.archived_messages == 1
+    assert report.deleted_media_objects == 1
+    assert [message.message_id for message in manager.archive.read("email")] == ["old"]
+    with Session(engine) as session:
+        assert sorted(session.exec(select(UnifiedMessageFormat.message_id)).all()) == ["in draft", "recent"]
+        assert session.exec(select(MediaObject.path)).all() == [shared]
+    assert os.path.exists(shared)
+    assert not os.path.exists(archived_only)
+
+
+def test_expired_drafts_are_deleted_except_the_newest(engine, tmp_path):
+    manager = make_manager(engine, tmp_path, drafts={"ignored": DraftPolicy(delete_after_days=30)})
+    with Session(engine) as session:
+        session.add_all([make_draft("oldest", 90, "ignored"), make_draft("old", 60, "ignored"),
+                         make_draft("pending", 70, "pending")])
+        session.commit()
+    assert manager.run_once().deleted_drafts == 1
+    with Session(engine) as session:
+        # the newest draft of the conversation is ignored but kept
+        assert sorted(session.exec(select(DraftResponse.draft_response_id)).all()) == ["old", "pending"]
+
+
+def test_unknown_media_files_are_collected(engine, tmp_path):
+    manager = make_manager(engine, tmp_path)
+    orphan = manager.media_store.put_bytes(b"never referenced", "orphan.png")
+    legacy_dir = tmp_path / "media" / "oldhash"
+    legacy_dir.mkdir()
+    (legacy_dir / "photo.jpg").write_bytes(b"old photo")
+    manager.run_once()
+    assert not os.path.exists(orphan)
+    assert not legacy_dir.exists()
+
+
+def test_archive_readers_skip_copies_from_interrupted_runs(tmp_path):
+    archive = ArchiveWriter(str(tmp_path / "archive"), segment_max_bytes=1)
+    archive.append("email", [make_message("1", 60), make_message("2", 60)])
+    archive.append("email", [make_message("2", 60), make_message("3", 60)])
+    assert len(os.listdir(tmp_path / "archive" / "email")) == 2
+    assert [message.message_id for message in archive.read("email")] == ["1", "2", "3"]
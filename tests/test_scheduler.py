@@ -0,0 +1,50 @@
+from messaging_manager.libs.scheduler import PollScheduler
+
+
+def test_new_folders_are_due_right_away():
+    scheduler = PollScheduler()
+    assert scheduler.is_due("email/INBOX", now=1000)
+
+
+def test_busy_folder_is_polled_sooner_and_quiet_folder_backs_off():
+    scheduler = PollScheduler(base_interval=300, min_interval=30, max_interval=3600)
+    scheduler.record_poll("busy", 0, now=1000)
+    scheduler.record_poll("busy", 20, now=1300)
+    assert scheduler.states["busy"].interval < 300
+    assert scheduler.states["busy"].interval >= 30
+
+    scheduler.record_poll("quiet", 0, now=1000)
+    assert scheduler.states["quiet"].interval == 600
+    for poll in range(10):
+        scheduler.record_poll("quiet", 0, now=2000 + poll)
+    assert scheduler.states["quiet"].interval == 3600
+    assert not scheduler.is_due("quiet", now=2100)
+
+
+def test_backpressure_holds_every_folder_at_the_max_interval():
+    scheduler = PollScheduler(base_interval=300, max_interval=3600)
+    scheduler.record_poll("busy", 20, now=1000)
+    assert scheduler.is_due("busy", now=1400)
+    scheduler.backpressure = True
+    assert not scheduler.is_due("busy", now=1400)
+    assert scheduler.is_due("busy", now=4600)
+
+
+def test_drafting_runs_only_after_new_messages():
+    scheduler = PollScheduler(draft_interval=60)
+    scheduler.record_drafting(now=1000)
+    scheduler.record_poll("inbox", 0, now=1100)
+    assert not scheduler.is_drafting_due(now=1200)
+    scheduler.record_poll("inbox", 3, now=1300)
+    assert scheduler.is_drafting_due(now=1300)
+    # a pass that hit its budget keeps drafting pending
+    scheduler.record_drafting(now=1300, backlog=True)
+    assert not scheduler.is_drafting_due(now=1330)
+    assert scheduler.is_drafting_due(now=1360)
+
+
+def test_scheduler_without_folders_sleeps_the_base_interval():
+    scheduler = PollScheduler(base_interval=300, retention_interval=1800)
+    scheduler.record_drafting(now=1000)
+    scheduler.record_retention(now=1000)
+    assert scheduler.seconds_until_next(now=1000) == 300
@@ -0,0 +1,57 @@
+from datetime import datetime
+from sqlmodel import Session
+
+from messaging_manager.libs.database_models import UnifiedMessageFormat
+from messaging_manager.libs.search_index import build_match_query, build_tsquery, rebuild_search_index, search_messages
+
+
+def make_message(message_id, message_content, service_name="email", sender_name="Bob"):
+    return UnifiedMessageFormat(message_id=message_id, service_name=service_name, source_id="conversation",
+                                message_content=message_content, sender_id=sender_name.lower(),
+                                sender_name=sender_name, message_timestamp=datetime(2024, 1, 1))
+
+
+def search_ids(engine, query, **kwargs):
+    with Session(engine) as session:
+        return [result.message_id for result in search_messages(session, query, **kwargs).results]
+
+
+def test_query_building():
+    assert build_match_query('quarterly "report" -draft') == '"quarterly" "report" "draft"*'
+    assert build_tsquery("Quarterly report") == "quarterly & report:*"
+    assert build_match_query("?!") == ""
+
+
+def test_search_follows_inserts_updates_and_deletes(engine):
+    with Session(engine) as session:
+        session.add_all([make_message("1", "the quarterly report is attached"),
+                         make_message("2", "lunch on friday?"),
+                         make_message("3", "report from the café", service_name="telegram", sender_name="Zoë")])
+        session.commit()
+        assert search_ids(engine, "quarterly rep") == ["1"]
+        assert sorted(search_ids(engine, "report")) == ["1", "3"]
+        assert search_ids(engine, "report", service_name="telegram") == ["3"]
+        # diacritics and sender names match too
+        assert search_ids(engine, "cafe") == ["3"]
+        assert search_ids(engine, "zoe") == ["3"]
+
+        message = session.get(UnifiedMessageFormat, "2")
+        message.message_content = "the report can wait"
+        session.add(message)
+        session.delete(session.get(UnifiedMessageFormat, "1"))
+        session.commit()
+    assert search_ids(engine, "lunch") == []
+    assert sorted(search_ids(engine, "report")) == ["2", "3"]
+    rebuild_search_index(engine)
+    assert sorted(search_ids(engine, "report")) == ["2", "3"]
+
+
+def test_results_are_paged(engine):
+    with Session(engine) as session:
+        session.add_all([make_message(str(i), f"status update {i}") for i in range(5)])
+        session.commit()
+        first = search_messages(session, "status", limit=3)
+        second = search_messages(session, "status", limit=3, offset=first.next_offset)
+    assert first.next_offset == 3
+    assert second.next_offset is None
+    assert len({result.message_id for result in first.results + second.results}) == 5
@@ -0,0 +1,96 @@
+import io
+from datetime import datetime, timedelta
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+from sqlmodel import Session
+
+from messaging_manager.libs import database
+from messaging_manager.libs.database_models import DraftResponse, UnifiedMessageFormat
+from messaging_manager.libs.drafts import link_draft_messages
+from messaging_manager.libs.media_store import MediaStore
+
+START = datetime(2024, 1, 1)
+
+
+@pytest.fixture
+def client(engine, tmp_path, monkeypatch):
+    # the server's engines are process wide, point them at the test database
+    monkeypatch.setenv("DATABASE_URL", str(engine.url))
+    monkeypatch.setattr(database, "_engine", engine)
+    monkeypatch.setattr(database, "_async_engine", None)
+    from ui import server
+    # without the lifespan, the pipeline doesn't start
+    yield TestClient(server.app)
+    if database._async_engine is not None:
+        database._async_engine.sync_engine.dispose()
+
+
+def store_drafts(engine, count):
+    with Session(engine) as session:
+        message = UnifiedMessageFormat(message_id="m1", service_name="email", source_id="conversation",
+                                       message_content="are we still on for the quarterly review?", sender_id="bob",
+                                       sender_name="Bob", message_timestamp=START)
+        session.add(message)
+        for number in range(count):
+            draft_response_id = f"d{number}"
+            session.add(DraftResponse(draft_response_id=draft_response_id, thoughts="", summary_of_chat="x" * 600,
+                                      reasoning_for_decision="", response_suggested=True, response="yes",
+                                      status="pending", source_id="conversation",
+                                      created_at=START + timedelta(minutes=number)))
+            link_draft_messages(session, draft_response_id, [message])
+        session.commit()
+
+
+def test_drafts_are_paged_and_revalidated(engine, client):
+    store_drafts(engine, 3)
+    first = client.get("/draft_responses", params={"limit": 2}, headers={"Accept-Encoding": "gzip"})
+    assert first.status_code == 200
+    assert first.headers["Content-Encoding"] == "gzip"
+    page = first.json()
+    assert [draft["draft_response_id"] for draft in page["drafts"]] == ["d2", "d1"]
+    second = client.get("/draft_responses", params={"limit": 2, "cursor": page["next_cursor"]}).json()
+    assert [draft["draft_response_id"] for draft in second["drafts"]] == ["d0"]
+
+    unchanged = client.get("/draft_responses", params={"limit": 2}, headers={"If-None-Match": first.headers["ETag"]})
+    assert unchanged.status_code == 304
+
+    detail = client.get("/draft_responses/d0").json()
+    assert [message["message_id"] for message in detail["messages"]] == ["m1"]
+    assert client.get("/draft_responses/missing").status_code == 404
+
+
+def test_search_endpoint(engine, client):
+    store_drafts(engine, 0)
+    results = client.get("/search", params={"q": "quarterly rev"}).json()
+    assert [result["message_id"] for result in results["results"]] == ["m1"]
+    assert "[quarterly]" in results["results"][0]["snippet"]
+
+
+def test_media_is_served_with_validators_and_ranges(client, tmp_path):
+    path = MediaStore("media").put_bytes(b"0123456789", "clip.mp4")
+    url = "/media/" + path[len("media/"):]
+    full = client.get(url)
+    assert full.content == b"0123456789"
+    assert "immutable" in full.headers["Cache-Control"]
+    assert client.get(url, headers={"If-None-Match": full.headers["ETag"]}).status_code == 304
+    partial = client.get(url, headers={"Range": "bytes=2-5"})
+    assert (partial.status_code, partial.content) == (206, b"2345")
+    assert client.get("/media/..%2Fmessages.db").status_code == 404
+
+
+def test_thumbnails_endpoint(client):
+    image = io.BytesIO()
+    Image.new("RGB", (1000, 500)).save(image, "JPEG")
+    path = MediaStore("media").put_bytes(image.getvalue(), "photo.jpg")
+    response = client.get("/thumbnails/small/" + path[len("media/"):])
+    assert response.status_code == 200
+    assert Image.open(io.BytesIO(response.content)).size == (160, 80)
+    assert client.get("/thumbnails/huge/" + path[len("media/"):]).status_code == 400
+
+
+def test_process_messages_is_refused_when_workers_run_the_pipeline(client, monkeypatch):
+    monkeypatch.setenv("EXTERNAL_WORKERS", "true")
+    response = client.post("/process_messages")
+    assert response.status_code == 409
+    assert client.get("/jobs").json() == []
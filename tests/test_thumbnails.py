@@ -0,0 +1,53 @@
+import os
+import pytest
+from PIL import Image
+
+from messaging_manager.libs.media_store import MediaStore
+from messaging_manager.libs.thumbnails import THUMBNAIL_SIZES, ThumbnailCache, ThumbnailError
+
+
+def save_image(path, size, mode="RGB"):
+    Image.new(mode, size).save(path)
+    return str(path)
+
+
+def test_thumbnails_are_resized_and_cached(tmp_path):
+    store = MediaStore(str(tmp_path / "media"))
+    source = store.put_file(save_image(tmp_path / "photo.jpg", (2000, 1000)))
+    cache = ThumbnailCache(store)
+    path, source_key = cache.get(source, "small")
+    assert source_key == store.get_content_hash(source)
+    assert path.endswith(".jpg")
+    with Image.open(path) as thumbnail:
+        assert thumbnail.size == (THUMBNAIL_SIZES["small"], THUMBNAIL_SIZES["small"] // 2)
+
+    modified = os.path.getmtime(path)
+    assert cache.get(source, "small") == (path, source_key)
+    assert os.path.getmtime(path) == modified
+
+    cache.remove(source_key)
+    assert not os.path.exists(path)
+
+
+def test_transparency_is_kept(tmp_path):
+    cache = ThumbnailCache(MediaStore(str(tmp_path / "media")))
+    path, _ = cache.get(save_image(tmp_path / "logo.png", (800, 800), mode="RGBA"), "medium")
+    assert path.endswith(".png")
+
+
+def test_files_outside_the_store_are_keyed_by_version(tmp_path):
+    cache = ThumbnailCache(MediaStore(str(tmp_path / "media")))
+    source = save_image(tmp_path / "photo.jpg", (400, 400))
+    first_key = cache.get_source_key(source)
+    save_image(tmp_path / "photo.jpg", (500, 400))
+    assert cache.get_source_key(source) != first_key
+
+
+def test_bad_requests_raise_thumbnail_errors(tmp_path):
+    cache = ThumbnailCache(MediaStore(str(tmp_path / "media")))
+    with pytest.raises(ThumbnailError):
+        cache.get(save_image(tmp_path / "photo.jpg", (400, 400)), "huge")
+    not_an_image = tmp_path / "notes.jpg"
+    not_an_image.write_bytes(b"not an image")
+    with pytest.raises(ThumbnailError):
+        cache.get(str(not_an_image), "small")
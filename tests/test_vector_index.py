@@ -0,0 +1,71 @@
+import pytest
+
+from messaging_manager.libs.vector_index import VectorIndex
+
+
+def test_search_returns_nearest_first(tmp_path):
+    index = VectorIndex(str(tmp_path / "vectors"))
+    assert index.add(["a", "b", "c"], [[1, 0], [0, 2], [1, 1]]) == 3
+    results = index.search([1, 0.1], k=2)
+    assert [message_id for message_id, _ in results] == ["a", "c"]
+    assert results[0][1] == pytest.approx(0.995, abs=0.001)
+    assert [message_id for message_id, _ in index.search([1, 0.1], k=2, exclude_ids=["a"])] == ["c", "b"]
+
+
+def test_rows_are_added_once_and_survive_a_reopen(tmp_path):
+    index = VectorIndex(str(tmp_path / "vectors"))
+    index.add(["a", "b"], [[1, 0], [0, 1]])
+    assert index.add(["a", "c", "c"], [[1, 0], [1, 1], [1, 1]]) == 1
+    assert index.missing(["a", "c", "d"]) == ["d"]
+    index.close()
+
+    reopened = VectorIndex(str(tmp_path / "vectors"))
+    assert reopened.ids == ["a", "b", "c"]
+    with pytest.raises(ValueError):
+        reopened.add(["d"], [[1, 0, 0]])
+
+
+def test_crash_between_vectors_and_ids_is_repaired(tmp_path):
+    index = VectorIndex(str(tmp_path / "vectors"))
+    index.add(["a", "b"], [[1, 0], [0, 1]])
+    # the vector of a third row was written, its id wasn't
+    with open(index.vectors_path, "ab") as f:
+        f.write(b"\0" * 8)
+    index.close()
+    reopened = VectorIndex(str(tmp_path / "vectors"))
+    assert len(reopened) == 2
+    assert reopened.add(["c"], [[1, 1]]) == 1
+    reopened.close()
+    assert VectorIndex(str(tmp_path / "vectors")).ids == ["a", "b", "c"]
+
+
+def test_second_writer_is_refused_and_leaves_the_files_alone(tmp_path):
+    writer = VectorIndex(str(tmp_path / "vectors"))
+    writer.add(["a", "b"], [[1, 0], [0, 1]])
+    # the writer is between appending a vector and its id
+    with open(writer.vectors_path, "ab") as f:
+        f.write(b"\0" * 8)
+    with pytest.raises(RuntimeError):
+        VectorIndex(str(tmp_path / "vectors"))
+    assert writer._vector_rows() == 3
+
+    writer.close()
+    assert len(VectorIndex(str(tmp_path / "vectors"))) == 2
+
+
+def test_read_only_index_refreshes_complete_rows(tmp_path):
+    writer = VectorIndex(str(tmp_path / "vectors"))
+    reader = VectorIndex(str(tmp_path / "vectors"), read_only=True)
+    assert len(reader) == 0
+    writer.add(["a"], [[1, 0]])
+    assert reader.refresh() == 1
+
+    writer.add(["b"], [[0, 1]])
+    # an id the writer is still appending
+    with open(writer.ids_path, "a") as f:
+        f.write("partial")
+    assert reader.refresh() == 1
+    assert reader.ids == ["a", "b"]
+    assert [message_id for message_id, _ in reader.search([0, 1], k=1)] == ["b"]
+    with pytest.raises(ValueError):
+        reader.add(["c"], [[1, 1]])
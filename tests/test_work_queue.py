@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+from sqlmodel import Session, select
+
+from messaging_manager.libs.database_models import DraftQueueItem
+from messaging_manager.libs.work_queue import DraftWorkQueue
+
+
+def mark(queue, engine, source_ids):
+    with Session(engine) as session:
+        queue.mark_dirty(session, source_ids)
+        session.commit()
+
+
+def get_item(engine, source_id):
+    with Session(engine) as session:
+        return session.exec(select(DraftQueueItem).where(DraftQueueItem.source_id == source_id)).first()
+
+
+def expire_lease(engine, source_id):
+    with Session(engine) as session:
+        item = session.exec(select(DraftQueueItem).where(DraftQueueItem.source_id == source_id)).one()
+        item.lease_expires_at = datetime.now() - timedelta(seconds=1)
+        session.add(item)
+        session.commit()
+
+
+def test_mark_dirty_bumps_the_version_of_queued_conversations(engine):
+    queue = DraftWorkQueue(engine)
+    mark(queue, engine, ["a", "b"])
+    mark(queue, engine, ["a"])
+    assert get_item(engine, "a").version == 2
+    assert get_item(engine, "b").version == 1
+
+
+def test_claim_gives_a_conversation_to_one_worker(engine):
+    queue = DraftWorkQueue(engine)
+    mark(queue, engine, ["a", "b", "c"])
+    assert queue.claim("w1", ["a", "b"], limit=1) == ["a"]
+    assert queue.claim("w2", ["a", "b", "c"], limit=5) == ["b", "c"]
+    with Session(engine) as session:
+        assert queue.get_available(session) == []
+
+
+def test_expired_lease_can_be_claimed_again(engine):
+    queue = DraftWorkQueue(engine)
+    mark(queue, engine, ["a"])
+    assert queue.claim("w1", ["a"], limit=1) == ["a"]
+    expire_lease(engine, "a")
+    assert queue.claim("w2", ["a"], limit=1) == ["a"]
+    # the first worker lost the lease, completing does nothing
+    queue.complete("w1", "a")
+    assert get_item(engine, "a").leased_by == "w2"
+
+
+def test_complete_removes_the_claimed_version_only(engine):
+    queue = DraftWorkQueue(engine)
+    mark(queue, engine, ["a", "b"])
+    queue.claim("w1", ["a", "b"], limit=2)
+    # new messages while a is leased
+    mark(queue, engine, ["a"])
+    queue.complete("w1", "a")
+    queue.complete("w1", "b")
+    item = get_item(engine, "a")
+    assert item is not None and item.leased_by is None and item.version == 2
+    assert get_item(engine, "b") is None
+
+
+def test_release_after_an_error_backs_off(engine):
+    queue = DraftWorkQueue(engine, retry_seconds=60)
+    mark(queue, engine, ["a", "b"])
+    queue.claim("w1", ["a", "b"], limit=2)
+    queue.release("w1", "a", error="model timed out")
+    queue.release("w1", "b")
+    item = get_item(engine, "a")
+    assert item.attempts == 1 and item.leased_by is None
+    assert item.lease_expires_at > datetime.now() + timedelta(seconds=30)
+    assert queue.claim("w2", ["a", "b"], limit=2) == ["b"]
@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta
+import pytest
+from sqlmodel import Session
+
+from messaging_manager.libs.database_models import UnifiedMessageFormat
+from messaging_manager.libs.writing_samples import WritingSampleIndex
+
+START = datetime(2024, 1, 1)
+
+
+def make_message(message_id, sender_name, other_party_id, minutes, service_name="email"):
+    return UnifiedMessageFormat(message_id=message_id, service_name=service_name, source_id=f"conversation {other_party_id}",
+                                source_keys={"other_party_id": other_party_id}, message_content=f"text of {message_id}",
+                                sender_id="me" if sender_name == "user" else other_party_id, sender_name=sender_name,
+                                message_timestamp=START + timedelta(minutes=minutes))
+
+
+def add(engine, index, messages):
+    with Session(engine) as session:
+        added = index.add_messages(session, messages)
+        session.commit()
+    return added
+
+
+def sample_ids(samples):
+    return [sample.message_id for sample in samples]
+
+
+def test_samples_prefer_the_recipient_newest_first(engine):
+    index = WritingSampleIndex(engine)
+    index.load()
+    assert add(engine, index, [make_message("to bob 1", "user", "bob", 1), make_message("from bob", "Bob", "bob", 2),
+                               make_message("to ann", "user", "ann", 3), make_message("to bob 2", "user", "bob", 4),
+                               make_message("telegram", "user", "bob", 5, service_name="telegram")]) == 4
+    assert sample_ids(index.get_samples("email", "bob", k=3)) == ["to bob 2", "to bob 1", "to ann"]
+    assert sample_ids(index.get_samples("email", "bob", k=3, exclude_ids=["to bob 2"])) == ["to bob 1", "to ann"]
+
+
+def test_adding_before_load_is_refused(engine):
+    with pytest.raises(RuntimeError):
+        add(engine, WritingSampleIndex(engine), [make_message("to bob", "user", "bob", 1)])
+
+
+def test_first_load_backfills_from_stored_messages(engine):
+    with Session(engine) as session:
+        session.add_all([make_message("to bob", "user", "bob", 1), make_message("from bob", "Bob", "bob", 2)])
+        session.commit()
+    index = WritingSampleIndex(engine)
+    index.load()
+    assert sample_ids(index.get_samples("email", "bob")) == ["to bob"]
+    # a second process reads the stored samples instead of scanning messages
+    reader = WritingSampleIndex(engine)
+    reader.load()
+    assert sample_ids(reader.get_samples("email", "bob")) == ["to bob"]
+
+
+def test_refresh_picks_up_samples_of_another_process(engine):
+    writer = WritingSampleIndex(engine)
+    writer.load()
+    reader = WritingSampleIndex(engine)
+    reader.load()
+    add(engine, writer, [make_message("to bob", "user", "bob", 1)])
+    assert reader.refresh() == 1
+    assert sample_ids(reader.get_samples("email", "bob")) == ["to bob"]
+    # samples read again in the overlap window aren't duplicated
+    reader.refresh()
+    assert sample_ids(reader.get_samples("email", "bob")) == ["to bob"]
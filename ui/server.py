@@ -1,42 +1,149 @@
 from messaging_manager.libs.database_models import DraftResponse, UnifiedMessageFormat, ServiceMetadata
-from sqlmodel import create_engine, Session, SQLModel, select
-from fastapi.responses import FileResponse
-from fastapi import FastAPI, Body
+from sqlmodel import select
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi import FastAPI, Body, Request, HTTPException
 from pydantic import BaseModel
 import uvicorn
 import os
 import asyncio
-import threading
+from contextlib import asynccontextmanager, suppress
+import json
+import gzip
+import hashlib
+from datetime import datetime
 from messaging_manager.run import get_loop_manager, run_continuous_loop, LoopManager
+from messaging_manager.libs.search_index import search_messages
+from messaging_manager.libs.database import get_async_session
+from messaging_manager.libs.drafts import load_draft_messages_async, list_drafts_async
+from messaging_manager.libs.media_store import MediaStore, OBJECTS_DIR
+from messaging_manager.libs.thumbnails import ThumbnailCache, ThumbnailError, THUMBNAIL_SIZES
+from messaging_manager.libs.events import event_bus, DRAFT_STATUS_CHANGED
+from messaging_manager.libs.jobs import Job, JobQueue
+from typing import Optional
 
-app = FastAPI()
+# the api and the pipeline share one LoopManager, created when the server starts
+loop_manager: Optional[LoopManager] = None
+job_queue = JobQueue()
 
-web_dir = os.path.join(os.path.dirname(__file__), "web")
-loop_manager = get_loop_manager()
+def external_workers() -> bool:
+    """whether worker processes run the pipeline instead of the server"""
+    return os.getenv("EXTERNAL_WORKERS", "").lower() in ("1", "true", "yes")
 
-# Start the background processing loop
-def start_background_loop():
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(run_continuous_loop(interval_seconds=300))
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    runs the pipeline as a task on the server's event loop for as long as the server is up,
+    with EXTERNAL_WORKERS=true the worker processes run it instead (see messaging_manager/worker.py)
+    """
+    global loop_manager
+    if external_workers():
+        # the ingest worker writes the vector index, the server only reads it
+        loop_manager = get_loop_manager(read_only_vectors=True)
+    else:
+        loop_manager = get_loop_manager()
+    tasks = [asyncio.create_task(job_queue.run())]
+    if not external_workers():
+        tasks.append(asyncio.create_task(run_continuous_loop(loop_manager, interval_seconds=300)))
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            with suppress(asyncio.CancelledError):
+                await task
 
-# Start the background thread when the server starts
-background_thread = threading.Thread(target=start_background_loop, daemon=True)
-background_thread.start()
+app = FastAPI(lifespan=lifespan)
+
+web_dir = os.path.join(os.path.dirname(__file__), "web")
+GZIP_MINIMUM_SIZE = 1024
+EVENT_KEEPALIVE_SECONDS = 15
+media_store = MediaStore("media")
+thumbnails = ThumbnailCache(media_store)
 
 class ApproveRequest(BaseModel):
     response: str
 
+def resolve_media_path(path: str) -> str:
+    """the file a media url points at, refusing anything outside the media folder"""
+    media_root = os.path.realpath(media_store.media_dir)
+    full_path = os.path.realpath(os.path.join(media_root, path))
+    if os.path.commonpath([media_root, full_path]) != media_root or not os.path.isfile(full_path):
+        raise HTTPException(status_code=404, detail="Media file not found")
+    return full_path
+
+def cached_file_response(request: Request, path: str, etag: str, immutable: bool, media_type: str = None) -> Response:
+    """
+    FileResponse with a strong validator, starlette answers Range and If-Range from it.
+    Store objects and their thumbnails never change, everything else is revalidated.
+    """
+    headers = {"ETag": etag,
+               "Cache-Control": "public, max-age=31536000, immutable" if immutable else "no-cache"}
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, headers=headers, media_type=media_type)
+
+def get_file_etag(path: str) -> str:
+    content_hash = media_store.get_content_hash(path)
+    if content_hash is not None:
+        return f'"{content_hash}"'
+    stat = os.stat(path)
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
 @app.get("/media/{path:path}")
-async def serve_media_file(path: str):
-    return FileResponse("media/" + path)
+async def serve_media_file(request: Request, path: str):
+    full_path = resolve_media_path(path)
+    etag = get_file_etag(full_path)
+    return cached_file_response(request, full_path, etag, immutable=path.startswith(f"{OBJECTS_DIR}/"))
+
+@app.get("/thumbnails/{size}/{path:path}")
+async def serve_thumbnail(request: Request, size: str, path: str):
+    if size not in THUMBNAIL_SIZES:
+        raise HTTPException(status_code=400, detail=f"Unknown thumbnail size, use one of {', '.join(THUMBNAIL_SIZES)}")
+    full_path = resolve_media_path(path)
+    try:
+        # decoding and resizing is cpu bound, keep it off the event loop
+        thumbnail_path, source_key = await asyncio.to_thread(thumbnails.get, full_path, size)
+    except ThumbnailError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    return cached_file_response(request, thumbnail_path, f'"{source_key}-{size}"',
+                                immutable=path.startswith(f"{OBJECTS_DIR}/"))
+
+def conditional_json_response(request: Request, content) -> Response:
+    """
+    JSON with a validator and compression, for the endpoints the UI polls.
+    The etag is weak since the same representation is sent gzipped or plain.
+    """
+    body = json.dumps(jsonable_encoder(content), separators=(",", ":")).encode()
+    etag = f'W/"{hashlib.sha256(body).hexdigest()[:32]}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    if len(body) >= GZIP_MINIMUM_SIZE and "gzip" in request.headers.get("accept-encoding", ""):
+        body = gzip.compress(body, compresslevel=6)
+        headers["Content-Encoding"] = "gzip"
+    return Response(content=body, media_type="application/json", headers=headers)
 
 @app.get("/draft_responses")
-async def get_draft_responses():
-    engine = create_engine("sqlite:///messages.db")
-    with Session(engine) as session:
-        draft_responses = session.exec(select(DraftResponse).where(DraftResponse.status == "pending")).all()
-        return draft_responses
+async def get_draft_responses(request: Request, limit: int = 20, cursor: Optional[str] = None, status: str = "pending"):
+    limit = max(1, min(limit, 100))
+    async with get_async_session() as session:
+        try:
+            page = await list_drafts_async(session, status=status, limit=limit, cursor=cursor)
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    return conditional_json_response(request, page)
+
+@app.get("/draft_responses/{draft_response_id}")
+async def get_draft_response(request: Request, draft_response_id: str):
+    async with get_async_session() as session:
+        draft_response = await session.get(DraftResponse, draft_response_id)
+        if draft_response is None:
+            raise HTTPException(status_code=404, detail="Draft response not found")
+        messages_by_draft = await load_draft_messages_async(session, [draft_response_id])
+    return conditional_json_response(request, {**draft_response.model_dump(),
+                                               "messages": messages_by_draft[draft_response_id]})
 
 
 @app.post("/draft_responses/{draft_response_id}/approve")
@@ -51,25 +158,87 @@ async def approve_draft_response(draft_response_id: str, request: ApproveRequest
     
 @app.post("/draft_responses/{draft_response_id}/ignore")
 async def ignore_draft_response(draft_response_id: str):
-    engine = create_engine("sqlite:///messages.db")
-    with Session(engine) as session:
-        draft_response = session.exec(select(DraftResponse).where(DraftResponse.draft_response_id == draft_response_id)).first()
+    async with get_async_session() as session:
+        draft_response = (await session.exec(select(DraftResponse).where(DraftResponse.draft_response_id == draft_response_id))).first()
         if draft_response:
             draft_response.status = "ignored"
+            draft_response.updated_at = datetime.now()
             session.add(draft_response)
-            session.commit()
+            await session.commit()
+            event_bus.publish(DRAFT_STATUS_CHANGED, {"draft_response_id": draft_response_id, "status": "ignored"})
             return {"message": "Draft response ignored", "success": True}
         return {"message": "Draft response not found", "success": False}
 
 # Add endpoint to manually trigger message processing
-@app.post("/process_messages")
-async def process_messages():
-    try:
+async def run_process_messages_job(job: Job):
+    async with loop_manager.pipeline_lock:
         await loop_manager.pull_latest_messages()
         await loop_manager.process_messages()
-        return {"message": "Messages processed successfully", "success": True}
-    except Exception as e:
-        return {"message": f"Error processing messages: {str(e)}", "success": False}
+
+job_queue.register("process_messages", run_process_messages_job)
+
+# queues a pull and drafting pass, poll /jobs/{job_id} for its progress
+@app.post("/process_messages")
+async def process_messages():
+    if external_workers():
+        # pulling and drafting here would run the pipeline a second time next to the workers
+        raise HTTPException(status_code=409, detail="Messages are processed by the worker processes")
+    job, created = job_queue.submit("process_messages")
+    return {"message": "Message processing queued" if created else "Message processing is already queued",
+            "success": True,
+            "job_id": job.job_id,
+            "status": job.status}
+
+@app.get("/jobs")
+async def get_jobs():
+    return job_queue.recent()
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/poll_schedule")
+async def get_poll_schedule():
+    """per folder arrival rate, interval and next poll time of the background loop"""
+    if loop_manager is None or loop_manager.scheduler is None:
+        return []
+    return loop_manager.scheduler.snapshot()
+
+@app.get("/events")
+async def stream_events(request: Request):
+    """server sent events for draft and pipeline updates, the ui applies them to what it already shows"""
+    last_event_id = request.headers.get("last-event-id")
+    queue = event_bus.subscribe(int(last_event_id) if last_event_id and last_event_id.isdigit() else None)
+
+    async def event_stream():
+        try:
+            # tells the browser how long to wait before reconnecting
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=EVENT_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    # comment line, keeps proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+                    continue
+                yield event.to_sse()
+        finally:
+            event_bus.unsubscribe(queue)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/search")
+async def search(q: str, limit: int = 20, offset: int = 0, service_name: Optional[str] = None):
+    limit = max(1, min(limit, 100))
+    offset = max(0, offset)
+    async with get_async_session() as session:
+        # the fts query helpers are synchronous, run_sync executes them on the async connection
+        return await session.run_sync(lambda sync_session: search_messages(sync_session, q, limit=limit, offset=offset,
+                                                                           service_name=service_name))
 
 # serve files from the static web directory
 @app.get("/")